@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the amount conversions: the previous Decimal based helpers against adapter.amounts.
+
+Run from the repository root:
+
+    python benchmarks/amounts.py [--outputs 2000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from adapter import amounts  # noqa: E402
+
+
+def legacy_to_cents(amount: Decimal, divisibility: int) -> int:
+    return int(amount * Decimal('10')**Decimal(divisibility))
+
+
+def legacy_from_cents(amount: int, divisibility: int) -> Decimal:
+    return Decimal(amount) / Decimal('10')**Decimal(divisibility)
+
+
+def legacy_sum_outputs(outputs, address):
+    total = Decimal('0')
+    for o in outputs:
+        for output_address in tuple(o['addresses']):
+            if output_address == address:
+                total += legacy_from_cents(o['value'], 8)
+    return total
+
+
+def make_outputs(count: int, address: str):
+    addresses = [address] + ['1Other%s' % i for i in range(9)]
+    return [{'addresses': [random.choice(addresses)], 'value': random.randint(1, 10 ** 8)} for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--outputs', type=int, default=2000, help='Outputs in the summed transaction.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=100000, help='Calls per conversion timing.')
+    args = parser.parse_args()
+
+    random.seed(0)
+    address = '1Recipient'
+    outputs = make_outputs(args.outputs, address)
+    value, units = Decimal('1.23456789'), 123456789
+
+    # Both implementations must agree before timing them:
+    assert legacy_sum_outputs(outputs, address) == amounts.from_units(amounts.sum_outputs(outputs, address), 8)
+    assert legacy_to_cents(value, 8) == amounts.to_units(value, 8)
+    assert legacy_from_cents(units, 8) == amounts.from_units(units, 8)
+
+    cases = [
+        ('to_cents', lambda: legacy_to_cents(value, 8), lambda: amounts.to_units(value, 8), args.number),
+        ('from_cents', lambda: legacy_from_cents(units, 8), lambda: amounts.from_units(units, 8), args.number),
+        ('sum %s outputs' % args.outputs, lambda: legacy_sum_outputs(outputs, address),
+         lambda: amounts.from_units(amounts.sum_outputs(outputs, address), 8), max(args.number // args.outputs, 10)),
+    ]
+
+    print('%-20s %14s %14s %8s' % ('case', 'legacy (us)', 'amounts (us)', 'speedup'))
+    for name, legacy, new, number in cases:
+        legacy_time = min(timeit.repeat(legacy, number=number, repeat=args.repeat)) / number * 1e6
+        new_time = min(timeit.repeat(new, number=number, repeat=args.repeat)) / number * 1e6
+        print('%-20s %14.3f %14.3f %7.1fx' % (name, legacy_time, new_time, legacy_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
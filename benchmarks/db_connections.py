@@ -0,0 +1,91 @@
+"""
+Per-request database latency benchmark: replays the request cycle (request_started, a query, request_finished)
+with new connections per request (CONN_MAX_AGE=0), persistent connections and persistent connections with
+health checks on every request, reporting latency percentiles. Point it at PgBouncer to compare pooling.
+
+Needs psycopg2 and a Postgres (or PgBouncer) reachable with the adapter's POSTGRES_* environment variables.
+Run from the repository root:
+
+    python benchmarks/db_connections.py [--requests 2000] [--host localhost] [--port 5432]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from django.conf import settings  # noqa: E402
+
+MODES = (
+    ('new connection per request', 0, None),
+    ('persistent', 60, 30),
+    ('persistent, checked per request', 60, 0),
+)
+
+
+def configure(host: str, port: str):
+    settings.configure(
+        DATABASES={'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': os.environ.get('POSTGRES_DB', 'postgres'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'postgres'),
+            'HOST': host,
+            'PORT': port,
+        }},
+        USE_TZ=True,
+    )
+    import django
+    django.setup()
+
+
+def run(requests: int, conn_max_age: int, health_check_interval) -> list:
+    from django.core.signals import request_finished, request_started
+    from django.db import connection
+
+    from adapter import db
+
+    connection.close()
+    connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+    settings.ADAPTER_DB_HEALTH_CHECK_INTERVAL = health_check_interval if health_check_interval is not None else 30
+
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        request_started.send(sender=None)
+        if health_check_interval is not None:
+            db.check_connections()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        request_finished.send(sender=None)
+        db.mark_healthy()
+        timings.append((time.perf_counter() - start) * 1000)
+    connection.close()
+    return timings
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--host', default=os.environ.get('POSTGRES_PORT_5432_TCP_ADDR', 'localhost'))
+    parser.add_argument('--port', default=os.environ.get('POSTGRES_1_PORT_5432_TCP_PORT', '5432'))
+    args = parser.parse_args()
+
+    configure(args.host, args.port)
+    print('%-34s %10s %10s %10s' % ('mode', 'mean ms', 'p50 ms', 'p95 ms'))
+    for name, conn_max_age, health_check_interval in MODES:
+        timings = run(args.requests, conn_max_age, health_check_interval)
+        print('%-34s %10.3f %10.3f %10.3f' % (name, statistics.mean(timings), percentile(timings, 0.5),
+                                              percentile(timings, 0.95)))
+
+
+if __name__ == '__main__':
+    main()
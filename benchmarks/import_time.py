@@ -0,0 +1,89 @@
+"""
+Cold start benchmark of the process roles: starts a fresh interpreter per run that sets Django up with the role's
+settings profile (ADAPTER_ROLE) and imports what the role serves, reporting the median startup time and the
+slowest top level imports (from `python -X importtime`).
+
+Needs the adapter's requirements and environment variables (or src/config/.local.env). Run from the repository
+root:
+
+    python benchmarks/import_time.py [--runs 5] [--roles web webhook-ingress worker] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# What each role imports on startup, after django.setup():
+ROLES = {
+    'web': 'from django.conf import settings; import importlib; importlib.import_module(settings.ROOT_URLCONF)',
+    'admin': 'from django.conf import settings; import importlib; importlib.import_module(settings.ROOT_URLCONF)',
+    'webhook-ingress': 'from django.conf import settings; import importlib; '
+                       'importlib.import_module(settings.ROOT_URLCONF)',
+    'worker': 'import config.celery, adapter.tasks',
+    'relay': 'import adapter.outbox',
+}
+
+
+def command(role: str) -> list:
+    return [sys.executable, '-c', 'import django; django.setup(); %s' % ROLES[role]]
+
+
+def environment(role: str) -> dict:
+    env = dict(os.environ, ADAPTER_ROLE=role)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    return env
+
+
+def startup(role: str) -> float:
+    """
+    Returns the wall time in ms of starting a process of the role, interpreter startup included.
+    """
+    start = time.perf_counter()
+    subprocess.run(command(role), cwd=SRC, env=environment(role), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def slowest_imports(role: str, top: int) -> list:
+    """
+    Returns the `top` slowest top level imports of the role as (cumulative ms, module).
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + command(role)[1:], cwd=SRC,
+                            env=environment(role), check=True, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # Nested imports are indented, they are part of their parent's cumulative time:
+        if not module[1:].startswith(' '):
+            imports.append((int(cumulative) / 1000, module.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--roles', nargs='+', choices=sorted(ROLES), default=['web', 'webhook-ingress', 'worker'])
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    print('%-16s %10s %10s %10s' % ('role', 'median ms', 'min ms', 'max ms'))
+    for role in args.roles:
+        startup(role)  # Warms the file system cache and writes the .pyc files.
+        timings = [startup(role) for _ in range(args.runs)]
+        print('%-16s %10.1f %10.1f %10.1f' % (role, statistics.median(timings), min(timings), max(timings)))
+
+    for role in args.roles:
+        print('\nSlowest imports of %s:' % role)
+        for cumulative, module in slowest_imports(role, args.top):
+            print('%10.1f ms  %s' % (cumulative, module))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""
+Stand-in WSGI app for the load test harness: each request waits LOAD_IO_MS on I/O (like the adapter's calls to
+BlockCypher, Rehive and Postgres) and burns LOAD_CPU_MS of CPU (like request handling and rendering).
+"""
+import os
+import time
+
+IO_SECONDS = float(os.environ.get('LOAD_IO_MS', 200)) / 1000
+CPU_SECONDS = float(os.environ.get('LOAD_CPU_MS', 2)) / 1000
+
+
+def application(environ, start_response):
+    time.sleep(IO_SECONDS)  # Cooperative under gevent's monkey patching.
+    deadline = time.perf_counter() + CPU_SECONDS
+    while time.perf_counter() < deadline:
+        pass
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [b'{}']
@@ -0,0 +1,131 @@
+"""
+Load test harness for the serving modes: runs concurrency levels against a URL and reports throughput and
+latency per level.
+
+Against a deployment (e.g. the account endpoint):
+
+    python benchmarks/load_test.py --url http://localhost:8015/api/1/ --concurrency 1 10 50 100
+
+Or with --simulate, against gunicorn serving benchmarks/load_app.py (a request waiting --io-ms on I/O and
+using --cpu-ms of CPU) with each worker class and config/gunicorn.py, from the repository root:
+
+    python benchmarks/load_test.py --simulate --worker-class sync gevent --io-ms 200 --cpu-ms 2
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def load(url: str, concurrency: int, duration: float) -> dict:
+    """
+    Runs `concurrency` clients sending requests back to back for `duration` seconds.
+    """
+    parsed = urlparse(url)
+    path = parsed.path + ('?' + parsed.query if parsed.query else '')
+    timings, errors = [], [0]
+    lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def client():
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 500
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                ok = False
+            with lock:
+                if ok:
+                    timings.append(time.perf_counter() - start)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Requests in flight at the deadline still complete, so divide by the time until the last one did:
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    count = len(timings)
+    return {
+        'rps': count / elapsed,
+        'p50_ms': timings[count // 2] * 1000 if count else 0,
+        'p95_ms': timings[min(int(count * 0.95), count - 1)] * 1000 if count else 0,
+        'errors': errors[0],
+    }
+
+
+def report(label: str, levels, url: str, duration: float):
+    for concurrency in levels:
+        result = load(url, concurrency, duration)
+        print('%-10s %12s %10.1f %10.1f %10.1f %8s' % (label, concurrency, result['rps'], result['p50_ms'],
+                                                       result['p95_ms'], result['errors']))
+
+
+def serve(worker_class: str, port: int, args) -> subprocess.Popen:
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, LOAD_IO_MS=str(args.io_ms),
+               LOAD_CPU_MS=str(args.cpu_ms), PYTHONPATH=os.pathsep.join(filter(None, [
+                   os.path.join(ROOT, 'benchmarks'), os.environ.get('PYTHONPATH')])))
+    if args.workers:
+        env['GUNICORN_WORKERS'] = str(args.workers)
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'load_app:application',
+                                '--config', 'file:%s' % os.path.join(ROOT, 'src', 'config', 'gunicorn.py'),
+                                '--bind', '127.0.0.1:%s' % port, '--log-level', 'warning'],
+                               env=env, cwd=ROOT)
+    # Wait until it accepts requests:
+    for _ in range(100):
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url')
+    parser.add_argument('--simulate', action='store_true')
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--workers', type=int, help='Overrides the gunicorn worker count.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--io-ms', type=float, default=200)
+    parser.add_argument('--cpu-ms', type=float, default=2)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    print('%-10s %12s %10s %10s %10s %8s' % ('workers', 'concurrency', 'req/s', 'p50 ms', 'p95 ms', 'errors'))
+    if not args.simulate:
+        report('-', args.concurrency, args.url, args.duration)
+        return
+
+    for worker_class in args.worker_class:
+        process = serve(worker_class, args.port, args)
+        try:
+            report(worker_class, args.concurrency, 'http://127.0.0.1:%s/' % args.port, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
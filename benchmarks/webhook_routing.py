@@ -0,0 +1,102 @@
+"""
+Routing benchmark of the sharded webhook queues: simulates a single consumer per shard queue and measures
+webhook throughput by shard count, checking that the events of each transaction stay in order.
+
+Run from the repository root:
+
+    python benchmarks/webhook_routing.py [--shards 1 2 4 8] [--transactions 400] [--work-ms 2]
+"""
+import argparse
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from django.conf import settings  # noqa: E402
+
+TASK = 'adapter.tasks.process_webhook_receive'
+
+
+def make_events(transactions: int, accounts: int):
+    """
+    A creation (0 confirmations) and a confirmation event per transaction, interleaved across transactions.
+    """
+    events = []
+    for i in range(transactions):
+        tx_hash = '%064x' % random.getrandbits(256)
+        receive_id = random.randint(1, accounts)
+        events.append({'receive_id': receive_id, 'data': {'hash': tx_hash, 'confirmations': 0}})
+        events.append({'receive_id': receive_id, 'data': {'hash': tx_hash, 'confirmations': 1}})
+    # Keep each transaction's events in order while interleaving transactions:
+    random.shuffle(events)
+    seen = set()
+    for event in events:
+        tx_hash = event['data']['hash']
+        event['data']['confirmations'] = 1 if tx_hash in seen else 0
+        seen.add(tx_hash)
+    return events
+
+
+def run(shard_count: int, events, work: float):
+    from adapter.routers import TaskRouter
+
+    settings.ADAPTER_TASK_SHARDS[TASK] = shard_count
+    router = TaskRouter()
+    queues, processed, lock = {}, {}, threading.Lock()
+    errors = []
+
+    for event in events:
+        name = router.route_for_task(TASK, kwargs=event)['queue']
+        queues.setdefault(name, queue.Queue()).put(event)
+
+    def consume(q):
+        while True:
+            try:
+                event = q.get_nowait()
+            except queue.Empty:
+                return
+            time.sleep(work)  # Database and Rehive work of one webhook.
+            tx_hash, confirmations = event['data']['hash'], event['data']['confirmations']
+            with lock:
+                if confirmations and tx_hash not in processed:
+                    errors.append(tx_hash)  # Confirmation processed before the creation.
+                processed[tx_hash] = confirmations
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=consume, args=(q,)) for q in queues.values()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return len(events) / elapsed, len(queues), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--transactions', type=int, default=400)
+    parser.add_argument('--accounts', type=int, default=1000)
+    parser.add_argument('--work-ms', type=float, default=2, help='Simulated processing time per webhook.')
+    args = parser.parse_args()
+
+    settings.configure(HOST_NAME='bench', ADAPTER_COINS=['XBT'],
+                       ADAPTER_TASK_QUEUES={TASK: 'webhooks'}, ADAPTER_TASK_SHARDS={TASK: 1})
+    random.seed(0)
+    events = make_events(args.transactions, args.accounts)
+
+    baseline = None
+    print('%8s %8s %14s %10s %16s' % ('shards', 'queues', 'webhooks/s', 'scaling', 'order violations'))
+    for shard_count in args.shards:
+        throughput, queue_count, errors = run(shard_count, events, args.work_ms / 1000)
+        baseline = baseline or throughput / shard_count
+        print('%8s %8s %14.1f %9.2fx %16s' % (shard_count, queue_count, throughput,
+                                             throughput / baseline, len(errors)))
+
+
+if __name__ == '__main__':
+    main()
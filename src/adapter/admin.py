@@ -1,6 +1,11 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 
-from .models import UserAccount, AdminAccount, ReceiveWebhook, ReceiveTransaction, SendTransaction
+from .managers import estimated_count
+from .models import UserAccount, AdminAccount, ReceiveWebhook, ReceiveTransaction, ReceiveTransactionTransition, \
+    SendTransaction, OutboxMessage
 
 
 class CustomModelAdmin(admin.ModelAdmin):
@@ -9,6 +14,50 @@ class CustomModelAdmin(admin.ModelAdmin):
         super(CustomModelAdmin, self).__init__(model, admin_site)
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts up to max_count rows. Larger unfiltered lists use the planner's row estimate, which is 0 before the
+    table is analyzed and lags behind inserts, so it is never lower than the capped count.
+    """
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        count = self.object_list[:self.max_count].count()
+        if count < self.max_count or self.object_list.query.where:
+            return count
+        return max(estimated_count(self.object_list.model), count)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Loads only the summary columns and adds a keyset "next page" link (id__lt=<last id>),
+    so paging deep into large tables doesn't need an OFFSET scan.
+    """
+    def get_queryset(self, request):
+        return super(KeysetChangeList, self).get_queryset(request).summary()
+
+    def get_results(self, request):
+        super(KeysetChangeList, self).get_results(request)
+        self.next_page_query = None
+
+        results = list(self.result_list)
+        if ORDER_VAR not in self.params and len(results) == self.list_per_page:
+            self.next_page_query = self.get_query_string({'id__lt': results[-1].pk}, [PAGE_VAR])
+
+
+class TransactionAdmin(admin.ModelAdmin):
+    change_list_template = 'admin/adapter/transaction_change_list.html'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+    list_filter = ('status', 'currency', 'created')
+    search_fields = ('=external_id', '=rehive_code')
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
 class UserAccountAdmin(CustomModelAdmin):
     pass
 
@@ -21,14 +70,37 @@ class ReceiveWebhookAdmin(CustomModelAdmin):
     pass
 
 
-class ReceiveTransactionAdmin(CustomModelAdmin):
+class OutboxMessageAdmin(CustomModelAdmin):
     pass
 
-class SendTransactionAdmin(CustomModelAdmin):
-    pass
+
+class ReceiveTransactionAdmin(TransactionAdmin):
+    list_display = ('id', 'external_id', 'rehive_code', 'user', 'amount', 'currency', 'status', 'created')
+    raw_id_fields = ('user_account',)
+    readonly_fields = ('data', 'rehive_response', 'metadata')
+
+    def user(self, obj):
+        return obj.user_account.rehive_id
+
+class ReceiveTransactionTransitionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'transaction_id', 'from_status', 'to_status', 'created', 'cause')
+    raw_id_fields = ('transaction',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+class SendTransactionAdmin(TransactionAdmin):
+    list_display = ('id', 'external_id', 'rehive_code', 'recipient', 'amount', 'currency', 'status', 'created',
+                    'account')
+    raw_id_fields = ('admin_account',)
+    readonly_fields = ('data', 'rehive_request', 'metadata')
+
+    def account(self, obj):
+        return obj.admin_account.name
 
 admin.site.register(SendTransaction, SendTransactionAdmin)
 admin.site.register(ReceiveTransaction, ReceiveTransactionAdmin)
+admin.site.register(ReceiveTransactionTransition, ReceiveTransactionTransitionAdmin)
 admin.site.register(UserAccount, UserAccountAdmin)
 admin.site.register(AdminAccount, AdminAccountAdmin)
 admin.site.register(ReceiveWebhook, ReceiveWebhookAdmin)
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
@@ -0,0 +1,138 @@
+from decimal import Decimal
+
+from .exceptions import InvalidAmountError
+
+# Amounts are handled as integers in the smallest unit (e.g. satoshis for divisibility 8), and only converted
+# to Decimal at the edges. Conversions never round: values that don't fit the divisibility are rejected.
+
+MAX_DIVISIBILITY = 18  # Scale of MoneyField.
+
+# Scale factors per divisibility, computed once:
+SCALES = tuple(10 ** d for d in range(MAX_DIVISIBILITY + 1))
+DECIMAL_SCALES = tuple(Decimal(scale) for scale in SCALES)
+
+
+def _check_divisibility(divisibility: int):
+    if not 0 <= divisibility <= MAX_DIVISIBILITY:
+        raise InvalidAmountError('Divisibility must be between 0 and %s.' % MAX_DIVISIBILITY)
+
+
+def parse_units(value) -> int:
+    """
+    Accepts an int, or a string or Decimal holding a whole number of units.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            value = Decimal(value.strip())
+        except ArithmeticError:
+            raise InvalidAmountError('Invalid amount: %r' % value)
+    if isinstance(value, Decimal) and value.is_finite() and value == value.to_integral_value():
+        return int(value)
+    raise InvalidAmountError('Amount must be a whole number of units: %r' % (value,))
+
+
+def to_units(value, divisibility: int) -> int:
+    """
+    Converts a decimal amount (Decimal, int or numeric string) to units. Floats are rejected.
+    """
+    _check_divisibility(divisibility)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value * SCALES[divisibility]
+    if isinstance(value, str):
+        try:
+            value = Decimal(value.strip())
+        except ArithmeticError:
+            raise InvalidAmountError('Invalid amount: %r' % value)
+    if not isinstance(value, Decimal) or not value.is_finite():
+        raise InvalidAmountError('Invalid amount: %r' % (value,))
+
+    units = value * DECIMAL_SCALES[divisibility]
+    if units != units.to_integral_value():
+        raise InvalidAmountError('%s has more than %s decimal places.' % (value, divisibility))
+    return int(units)
+
+
+def from_units(units: int, divisibility: int) -> Decimal:
+    _check_divisibility(divisibility)
+    return Decimal(parse_units(units)).scaleb(-divisibility)
+
+
+def sum_outputs(outputs, address: str) -> int:
+    """
+    Sums the values (in units) of the transaction outputs paying to an address, without any Decimal arithmetic.
+    """
+    total = 0
+    for output in outputs:
+        addresses = output.get('addresses') or ()
+        # Bitcoin outputs usually have one address, but the API returns a list
+        if len(addresses) > 1:
+            raise InvalidAmountError('Bitcoin output has multiple addresses')
+        if addresses and addresses[0] == address:
+            total += output['value']
+    return total
+
+
+class Amount:
+    """
+    Immutable amount: an integer number of units with its divisibility, e.g. Amount(150000000, 8) is 1.5 BTC.
+    """
+    __slots__ = ('units', 'divisibility')
+
+    def __init__(self, units, divisibility: int = 8):
+        _check_divisibility(divisibility)
+        object.__setattr__(self, 'units', parse_units(units))
+        object.__setattr__(self, 'divisibility', divisibility)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Amount is immutable')
+
+    @classmethod
+    def from_decimal(cls, value, divisibility: int = 8) -> 'Amount':
+        return cls(to_units(value, divisibility), divisibility)
+
+    def to_decimal(self) -> Decimal:
+        return Decimal(self.units).scaleb(-self.divisibility)
+
+    def _check_compatible(self, other: 'Amount'):
+        if not isinstance(other, Amount) or other.divisibility != self.divisibility:
+            raise InvalidAmountError('Cannot combine amounts with different divisibility.')
+
+    def __add__(self, other: 'Amount') -> 'Amount':
+        self._check_compatible(other)
+        return Amount(self.units + other.units, self.divisibility)
+
+    def __sub__(self, other: 'Amount') -> 'Amount':
+        self._check_compatible(other)
+        return Amount(self.units - other.units, self.divisibility)
+
+    def __neg__(self) -> 'Amount':
+        return Amount(-self.units, self.divisibility)
+
+    def __eq__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return (self.units, self.divisibility) == (other.units, other.divisibility)
+
+    def __lt__(self, other: 'Amount') -> bool:
+        self._check_compatible(other)
+        return self.units < other.units
+
+    def __hash__(self):
+        return hash((self.units, self.divisibility))
+
+    def __int__(self):
+        return self.units
+
+    def __bool__(self):
+        return self.units != 0
+
+    def __str__(self):
+        if not self.divisibility:
+            return str(self.units)
+        whole, fraction = divmod(abs(self.units), SCALES[self.divisibility])
+        return '%s%d.%0*d' % ('-' if self.units < 0 else '', whole, self.divisibility, fraction)
+
+    def __repr__(self):
+        return 'Amount(%s, %s)' % (self.units, self.divisibility)
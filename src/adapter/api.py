@@ -1,12 +1,13 @@
 from logging import getLogger
 
-import requests
 from django.conf import settings
 
-from .utils import to_cents
+from . import cache, clients, fees
+from .resilience import protect
 
 logger = getLogger('django')
-import bitcoin, blockcypher
+# The bitcoin and blockcypher libraries are imported where they are used: they are slow to import
+# and most processes (webhook ingress, Rehive upload workers) never need them.
 from urllib.parse import urlparse, urlencode, urljoin
 from django.contrib.sites.shortcuts import get_current_site
 
@@ -55,12 +56,17 @@ class AbstractBaseInteface:
 
 class Interface(AbstractBaseInteface):
     """
-    Bitcoin Interface
+    Bitcoin Interface, for Bitcoin and the other coins BlockCypher supports (see adapter.coins).
     """
+    @property
+    def coin(self):
+        return self.account.coin
+
     def _get_private_key(self):
         """
         Get the private key associated with the admin account.
         """
+        import bitcoin
         if self.account.secret.get('seed'):
             seed = self.account.secret.get('seed')
             index = self.account.secret.get('current_index', 0)  # last used primary index.
@@ -70,33 +76,38 @@ class Interface(AbstractBaseInteface):
             raise NotImplementedError('Account does not have valid seed')
 
     def get_user_account_id(self):
+        import bitcoin
         if self.account.secret.get('mpk'):
             mpk = self.account.secret.get('mpk')
-            idx = self.account.secret.get('current_index')
+            # Incremented in the database, so that concurrent workers never derive the same address:
+            idx = type(self.account).objects.allocate_index(self.account.id)
+            self.index = idx
             pubkey = bitcoin.electrum_pubkey(mpk, idx)
-            address = bitcoin.pubtoaddr(pubkey)
-
-            if 'current_index' in self.account.secret:
-                self.account.secret['current_index'] += 1
-            else:
-                self.account.secret['current_index'] = 0
-
-            self.account.save()
+            address = bitcoin.pubtoaddr(pubkey, self.coin.magicbyte)
+            self.account.secret['current_index'] = 0 if idx is None else idx + 1
             return address
         else:
             raise NotImplementedError('Account does not have valid MPK')
 
     def get_account_id(self):
+        # Deriving the address is slow EC math, cache it per account and key index:
+        index = self.account.secret.get('current_index', 0)
+        return cache.get_or_set('operating_address', '%s:%s' % (self.account.id, index), self._derive_account_id)
+
+    def _derive_account_id(self):
         # TODO: switch to compressed address
+        import bitcoin
         privkey = self._get_private_key()
         pubkey = bitcoin.privkey_to_pubkey(privkey)
-        address = bitcoin.pubtoaddr(pubkey)
+        address = bitcoin.pubtoaddr(pubkey, self.coin.magicbyte)
         return address
 
     def send(self, tx):
-        logger.info('Creating bitcoin send transaction...')
+        import bitcoin
+        import blockcypher
+        logger.info('Creating %s send transaction...' % self.coin.code)
 
-        to_satoshis = to_cents(tx.amount, 8)
+        to_satoshis = tx.amount  # Stored in satoshis.
 
         # Private Key, Public Key and Address
         from_privkey = self._get_private_key()
@@ -110,18 +121,28 @@ class Interface(AbstractBaseInteface):
         logger.info('inputs: %s' % inputs)
         logger.info('outputs: %s' % outputs)
 
+        # Fee priority: BlockCypher sets the fee from the tier's current rate.
+        tier, fee_per_kb = fees.select_tier((tx.metadata or {}).get('fee_tier'), self.coin)
+        logger.info('fee tier: %s (%s satoshis/kB)' % (tier, fee_per_kb))
+
         # Unsigned Transaction:
-        unsigned_tx = blockcypher.create_unsigned_tx(
-            inputs=inputs,
-            outputs=outputs,
-            change_address=change_address,
-            coin_symbol='btc',
-            verify_tosigntx=False,  # will verify in next step
-            include_tosigntx=True,
-            api_key=settings.BLOCKCYPHER_TOKEN,
-        )
+        with protect('blockcypher'):
+            unsigned_tx = blockcypher.create_unsigned_tx(
+                inputs=inputs,
+                outputs=outputs,
+                change_address=change_address,
+                coin_symbol=self.coin.symbol,
+                verify_tosigntx=False,  # will verify in next step
+                include_tosigntx=True,
+                preference=tier,
+                api_key=settings.BLOCKCYPHER_TOKEN,
+            )
         logger.info('unsigned_tx: %s' % unsigned_tx)
 
+        # BlockCypher sets the fee from its own rate for the tier, so the cap is checked on the actual fee:
+        skeleton = unsigned_tx['tx']
+        fees.check_fee(skeleton['fees'], fees.estimate_size(len(skeleton['inputs']), len(skeleton['outputs'])))
+
         # Verify Transaction
         tx_is_correct, err_msg = blockcypher.verify_unsigned_tx(
             unsigned_tx=unsigned_tx,
@@ -129,7 +150,7 @@ class Interface(AbstractBaseInteface):
             outputs=outputs,
             sweep_funds=bool(to_satoshis == -1),
             change_address=change_address,
-            coin_symbol='btc',
+            coin_symbol=self.coin.symbol,
         )
 
         if not tx_is_correct:
@@ -153,12 +174,14 @@ class Interface(AbstractBaseInteface):
         logger.info('tx_signatures: %s' % tx_signatures)
 
         # Broadcast transaction:
-        broadcasted_tx = blockcypher.broadcast_signed_transaction(
-            unsigned_tx=unsigned_tx,
-            signatures=tx_signatures,
-            pubkeys=pubkey_list,
-            coin_symbol='btc',
-        )
+        tx.broadcasting = True  # From here on the send may have reached the network.
+        with protect('blockcypher'):
+            broadcasted_tx = blockcypher.broadcast_signed_transaction(
+                unsigned_tx=unsigned_tx,
+                signatures=tx_signatures,
+                pubkeys=pubkey_list,
+                coin_symbol=self.coin.symbol,
+            )
         logger.info('broadcasted_tx: %s' % broadcasted_tx)
 
         if 'errors' in broadcasted_tx:
@@ -176,8 +199,14 @@ class Interface(AbstractBaseInteface):
         return tx_hash
 
     def get_balance(self):
+        address = self.get_account_id()
+        return cache.get_or_set('balance', address, lambda: self._fetch_balance(address))
+
+    def _fetch_balance(self, address: str):
+        import blockcypher
         api_key = getattr(settings, 'BLOCKCYPHER_TOKEN')
-        return blockcypher.get_total_balance(self.get_account_id(), api_key=api_key)
+        with protect('blockcypher'):
+            return blockcypher.get_total_balance(address, coin_symbol=self.coin.symbol, api_key=api_key)
 
 
 class AbstractReceiveWebhookInterfaceBase:
@@ -193,109 +222,85 @@ class AbstractReceiveWebhookInterfaceBase:
 
 
 class WebhookReceiveInterface(AbstractReceiveWebhookInterfaceBase):
-    def blockcypher_receive_unconfirmed(self):
-        from .models import ReceiveWebhook
-        api_key = settings.BLOCKCYPHER_TOKEN
-        # base_url = urljoin(BASE_URL, 'unconfirmed')
+    # Callback paths of the BlockCypher events, below /api/1/hooks/:
+    EVENTS = {'unconfirmed-tx': 'unconfirmed', 'tx-confirmation': 'confirmations', 'tx-confidence': 'confidence'}
+    # Events every user account is subscribed to. The confirmations hook also posts the unconfirmed tx.
+    SUBSCRIBED_EVENTS = ('tx-confidence', 'tx-confirmation')
+    EVENT_DATA = {'tx-confidence': {'confidence': 0.99}}
+
+    @staticmethod
+    def callback_base_url() -> str:
+        # TODO: Remove hardcoded SITE_URL
         request = None
-        base_url = ''.join(['https://', get_current_site(request).domain, '/api/1', '/hooks', '/unconfirmed/'])
+        return ''.join(['https://', get_current_site(request).domain, '/api/1', '/hooks/'])
 
+    def callback_url(self, event: str) -> str:
+        base_url = self.callback_base_url() + self.EVENTS[event] + '/'
         # ID is used to keep track of user or tx for which transactions are being monitored:
-        params = {'id': self.account.id}
-        callback_url = base_url + ('&', '?')[urlparse(base_url).query == ''] + urlencode(params)
+        params = {'id': self.account.id, 'currency': self.account.currency}
+        return base_url + ('&', '?')[urlparse(base_url).query == ''] + urlencode(params)
 
-        url = 'https://api.blockcypher.com/v1/btc/main/hooks'
-        params = {
-            'secret': 'secret'  # TODO: set proper secret
-        }
-
-        data = {'event': 'unconfirmed-tx',
-                'url': callback_url,
-                'address': self.account.account_id,
-                'token': api_key}
-
-        res = requests.post(url, params=params, json=data, verify=True)
-        webhook_id = res.json()['id']
-
-        ReceiveWebhook.objects.create(user_account=self.account,
-                                      webhook_type='unconfirmed-tx',
-                                      webhook_id=webhook_id,
-                                      callback_url=callback_url)
-
-    def blockcypher_receive_confirmations(self):
+    def create_hook(self, event: str, **data):
+        """
+        Creates a BlockCypher webhook for an event on the account's address and returns it as an unsaved
+        ReceiveWebhook, so that callers can save hooks in bulk.
+        """
         from .models import ReceiveWebhook
-        api_key = settings.BLOCKCYPHER_TOKEN
-        # TODO: Remove hardcoded SITE_URL
-        # base_url = urljoin(BASE_URL, 'unconfirmed')
-        request = None
-        base_url = ''.join(['https://', get_current_site(request).domain, '/api/1', '/hooks', '/confirmations/'])
-        params = {'id': self.account.id}
-        callback_url = base_url + ('&', '?')[urlparse(base_url).query == ''] + urlencode(params)
-
-        url = 'https://api.blockcypher.com/v1/btc/main/hooks'
+        callback_url = self.callback_url(event)
+        data = dict(self.EVENT_DATA.get(event, {}), **data)
+        data.update({'event': event,
+                     'url': callback_url,
+                     'address': self.account.account_id,
+                     'token': settings.BLOCKCYPHER_TOKEN})
         params = {
             'secret': 'secret'  # TODO: set proper secret
         }
 
-        data = {'event': 'tx-confirmation',
-                'url': callback_url,
-                'address': self.account.account_id,
-                'token': api_key}
-
-        res = requests.post(url, params=params, json=data, verify=True)
-        print(res.json())
+        with protect('blockcypher'):
+            res = clients.request('POST', clients.blockcypher_url('hooks', self.account.coin), params=params,
+                                  json=data, verify=True)
+        res.raise_for_status()
         webhook_id = res.json()['id']
+        logger.info('Created %s webhook %s for %s' % (event, webhook_id, self.account.account_id))
 
-        ReceiveWebhook.objects.create(user_account=self.account,
-                                      webhook_type='tx-confirmation',
-                                      webhook_id=webhook_id,
-                                      callback_url=callback_url)
+        return ReceiveWebhook(user_account=self.account,
+                              webhook_type=event,
+                              webhook_id=webhook_id,
+                              callback_url=callback_url)
 
-    def blockcypher_receive_confidence(self, confidence_factor: float = 0.99):
-        from .models import ReceiveWebhook
-        api_key = settings.BLOCKCYPHER_TOKEN
-        # TODO: Remove hardcoded SITE_URL
-        # base_url = urljoin(BASE_URL, 'confirmations')
-        request = None
-        base_url = ''.join(['https://', get_current_site(request).domain, '/api/1', '/hooks', '/confidence/'])
-        params = {'id': self.account.id}
-        callback_url = base_url + ('&', '?')[urlparse(base_url).query == ''] + urlencode(params)
-
-        url = 'https://api.blockcypher.com/v1/btc/main/hooks'
+    @staticmethod
+    def delete_hook(webhook_id: str, coin) -> bool:
+        """
+        Deletes a BlockCypher webhook. Returns False if BlockCypher doesn't know it (anymore).
+        """
+        with protect('blockcypher'):
+            res = clients.blockcypher_request('DELETE', 'hooks/' + webhook_id, coin=coin, verify=True)
+        if res.status_code == 404:
+            return False
+        res.raise_for_status()
+        return True
 
-        data = {'event': 'tx-confidence',
-                'confidence': confidence_factor,
-                'url': callback_url,
-                'address': self.account.account_id,
-                'token': api_key}
+    def blockcypher_receive_unconfirmed(self):
+        self.create_hook('unconfirmed-tx').save()
 
-        res = requests.post(url, json=data, verify=True)
-        webhook_id = res.json()['id']
-        logger.info(res.json())
-        logger.info(webhook_id)
+    def blockcypher_receive_confirmations(self):
+        self.create_hook('tx-confirmation').save()
 
-        ReceiveWebhook.objects.create(user_account=self.account,
-                                      webhook_type='tx-confidence',
-                                      webhook_id=webhook_id,
-                                      callback_url=callback_url)
+    def blockcypher_receive_confidence(self, confidence_factor: float = 0.99):
+        self.create_hook('tx-confidence', confidence=confidence_factor).save()
 
     def unsubscribe_blockcypher(self, webhook_type: str):
-        webhook_set = self.account.receivewebhook_set
-        selected_hooks = webhook_set.filter(webhook_type=webhook_type)
-
-        for hook in selected_hooks:
-            # TODO: fix manual blockcypher call:
-            logger.info(hook.webhook_id)
-            url = 'https://api.blockcypher.com/v1/btc/main/hooks/' + hook.webhook_id
-            params = {'token': settings.BLOCKCYPHER_TOKEN}
-            res = requests.delete(url=url, params=params, verify=True)
-            return res
+        for hook in self.account.receivewebhook_set.filter(webhook_type=webhook_type):
+            self.delete_hook(hook.webhook_id, self.account.coin)
+            hook.delete()
 
     def subscribe_to_all(self):
-        self.blockcypher_receive_confidence()
-        # The confirmations hook also posts the unconfirmed tx
-        self.blockcypher_receive_confirmations()
+        # Skip hooks that already exist, so that a subscription interrupted half way can be retried:
+        subscribed = set(self.account.receivewebhook_set.values_list('webhook_type', flat=True))
+        for event in self.SUBSCRIBED_EVENTS:
+            if event not in subscribed:
+                self.create_hook(event).save()
 
     def unsubscribe_from_all(self):
-        self.unsubscribe_blockcypher('unconfirmed-tx')
-        self.unsubscribe_blockcypher('tx-confidence')
+        for event in self.EVENTS:
+            self.unsubscribe_blockcypher(event)
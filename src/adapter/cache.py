@@ -0,0 +1,202 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+# Cache used for provider data and lookups that are expensive to repeat.
+#
+# Keys are namespaced and versioned: <KEY_PREFIX>:<CACHES version>:<namespace>:<namespace version>:<key>.
+# bump() invalidates a whole namespace by incrementing its version. Values are served from a small
+# in-process LRU (L1) for up to ADAPTER_CACHE_L1_TTL seconds before Redis (L2) is consulted again.
+#
+# None is never cached, as django-redis returns None when Redis is unavailable.
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread safe, size bounded in-process cache with a per-entry expiry.
+    """
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = LRUCache(getattr(settings, 'ADAPTER_CACHE_L1_SIZE', 1024), getattr(settings, 'ADAPTER_CACHE_L1_TTL', 5))
+
+# Striped locks so that only one thread per process computes a missing value:
+_stripes = [threading.Lock() for _ in range(64)]
+
+_namespaces = set()
+_namespaces_lock = threading.Lock()
+
+
+def _backend():
+    return caches['default']
+
+
+def _timeout(namespace: str):
+    return getattr(settings, 'ADAPTER_CACHE_TIMEOUTS', {}).get(namespace, 300)
+
+
+def _record(namespace: str, result: str):
+    metrics.inc('adapter_cache_requests_total', namespace=namespace, result=result)
+    if namespace not in _namespaces:
+        with _namespaces_lock:
+            if namespace not in _namespaces:
+                metrics.register_gauge('adapter_cache_hit_ratio', lambda: hit_ratio(namespace), namespace=namespace)
+                _namespaces.add(namespace)
+
+
+def hit_ratio(namespace: str) -> float:
+    hits = sum(metrics.counter_value('adapter_cache_requests_total', namespace=namespace, result=result)
+               for result in ('l1_hit', 'l2_hit'))
+    total = hits + metrics.counter_value('adapter_cache_requests_total', namespace=namespace, result='miss')
+    return hits / total if total else 0.0
+
+
+def _namespace_version(namespace: str) -> int:
+    key = 'ns:%s' % namespace
+    version = _local.get(key)
+    if version is _MISSING:
+        version = _backend().get(key) or 1
+        _local.set(key, version)
+    return version
+
+
+def version(namespace: str) -> int:
+    """
+    Current version of a namespace, changed by bump(). Can serve as a version stamp for in-process data.
+    """
+    return _namespace_version(namespace)
+
+
+def make_key(namespace: str, key) -> str:
+    return '%s:%s:%s' % (namespace, _namespace_version(namespace), key)
+
+
+def _lookup(full_key: str):
+    value = _local.get(full_key)
+    if value is not _MISSING:
+        return value, 'l1_hit'
+    value = _backend().get(full_key)
+    if value is not None:
+        _local.set(full_key, value)
+        return value, 'l2_hit'
+    return None, 'miss'
+
+
+def get(namespace: str, key, default=None):
+    value, result = _lookup(make_key(namespace, key))
+    _record(namespace, result)
+    return default if value is None else value
+
+
+def set(namespace: str, key, value, timeout: int = None):
+    if value is None:
+        return
+    timeout = _timeout(namespace) if timeout is None else timeout
+    full_key = make_key(namespace, key)
+    _backend().set(full_key, value, timeout)
+    _local.set(full_key, value, min(_local.ttl, timeout))
+
+
+def add(namespace: str, key, value, timeout: int = None):
+    """
+    Stores the value only if the key doesn't exist, atomically in Redis.
+    Returns True if stored, False if the key exists and None if Redis is unavailable.
+    """
+    timeout = _timeout(namespace) if timeout is None else timeout
+    return _backend().add(make_key(namespace, key), value, timeout)
+
+
+def delete(namespace: str, key):
+    full_key = make_key(namespace, key)
+    _backend().delete(full_key)
+    _local.delete(full_key)
+
+
+def bump(namespace: str):
+    """
+    Invalidates every key in a namespace. Other processes notice within ADAPTER_CACHE_L1_TTL seconds.
+    """
+    key = 'ns:%s' % namespace
+    backend = _backend()
+    backend.add(key, 1, None)
+    try:
+        backend.incr(key)
+    except ValueError:
+        pass
+    _local.delete(key)
+
+
+def get_or_set(namespace: str, key, compute, timeout: int = None):
+    """
+    Returns the cached value, or computes and caches it. On a miss only one caller computes the value:
+    other threads in the process wait on a lock, other processes wait for the value to appear in Redis.
+    """
+    full_key = make_key(namespace, key)
+    value, result = _lookup(full_key)
+    _record(namespace, result)
+    if value is not None:
+        return value
+
+    with _stripes[zlib.crc32(full_key.encode()) % len(_stripes)]:
+        value, _ = _lookup(full_key)
+        if value is not None:
+            return value
+
+        backend = _backend()
+        lock_key = 'lock:' + full_key
+        lock_timeout = getattr(settings, 'ADAPTER_CACHE_LOCK_TIMEOUT', 10)
+        locked = backend.add(lock_key, 1, lock_timeout) is not False
+        if not locked:
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value, _ = _lookup(full_key)
+                if value is not None:
+                    return value
+
+        try:
+            value = compute()
+            set(namespace, key, value, timeout)
+        finally:
+            if locked:
+                backend.delete(lock_key)
+        return value
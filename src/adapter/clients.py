@@ -0,0 +1,54 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .coins import Coin, get_coin
+
+BLOCKCYPHER_API_URL = 'https://api.blockcypher.com/v1/'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process wide HTTP session. It keeps connections to the providers alive
+    (up to ADAPTER_HTTP_POOL_SIZE per host, shared by all threads) instead of opening one per request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = getattr(settings, 'ADAPTER_HTTP_POOL_SIZE', 20)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault('timeout', getattr(settings, 'ADAPTER_HTTP_TIMEOUT', 10))
+    return get_session().request(method, url, **kwargs)
+
+
+def rehive_request(method: str, path: str, **kwargs) -> requests.Response:
+    headers = kwargs.pop('headers', {})
+    headers['Authorization'] = 'Token ' + getattr(settings, 'REHIVE_API_TOKEN')
+    return request(method, getattr(settings, 'REHIVE_API_URL') + path, headers=headers, **kwargs)
+
+
+def blockcypher_url(path: str, coin: Coin = None) -> str:
+    """
+    BlockCypher API URL of a path on a coin's chain (the default coin if none is given).
+    """
+    return '%s%s/%s' % (BLOCKCYPHER_API_URL, (coin or get_coin()).chain, path)
+
+
+def blockcypher_request(method: str, path: str, coin: Coin = None, **kwargs) -> requests.Response:
+    params = kwargs.pop('params', {})
+    params.setdefault('token', getattr(settings, 'BLOCKCYPHER_TOKEN'))
+    return request(method, blockcypher_url(path, coin), params=params, **kwargs)
@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+from django.conf import settings
+
+from .exceptions import NotImplementedAPIError
+
+# Coins the adapter can serve, keyed by Rehive currency code:
+#   symbol: BlockCypher coin symbol (the `coin_symbol` of the blockcypher library).
+#   chain: BlockCypher API path of the chain.
+#   divisibility: decimal places of the smallest unit.
+#   uri_scheme: scheme of payment URIs.
+#   magicbyte: address version byte for the bitcoin library.
+Coin = namedtuple('Coin', ('code', 'symbol', 'chain', 'divisibility', 'uri_scheme', 'magicbyte'))
+
+COINS = {coin.code: coin for coin in (
+    Coin('XBT', 'btc', 'btc/main', 8, 'bitcoin', 0),
+    Coin('TXBT', 'btc-testnet', 'btc/test3', 8, 'bitcoin', 111),
+    Coin('LTC', 'ltc', 'ltc/main', 8, 'litecoin', 48),
+    Coin('DOGE', 'doge', 'doge/main', 8, 'dogecoin', 30),
+    Coin('DASH', 'dash', 'dash/main', 8, 'dash', 76),
+)}
+
+DEFAULT_COIN = 'XBT'
+
+
+def enabled() -> list:
+    return [code for code in getattr(settings, 'ADAPTER_COINS', [DEFAULT_COIN]) if code in COINS]
+
+
+def is_enabled(code: str) -> bool:
+    return code in enabled()
+
+
+def get_coin(code: str = None) -> Coin:
+    """
+    Returns the coin for a currency code, the default coin if no code is given.
+    """
+    code = code or DEFAULT_COIN
+    if not is_enabled(code):
+        raise NotImplementedAPIError('Currency %s is not supported by this adapter.' % code)
+    return COINS[code]
+
+
+def payment_uri(coin: Coin, address: str) -> str:
+    return '%s:%s' % (coin.uri_scheme, address)
+
+
+def queue_name(base: str, code: str = None) -> str:
+    """
+    Per-coin queue for a task queue, e.g. webhooks-ltc-<host>. The default coin uses the plain queue name.
+    """
+    if not code or code == DEFAULT_COIN or code not in COINS:
+        return '-'.join((base, settings.HOST_NAME))
+    return '-'.join((base, COINS[code].symbol, settings.HOST_NAME))
@@ -0,0 +1,47 @@
+import time
+from logging import getLogger
+
+from django.conf import settings
+from django.db import connections
+
+logger = getLogger('django')
+
+# Health checks of persistent database connections (CONN_MAX_AGE). Django (and Celery's Django fixup, around
+# tasks) only closes connections that expired or saw errors, a connection dropped while idle (by Postgres,
+# PgBouncer or a firewall) would fail the next request or task.
+
+
+def check_connections():
+    """
+    Closes persistent connections that stopped working, so that the next query reconnects. Connections that
+    were healthy less than ADAPTER_DB_HEALTH_CHECK_INTERVAL seconds ago are trusted without a round trip.
+    """
+    interval = getattr(settings, 'ADAPTER_DB_HEALTH_CHECK_INTERVAL', 30)
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if now - getattr(connection, 'adapter_healthy_at', 0) < interval:
+            continue
+        if not connection.is_usable():
+            logger.warning('Closing unusable database connection %s.' % connection.alias)
+            connection.close()
+        connection.adapter_healthy_at = now
+
+
+def mark_healthy():
+    """
+    Records that the open connections worked, at the end of a request or task without database errors.
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None and not connection.errors_occurred:
+            connection.adapter_healthy_at = now
+
+
+def connection_limit(role: str = None) -> int:
+    """
+    The maximum number of connections of a role (0: no limit).
+    """
+    role = role or getattr(settings, 'ADAPTER_DB_ROLE', 'web')
+    return getattr(settings, 'ADAPTER_DB_CONNECTIONS', {}).get(role, 0)
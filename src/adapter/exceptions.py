@@ -28,3 +28,35 @@ class AdapterError(Exception):
 class PlatformRequestFailedError(AdapterError):
     default_detail = 'Adapter platform request post failed.'
     default_error_slug = 'adapter_platform_failed_error.'
+
+
+class PlatformRequestOutcomeUnknownError(PlatformRequestFailedError):
+    default_detail = 'Adapter platform request timed out, it may have been processed.'
+    default_error_slug = 'adapter_platform_outcome_unknown_error'
+
+
+class InvalidTransitionError(AdapterError):
+    default_detail = 'Invalid transaction status transition.'
+    default_error_slug = 'invalid_transition_error'
+
+
+class DependencyUnavailableError(APIException):
+    status_code = 503
+    default_detail = 'A service the adapter depends on is unavailable, try again later.'
+
+
+class DuplicateRequestError(APIException):
+    status_code = 409
+    default_detail = 'A request with this transaction code is already being processed.'
+
+
+class FeeTooHighError(AdapterError):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Network fees are above the fee cap, try again later.'
+    default_error_slug = 'fee_too_high_error'
+
+
+class InvalidAmountError(AdapterError, ValueError):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Invalid amount.'
+    default_error_slug = 'invalid_amount_error'
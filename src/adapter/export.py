@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from decimal import Decimal
+
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ReceiveTransaction, SendTransaction
+
+# Exported columns per transaction type, and the lookup used to filter by account:
+EXPORTS = {
+    'receive': {
+        'model': ReceiveTransaction,
+        'fields': ('id', 'external_id', 'rehive_code', 'status', 'amount', 'divisibility', 'currency', 'issuer',
+                   'user_account__rehive_id', 'user_account__account_id', 'created', 'updated'),
+        'account': 'user_account__rehive_id',
+    },
+    'send': {
+        'model': SendTransaction,
+        'fields': ('id', 'external_id', 'rehive_code', 'status', 'amount', 'divisibility', 'currency', 'issuer',
+                   'recipient', 'admin_account__name', 'created', 'updated'),
+        'account': 'recipient',
+    },
+}
+
+FORMATS = ('ndjson', 'csv')
+
+
+def parse_time(value):
+    """
+    Accepts an ISO datetime or date.
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value) or parse_date(value)
+    if parsed is None:
+        raise ValueError('Invalid date: %s' % value)
+    return parsed
+
+
+def export_queryset(tx_type: str, status: str = None, start=None, end=None, account: str = None):
+    export = EXPORTS[tx_type]
+    queryset = export['model'].objects.all()
+    if status:
+        queryset = queryset.filter(status=status)
+    if start:
+        queryset = queryset.filter(created__gte=start)
+    if end:
+        queryset = queryset.filter(created__lt=end)
+    if account:
+        queryset = queryset.filter(**{export['account']: account})
+    return queryset
+
+
+def iter_rows(queryset, fields, chunk_size: int = 2000):
+    """
+    Yields rows as dicts in id order, fetching one keyset chunk (id > last id) at a time
+    so that memory use and query cost stay constant regardless of the table size.
+    """
+    queryset = queryset.order_by('id').values(*fields)
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        for row in chunk:
+            yield row
+        last_id = chunk[-1]['id']
+
+
+def _value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps({k: _value(v) for k, v in row.items()}, separators=(',', ':')) + '\n'
+
+
+def csv_lines(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return value
+
+    yield line(fields)
+    for row in rows:
+        yield line([_value(row[field]) for field in fields])
+
+
+def gzip_chunks(lines, flush_size: int = 64 * 1024):
+    """
+    Gzip compresses a stream of text lines, yielding compressed blocks of roughly flush_size bytes.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= flush_size:
+            block = compressor.compress(b''.join(pending))
+            pending, size = [], 0
+            if block:
+                yield block
+    yield compressor.compress(b''.join(pending)) + compressor.flush()
+
+
+def export_lines(tx_type: str, output: str = 'ndjson', chunk_size: int = 2000, **filters):
+    """
+    Streams the filtered transactions of a type as NDJSON or CSV lines.
+    """
+    fields = EXPORTS[tx_type]['fields']
+    rows = iter_rows(export_queryset(tx_type, **filters), fields, chunk_size=chunk_size)
+    if output == 'csv':
+        return csv_lines(rows, list(fields))
+    return ndjson_lines(rows)
@@ -0,0 +1,97 @@
+from logging import getLogger
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import cache, clients
+from .coins import Coin, get_coin
+from .exceptions import DependencyUnavailableError, FeeTooHighError
+from .resilience import protect
+
+logger = getLogger('django')
+
+# Priority tiers, fastest first. The names match BlockCypher's `preference` values.
+TIERS = ('high', 'medium', 'low')
+
+# Transaction size in bytes: overhead, per input and per output. Upper bounds for P2PKH with uncompressed keys,
+# which the admin accounts use (see Interface._derive_account_id).
+TX_OVERHEAD, INPUT_SIZE, OUTPUT_SIZE = 10, 180, 34
+
+
+class FeeSource:
+    """
+    Source of fee rates of a coin. Returns units per kB for each tier: {'high': ..., 'medium': ..., 'low': ...}.
+    """
+    def get_rates(self, coin: Coin) -> dict:
+        raise NotImplementedError('subclasses of FeeSource must provide a get_rates() method')
+
+
+class BlockCypherFeeSource(FeeSource):
+    def get_rates(self, coin: Coin) -> dict:
+        with protect('blockcypher'):
+            r = clients.blockcypher_request('GET', '', coin=coin)
+            r.raise_for_status()
+        data = r.json()
+        return {tier: int(data['%s_fee_per_kb' % tier]) for tier in TIERS}
+
+
+class StaticFeeSource(FeeSource):
+    def get_rates(self, coin: Coin) -> dict:
+        return dict(getattr(settings, 'ADAPTER_FEE_STATIC_RATES'))
+
+
+def _fetch_rates(coin: Coin) -> dict:
+    for path in getattr(settings, 'ADAPTER_FEE_SOURCES', ['adapter.fees.StaticFeeSource']):
+        try:
+            rates = import_string(path.strip())().get_rates(coin)
+        except Exception as exc:
+            logger.warning('Fee source %s failed: %s' % (path, exc))
+            continue
+        if all(tier in rates for tier in TIERS):
+            return rates
+        logger.warning('Fee source %s returned incomplete rates: %s' % (path, rates))
+    raise DependencyUnavailableError('No fee source available.')
+
+
+def get_rates(coin: Coin = None) -> dict:
+    """
+    Fee rates per tier of a coin (the default coin if none is given), cached for the 'fees' cache timeout.
+    """
+    coin = coin or get_coin()
+    return cache.get_or_set('fees', 'rates:%s' % coin.code, lambda: _fetch_rates(coin))
+
+
+def select_tier(tier: str = None, coin: Coin = None):
+    """
+    Returns (tier, satoshis per kB) to use for a transaction. Unknown tiers fall back to the default tier.
+    A tier above the fee cap is stepped down to the fastest tier within the cap.
+    """
+    if tier not in TIERS:
+        tier = getattr(settings, 'ADAPTER_FEE_DEFAULT_TIER', 'high')
+    rates = get_rates(coin)
+    cap = getattr(settings, 'ADAPTER_FEE_MAX_PER_KB', 0)
+    if cap and rates[tier] > cap:
+        within_cap = [t for t in TIERS[TIERS.index(tier):] if rates[t] <= cap]
+        tier = within_cap[0] if within_cap else TIERS[-1]
+    return tier, rates[tier]
+
+
+def estimate_size(inputs: int, outputs: int) -> int:
+    return TX_OVERHEAD + INPUT_SIZE * inputs + OUTPUT_SIZE * outputs
+
+
+def check_fee(fee: int, size: int):
+    """
+    Raises FeeTooHighError if a fee (in units) is above ADAPTER_FEE_MAX_PER_KB for a transaction of `size` bytes.
+    """
+    cap = getattr(settings, 'ADAPTER_FEE_MAX_PER_KB', 0)
+    if cap and fee > cap * size // 1000:
+        raise FeeTooHighError('Fee of %s units for %s bytes is above the cap of %s units per kB.' % (fee, size, cap))
+
+
+def estimate_fee(size: int, tier: str = None, coin: Coin = None) -> int:
+    """
+    Estimated fee in units for a transaction of `size` bytes.
+    """
+    tier, fee_per_kb = select_tier(tier, coin)
+    return fee_per_kb * size // 1000
@@ -0,0 +1,66 @@
+from logging import getLogger
+
+from django.conf import settings
+from django.db.models import Max
+
+from . import cache, metrics
+from .coins import COINS, enabled
+
+logger = getLogger('django')
+
+# Address gap monitoring. Wallets restoring the receive MPK stop scanning after a run of unused addresses
+# (the gap limit, 20 by BIP 44 convention), so funds sent to an address past a longer run are not found.
+# Most derived addresses are never used, so the runs are tracked per coin. Only addresses with a known
+# derivation index (UserAccount.address_index) are counted.
+
+
+def address_gaps(admin_account) -> dict:
+    """
+    Returns the longest run of unused addresses before a used one (max_gap) and the run of unused addresses
+    after the last used one (trailing_gap) of an MPK account.
+    """
+    from .models import UserAccount
+    accounts = UserAccount.objects.filter(admin_account=admin_account, address_index__isnull=False)
+    allocated = accounts.aggregate(allocated=Max('address_index'))['allocated']
+    used = accounts.filter(receivetransaction__isnull=False).order_by('address_index') \
+        .values_list('address_index', flat=True).distinct()
+
+    previous, max_gap = -1, 0
+    for index in used.iterator():
+        max_gap = max(max_gap, index - previous - 1)
+        previous = index
+    trailing_gap = 0 if allocated is None else allocated - previous
+    return {'max_gap': max_gap, 'trailing_gap': trailing_gap, 'allocated': 0 if allocated is None else allocated + 1}
+
+
+def check() -> dict:
+    """
+    Computes the address gaps of every enabled coin, caches them for the metrics and warns about gaps
+    past ADAPTER_GAP_LIMIT.
+    """
+    from .models import AdminAccount
+    limit = getattr(settings, 'ADAPTER_GAP_LIMIT', 20)
+    results = {}
+    for code in enabled():
+        try:
+            admin_account = AdminAccount.objects.get_cached(name='receive_mpk', currency=code)
+        except AdminAccount.DoesNotExist:
+            continue
+        gaps = results[code] = address_gaps(admin_account)
+        cache.set('address_gap', code, gaps)
+        if gaps['max_gap'] >= limit or gaps['trailing_gap'] >= limit:
+            logger.warning('%s address gap past the gap limit of %s: %s' % (code, limit, gaps))
+    return results
+
+
+def _gauge(code: str, name: str):
+    return lambda: (cache.get('address_gap', code) or {}).get(name)
+
+
+def register_gauges():
+    """
+    Exposes the gaps last computed by check() (in any process) as metrics.
+    """
+    for code in COINS:
+        for name in ('max_gap', 'trailing_gap'):
+            metrics.register_gauge('adapter_address_%s' % name, _gauge(code, name), currency=code)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from adapter.models import ReceiveTransaction, SendTransaction, ReceiveTransactionTransition, TransactionPayload
+
+
+class Command(BaseCommand):
+    help = 'Fills in created/updated timestamps for transactions saved before the columns existed. ' \
+           'Rows are updated in small chunks so that no long locks are held.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in (ReceiveTransaction, SendTransaction):
+            self.backfill(model, options['chunk_size'])
+
+    def backfill(self, model, chunk_size: int):
+        last_id, filled = 0, 0
+        while True:
+            ids = list(model.objects.filter(id__gt=last_id, created__isnull=True)
+                       .order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+
+            timestamps = self.timestamps(model, ids)
+            with transaction.atomic():
+                for tx_id in ids:
+                    created = timestamps.get(tx_id) or timezone.now()
+                    model.objects.filter(id=tx_id, created__isnull=True).update(created=created, updated=created)
+
+            filled += len(ids)
+            last_id = ids[-1]
+
+        self.stdout.write('%s: filled %s rows.' % (model._meta.db_table, filled))
+
+    @staticmethod
+    def timestamps(model, ids) -> dict:
+        """
+        Best known creation time per transaction: the first logged transition,
+        otherwise the time the provider first saw the transaction.
+        """
+        timestamps = {}
+        for tx_id, data in TransactionPayload.objects.load_many(model.PAYLOAD_TYPE, ids, 'data').items():
+            received = parse_datetime(data.get('received') or '') if isinstance(data, dict) else None
+            if received:
+                timestamps[tx_id] = received
+
+        if model is ReceiveTransaction:
+            transitions = ReceiveTransactionTransition.objects.filter(transaction_id__in=ids)\
+                .values('transaction_id').annotate(first=Min('created'))
+            timestamps.update({t['transaction_id']: t['first'] for t in transitions})
+
+        return timestamps
@@ -0,0 +1,117 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from adapter.models import ReceiveTransaction, SendTransaction
+
+
+class Command(BaseCommand):
+    help = 'Converts the decimal amount columns of the transaction tables to integer units (amount bigint, ' \
+           'divisibility smallint) without long locks. Run the actions in order:\n\n' \
+           'prepare: add the new columns and a trigger that fills them for rows written by the running code. ' \
+           'The trigger rejects amounts with more decimal places than their divisibility.\n' \
+           'backfill: fill the new columns of existing rows in chunks. Fails if an amount has more decimal ' \
+           'places than its divisibility, rather than truncating it.\n' \
+           'swap: replace the decimal column by the integer one. Run it as part of deploying the code that uses ' \
+           'integer amounts, the old code must not write amounts after the swap.\n' \
+           'drop: drop the old decimal column (amount_decimal) once it is no longer needed.'
+
+    tables = [model._meta.db_table for model in (ReceiveTransaction, SendTransaction)]
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('prepare', 'backfill', 'swap', 'drop'))
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--divisibility', type=int, default=8, help='Divisibility of the existing amounts.')
+
+    def handle(self, *args, **options):
+        for table in self.tables:
+            if options['action'] == 'prepare':
+                self.prepare(table, options['divisibility'])
+            elif options['action'] == 'backfill':
+                self.backfill(table, options['chunk_size'])
+            elif options['action'] == 'swap':
+                self.swap(table)
+            elif options['action'] == 'drop':
+                self.execute_sql('ALTER TABLE %s DROP COLUMN IF EXISTS amount_decimal' % table)
+                self.stdout.write('%s: dropped amount_decimal.' % table)
+
+    def execute_sql(self, sql: str, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+    def column_type(self, table: str, column: str):
+        row = self.execute_sql('SELECT data_type FROM information_schema.columns '
+                               'WHERE table_name = %s AND column_name = %s', [table, column])
+        return row[0][0] if row else None
+
+    def prepare(self, table: str, divisibility: int):
+        if self.column_type(table, 'amount') != 'numeric':
+            self.stdout.write('%s: amount is already converted.' % table)
+            return
+
+        with transaction.atomic():
+            self.execute_sql("SET LOCAL lock_timeout = '5s'")
+            # Constant defaults, so adding the columns doesn't rewrite the table:
+            self.execute_sql('ALTER TABLE %s ADD COLUMN IF NOT EXISTS divisibility smallint NOT NULL DEFAULT %s'
+                             % (table, int(divisibility)))
+            self.execute_sql('ALTER TABLE %s ADD COLUMN IF NOT EXISTS amount_units bigint' % table)
+            # Casting to bigint rounds, so fractional units are an error, as in the backfill:
+            self.execute_sql(
+                'CREATE OR REPLACE FUNCTION adapter_amount_units() RETURNS trigger AS $$ '
+                'DECLARE units numeric := NEW.amount * power(10::numeric, NEW.divisibility); BEGIN '
+                'IF units <> trunc(units) THEN RAISE EXCEPTION '
+                "'Amount % has more decimal places than its divisibility %', NEW.amount, NEW.divisibility; "
+                'END IF; '
+                'NEW.amount_units := units::bigint; '
+                'RETURN NEW; END $$ LANGUAGE plpgsql')
+            self.execute_sql('DROP TRIGGER IF EXISTS %s_amount_units ON %s' % (table, table))
+            self.execute_sql('CREATE TRIGGER %s_amount_units BEFORE INSERT OR UPDATE OF amount, divisibility ON %s '
+                             'FOR EACH ROW EXECUTE PROCEDURE adapter_amount_units()' % (table, table))
+        self.stdout.write('%s: prepared.' % table)
+
+    def backfill(self, table: str, chunk_size: int):
+        if self.column_type(table, 'amount_units') is None:
+            raise CommandError('%s: run the prepare action first.' % table)
+
+        inexact = self.execute_sql('SELECT id, amount FROM %s WHERE amount * power(10::numeric, divisibility) '
+                                   '<> trunc(amount * power(10::numeric, divisibility)) LIMIT 10' % table)
+        if inexact:
+            raise CommandError('%s: amounts with more decimal places than their divisibility: %s'
+                               % (table, ', '.join('%s (id %s)' % (amount, tx_id) for tx_id, amount in inexact)))
+
+        last_id, filled = 0, 0
+        while True:
+            with transaction.atomic():
+                rows = self.execute_sql(
+                    'UPDATE %s t SET amount_units = (t.amount * power(10::numeric, t.divisibility))::bigint '
+                    'FROM (SELECT id FROM %s WHERE id > %%s ORDER BY id LIMIT %%s) chunk '
+                    'WHERE t.id = chunk.id RETURNING t.id' % (table, table), [last_id, chunk_size])
+            if not rows:
+                break
+            filled += len(rows)
+            last_id = max(row[0] for row in rows)
+
+        self.stdout.write('%s: filled %s rows.' % (table, filled))
+
+    def swap(self, table: str):
+        if self.column_type(table, 'amount') != 'numeric':
+            self.stdout.write('%s: amount is already converted.' % table)
+            return
+        if self.execute_sql('SELECT 1 FROM %s WHERE amount_units IS NULL LIMIT 1' % table):
+            raise CommandError('%s: not all rows are filled, run the backfill action.' % table)
+
+        # Validated without blocking writes, so that SET NOT NULL below needs no table scan:
+        self.execute_sql('ALTER TABLE %s ADD CONSTRAINT %s_amount_units_not_null '
+                         'CHECK (amount_units IS NOT NULL) NOT VALID' % (table, table))
+        self.execute_sql('ALTER TABLE %s VALIDATE CONSTRAINT %s_amount_units_not_null' % (table, table))
+
+        with transaction.atomic():
+            self.execute_sql("SET LOCAL lock_timeout = '5s'")
+            self.execute_sql('DROP TRIGGER %s_amount_units ON %s' % (table, table))
+            self.execute_sql('ALTER TABLE %s RENAME COLUMN amount TO amount_decimal' % table)
+            self.execute_sql('ALTER TABLE %s ALTER COLUMN amount_decimal DROP NOT NULL' % table)
+            self.execute_sql('ALTER TABLE %s RENAME COLUMN amount_units TO amount' % table)
+            self.execute_sql('ALTER TABLE %s ALTER COLUMN amount SET DEFAULT 0' % table)
+            self.execute_sql('ALTER TABLE %s ALTER COLUMN amount SET NOT NULL' % table)
+            self.execute_sql('ALTER TABLE %s DROP CONSTRAINT %s_amount_units_not_null' % (table, table))
+        self.stdout.write('%s: amount is now stored in integer units.' % table)
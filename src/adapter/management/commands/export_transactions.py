@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from adapter.export import EXPORTS, FORMATS, export_lines, gzip_chunks, parse_time
+
+
+class Command(BaseCommand):
+    help = 'Streams transactions as NDJSON or CSV for reconciliation, in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tx_type', choices=sorted(EXPORTS))
+        parser.add_argument('--format', dest='output', choices=FORMATS, default='ndjson')
+        parser.add_argument('--status')
+        parser.add_argument('--start', help='ISO date or datetime (inclusive).')
+        parser.add_argument('--end', help='ISO date or datetime (exclusive).')
+        parser.add_argument('--account', help='Rehive user id (receive) or recipient address (send).')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output (default if --file ends in .gz).')
+        parser.add_argument('--file', help='Write to this file instead of stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            lines = export_lines(options['tx_type'],
+                                 output=options['output'],
+                                 chunk_size=options['chunk_size'],
+                                 status=options['status'],
+                                 start=parse_time(options['start']),
+                                 end=parse_time(options['end']),
+                                 account=options['account'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        path = options['file']
+        compress = options['gzip'] or bool(path and path.endswith('.gz'))
+
+        if path:
+            with (open(path, 'wb') if compress else open(path, 'w', newline='')) as f:
+                for chunk in (gzip_chunks(lines) if compress else lines):
+                    f.write(chunk)
+        elif compress:
+            for chunk in gzip_chunks(lines):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
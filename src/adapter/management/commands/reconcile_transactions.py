@@ -0,0 +1,40 @@
+import json
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from adapter.export import EXPORTS, parse_time
+from adapter.reconciliation import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Reconciles adapter transactions against the blockchain and Rehive, ' \
+           'writing an NDJSON mismatch report followed by a summary.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tx_type', choices=sorted(EXPORTS))
+        parser.add_argument('--status')
+        parser.add_argument('--start', help='ISO date or datetime (inclusive).')
+        parser.add_argument('--end', help='ISO date or datetime (exclusive).')
+        parser.add_argument('--repair', action='store_true', help='Queue repair tasks for repairable mismatches.')
+        parser.add_argument('--file', help='Write the report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            start, end = parse_time(options['start']), parse_time(options['end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        summary = Counter()
+        mismatches = reconcile(options['tx_type'], start=start, end=end, status=options['status'],
+                               auto_repair=options['repair'], summary=summary)
+
+        out = open(options['file'], 'w') if options['file'] else self.stdout
+        try:
+            for mismatch in mismatches:
+                out.write(json.dumps(mismatch) + '\n')
+        finally:
+            if options['file']:
+                out.close()
+
+        self.stderr.write('Summary: %s' % json.dumps(summary, sort_keys=True))
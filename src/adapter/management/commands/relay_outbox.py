@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from adapter import db
+from adapter.outbox import relay
+
+
+class Command(BaseCommand):
+    help = 'Relays outbox messages to the task broker in batches. Runs continuously unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the outbox and exit.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the outbox is empty.')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        while True:
+            # Long running, so expired and dropped connections are replaced here rather than around requests:
+            close_old_connections()
+            db.check_connections()
+            sent = relay(batch_size=options['batch_size'])
+            db.mark_healthy()
+            if sent:
+                self.stdout.write('Relayed %s messages.' % sent)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
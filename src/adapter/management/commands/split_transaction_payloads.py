@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from adapter.models import ReceiveTransaction, SendTransaction, TransactionPayload
+
+
+class Command(BaseCommand):
+    help = 'Copies payloads from the legacy inline JSON columns of the transaction tables into ' \
+           'the TransactionPayload table. Run before the legacy columns are dropped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model in (ReceiveTransaction, SendTransaction):
+            self.split(model, options['chunk_size'])
+
+    def split(self, model, chunk_size: int):
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            columns = {c.name for c in connection.introspection.get_table_description(cursor, table)}
+        names = [name for name in model.PAYLOAD_FIELDS if name in columns]
+        if not names:
+            self.stdout.write('%s: no legacy payload columns.' % table)
+            return
+
+        sql = 'SELECT id, %s FROM %s WHERE id > %%s ORDER BY id LIMIT %%s' % (', '.join(names), table)
+        last_id, copied = 0, 0
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [last_id, chunk_size])
+                rows = cursor.fetchall()
+            if not rows:
+                break
+
+            ids = [row[0] for row in rows]
+            existing = set(TransactionPayload.objects.filter(tx_type=model.PAYLOAD_TYPE, tx_id__in=ids)
+                           .values_list('tx_id', 'name'))
+            payloads = []
+            for row in rows:
+                for name, value in zip(names, row[1:]):
+                    if value and (row[0], name) not in existing:
+                        payloads.append(TransactionPayload.build(model.PAYLOAD_TYPE, row[0], name, value))
+
+            with transaction.atomic():
+                TransactionPayload.objects.bulk_create(payloads)
+
+            copied += len(payloads)
+            last_id = ids[-1]
+
+        self.stdout.write('%s: copied %s payloads.' % (table, copied))
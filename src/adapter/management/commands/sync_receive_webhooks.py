@@ -0,0 +1,31 @@
+import json
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from adapter import coins
+from adapter.subscriptions import sync
+
+
+class Command(BaseCommand):
+    help = 'Syncs the BlockCypher receive webhooks with the user accounts: creates missing hooks for active ' \
+           'accounts and deletes hooks of dormant accounts, duplicates and hooks unknown to the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--currency', choices=coins.enabled(), action='append',
+                            help='Only sync this coin (repeatable). Defaults to all enabled coins.')
+        parser.add_argument('--dormant-days', type=int,
+                            help='Expire hooks of accounts without activity for this many days (0 keeps them). '
+                                 'Defaults to ADAPTER_HOOK_DORMANT_DAYS.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the changes.')
+
+    def handle(self, *args, **options):
+        dormant_after = None
+        if options['dormant_days'] is not None:
+            dormant_after = timedelta(days=options['dormant_days']) if options['dormant_days'] else False
+
+        for code in options['currency'] or coins.enabled():
+            summary = sync(coins.COINS[code], dormant_after=dormant_after, dry_run=options['dry_run'],
+                           summary=Counter())
+            self.stdout.write('%s: %s' % (code, json.dumps(summary, sort_keys=True)))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from adapter import coins
+from adapter.routers import task_queues
+
+
+class Command(BaseCommand):
+    help = 'Lists the queues of the routed tasks per coin, for the -Q option of the workers. ' \
+           'Each shard queue must be consumed by a single worker process (--concurrency=1).'
+
+    def handle(self, *args, **options):
+        for code in coins.enabled():
+            for task in sorted(settings.ADAPTER_TASK_QUEUES):
+                self.stdout.write('%s %s: %s' % (code, task, ','.join(task_queues(task, code))))
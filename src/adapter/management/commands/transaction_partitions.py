@@ -0,0 +1,203 @@
+import re
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, DatabaseError
+
+from adapter.models import ReceiveTransaction, SendTransaction, TransactionPayload
+
+
+def month_start(day: date, months: int = 0) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def index_name(name: str, suffix: str) -> str:
+    """
+    Name of the parent ('p') or partition copy ('c') of an index, within Postgres' 63 character limit.
+    """
+    return '%s_%s' % (name[:61], suffix)
+
+
+class Command(BaseCommand):
+    help = 'Manages monthly range partitioning (on created) of the transaction tables (Postgres 12+).\n\n' \
+           'convert: turn the tables into partitioned tables. The existing table is attached as the ' \
+           'partition for everything up to the end of the current month. ' \
+           'backfill_transaction_timestamps must have been run first.\n' \
+           'create: create partitions for the coming months.\n' \
+           'detach: detach partitions older than --before (YYYY-MM) so that they can be archived. The payloads ' \
+           'of their transactions are moved to a <partition>_payload table, to be archived with them.'
+
+    tables = [model._meta.db_table for model in (ReceiveTransaction, SendTransaction)]
+    payload_types = {model._meta.db_table: model.PAYLOAD_TYPE for model in (ReceiveTransaction, SendTransaction)}
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('convert', 'create', 'detach'))
+        parser.add_argument('--months', type=int, default=3, help='Number of months ahead to create partitions for.')
+        parser.add_argument('--before', help='Detach partitions ending on or before this month (YYYY-MM).')
+
+    def handle(self, *args, **options):
+        for table in self.tables:
+            if options['action'] == 'convert':
+                self.convert(table)
+                self.create(table, options['months'])
+            elif options['action'] == 'create':
+                self.create(table, options['months'])
+            elif options['action'] == 'detach':
+                if not options['before']:
+                    raise CommandError('--before is required to detach partitions.')
+                year, month = options['before'].split('-')
+                self.detach(table, date(int(year), int(month), 1))
+
+    def execute_sql(self, sql: str, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+    def is_partitioned(self, table: str) -> bool:
+        return bool(self.execute_sql('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [table]))
+
+    def convert(self, table: str):
+        if self.is_partitioned(table):
+            self.stdout.write('%s is already partitioned.' % table)
+            return
+
+        if self.execute_sql('SELECT 1 FROM %s WHERE created IS NULL LIMIT 1' % table):
+            raise CommandError('%s has rows without a created timestamp, run backfill_transaction_timestamps.' % table)
+
+        legacy = table + '_legacy'
+        boundary = month_start(date.today(), 1)
+
+        # Prepare the existing table without blocking writes, so that attaching it needs no scan:
+        self.execute_sql('ALTER TABLE %s ADD CONSTRAINT %s_range '
+                         'CHECK (created IS NOT NULL AND created < %%s) NOT VALID' % (table, legacy), [boundary])
+        self.execute_sql('ALTER TABLE %s VALIDATE CONSTRAINT %s_range' % (table, legacy))
+        pkey = legacy + '_pkey_created'
+        self.execute_sql('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (id, created)' % (pkey, table))
+        # Make it the primary key before the swap, so that attaching the table reuses it instead of building
+        # and validating a unique index under the exclusive lock. Proven by the validated check constraint,
+        # SET NOT NULL needs no table scan:
+        primary_key = self.execute_sql("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass "
+                                       "AND contype = 'p'", [table])
+        if not primary_key or primary_key[0][0] != pkey:
+            with transaction.atomic():
+                self.execute_sql("SET LOCAL lock_timeout = '5s'")
+                self.execute_sql('ALTER TABLE %s ALTER COLUMN created SET NOT NULL' % table)
+                self.execute_sql('ALTER TABLE %s %sADD CONSTRAINT %s PRIMARY KEY USING INDEX %s'
+                                 % (table, 'DROP CONSTRAINT %s, ' % primary_key[0][0] if primary_key else '',
+                                    pkey, pkey))
+
+        indexes = self.execute_sql(
+            'SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE i.indrelid = %s::regclass AND NOT i.indisunique', [table])
+        unique_indexes = self.unique_indexes(table)
+        foreign_keys = self.execute_sql(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass "
+            "AND contype = 'f'", [table])
+
+        with transaction.atomic():
+            self.execute_sql("SET LOCAL lock_timeout = '5s'")
+            self.execute_sql('ALTER TABLE %s RENAME TO %s' % (table, legacy))
+            self.execute_sql('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (created)'
+                             % (table, legacy))
+            self.execute_sql('ALTER TABLE %s ADD PRIMARY KEY (id, created)' % table)
+
+            for name, definition in indexes:
+                definition = re.sub(r' ON (\w+\.)?%s ' % table, ' ON ONLY %s ' % table, definition, count=1)
+                self.execute_sql(definition.replace(' INDEX %s ' % name, ' INDEX %s ' % index_name(name, 'p'), 1))
+            for name, definition in unique_indexes:
+                self.execute_sql('CREATE UNIQUE INDEX %s ON ONLY %s %s' % (index_name(name, 'p'), table, definition))
+
+            self.execute_sql("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (MINVALUE) TO ('%s')"
+                             % (table, legacy, boundary.isoformat()))
+            for name, _ in indexes:
+                self.execute_sql('ALTER INDEX %s ATTACH PARTITION %s' % (index_name(name, 'p'), name))
+            for name, _ in unique_indexes:
+                self.execute_sql('ALTER INDEX %s ATTACH PARTITION %s'
+                                 % (index_name(name, 'p'), index_name(name, 'c')))
+            for name, definition in foreign_keys:
+                self.execute_sql('ALTER TABLE %s ADD CONSTRAINT %s_p %s' % (table, name, definition))
+
+            self.execute_sql('ALTER SEQUENCE %s_id_seq OWNED BY %s.id' % (table, table))
+
+        self.stdout.write('%s converted, existing rows are in %s.' % (table, legacy))
+        for name, definition in unique_indexes:
+            self.stdout.write('Unique index %s is now %s: unique per created timestamp, the partition key.'
+                              % (name, definition))
+
+    def unique_indexes(self, table: str) -> list:
+        """
+        Prepares a copy of each unique index with the partition key appended, which Postgres requires on
+        partitioned tables, and returns them as (name, definition). Expression indexes can't be copied.
+        """
+        rows = self.execute_sql(
+            'SELECT c.relname, i.indnatts, pg_get_expr(i.indpred, i.indrelid), ARRAY(SELECT a.attname::text '
+            'FROM unnest(i.indkey) WITH ORDINALITY k(n, o) JOIN pg_attribute a ON a.attrelid = i.indrelid '
+            'AND a.attnum = k.n ORDER BY k.o) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE i.indrelid = %s::regclass AND i.indisunique AND NOT i.indisprimary', [table])
+        copies = {index_name(row[0], 'c') for row in rows}
+        unique_indexes = []
+        for name, count, where, columns in rows:
+            if name in copies:
+                continue  # A copy prepared by an earlier, interrupted run.
+            if len(columns) != count:
+                raise CommandError('Unique index %s of %s is on expressions, drop or replace it before converting.'
+                                   % (name, table))
+            if 'created' not in columns:
+                columns.append('created')
+            definition = '(%s)%s' % (', '.join(columns), ' WHERE %s' % where if where else '')
+            # Built on the existing table without blocking writes, attached as its partition's index:
+            self.execute_sql('CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s %s'
+                             % (index_name(name, 'c'), table, definition))
+            unique_indexes.append((name, definition))
+        return unique_indexes
+
+    def create(self, table: str, months: int):
+        if not self.is_partitioned(table):
+            raise CommandError('%s is not partitioned, run the convert action first.' % table)
+
+        today = date.today()
+        for offset in range(months + 1):
+            start, end = month_start(today, offset), month_start(today, offset + 1)
+            partition = '%s_p%s' % (table, start.strftime('%Y%m'))
+            exists = self.execute_sql(
+                "SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = %s::regclass AND c.relname = %s", [table, partition])
+            if exists:
+                continue
+
+            try:
+                with transaction.atomic():
+                    self.execute_sql("CREATE TABLE %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')"
+                                     % (partition, table, start.isoformat(), end.isoformat()))
+            except DatabaseError:
+                # The month is already covered, e.g. by the converted legacy partition.
+                self.stdout.write('Skipped partition %s, the range is already covered.' % partition)
+                continue
+            self.stdout.write('Created partition %s.' % partition)
+
+    def detach(self, table: str, before: date):
+        partitions = self.execute_sql(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass AND c.relname ~ '_p[0-9]{6}$'", [table])
+        for (partition,) in partitions:
+            month = date(int(partition[-6:-2]), int(partition[-2:]), 1)
+            if month_start(month, 1) <= before:
+                moved = self.move_payloads(table, partition)
+                self.execute_sql('ALTER TABLE %s DETACH PARTITION %s' % (table, partition))
+                self.stdout.write('Detached partition %s, moved %s payloads to %s_payload.'
+                                  % (partition, moved, partition))
+
+    def move_payloads(self, table: str, partition: str) -> int:
+        """
+        Moves the payloads of a partition's transactions out of the payload table, which has no foreign key
+        that would delete them. Done before detaching, so that an interrupted run is completed by the next one.
+        """
+        payload_table = TransactionPayload._meta.db_table
+        with transaction.atomic():
+            self.execute_sql('CREATE TABLE IF NOT EXISTS %s_payload (LIKE %s)' % (partition, payload_table))
+            rows = self.execute_sql(
+                'WITH moved AS (DELETE FROM %s WHERE tx_type = %%s AND tx_id IN (SELECT id FROM %s) RETURNING *) '
+                'INSERT INTO %s_payload SELECT * FROM moved RETURNING id' % (payload_table, partition, partition),
+                [self.payload_types[table]])
+        return len(rows)
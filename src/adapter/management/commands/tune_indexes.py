@@ -0,0 +1,120 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+
+from adapter.models import AdminAccount, ReceiveTransaction, SendTransaction, UserAccount
+
+# Indexes matching the hot path lookups: (model, index name, columns, unique, partial index condition).
+INDEXES = (
+    # get_or_create(rehive_id=..., currency=...) of the account view, also declared by UserAccount.Meta:
+    (UserAccount, 'adapter_useraccount_rehive_id_currency_uniq', ('rehive_id', 'currency'), True, None),
+    # Webhook processing looks transactions up by account and tx hash, a hash can pay several accounts:
+    (ReceiveTransaction, 'adapter_receivetransaction_account_external_id_uniq', ('user_account_id', 'external_id'),
+     True, 'external_id IS NOT NULL'),
+    # The send claim of SendView, also declared by SendTransaction.rehive_code:
+    (SendTransaction, 'adapter_sendtransaction_rehive_code_uniq', ('rehive_code',), True, 'rehive_code IS NOT NULL'),
+    # The currency filter of the transaction admin lists, which are ordered by -id:
+    (ReceiveTransaction, 'adapter_receivetransaction_currency_id', ('currency', 'id'), False, None),
+    (SendTransaction, 'adapter_sendtransaction_currency_id', ('currency', 'id'), False, None),
+    # get_cached(default=True, currency=...), one default account per coin:
+    (AdminAccount, 'adapter_adminaccount_default_currency_uniq', ('currency',), True, '"default"'),
+    # get_cached(name=..., currency=...), e.g. the receive_mpk account of a coin:
+    (AdminAccount, 'adapter_adminaccount_name_currency', ('name', 'currency'), False, None),
+)
+
+
+class Command(BaseCommand):
+    help = 'Creates the indexes and unique constraints matching the hot path queries with ' \
+           'CREATE INDEX CONCURRENTLY, so that writes are not blocked while they are built. ' \
+           'Unique indexes are skipped (and the duplicates reported) while the table has duplicate rows. ' \
+           'Run it before migrating to models that declare the same constraints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the indexes to create.')
+
+    def handle(self, *args, **options):
+        for model, name, columns, unique, where in INDEXES:
+            self.create_index(model._meta.db_table, name, columns, unique, where, options['dry_run'])
+
+    def execute_sql(self, sql: str, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+    def is_partitioned(self, table: str) -> bool:
+        return bool(self.execute_sql('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [table]))
+
+    def index_state(self, name: str):
+        """
+        Returns whether the index is valid, or None if it doesn't exist. Failed concurrent builds leave invalid
+        indexes behind.
+        """
+        rows = self.execute_sql(
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s',
+            [name])
+        return rows[0][0] if rows else None
+
+    def has_equivalent(self, table: str, columns, unique: bool) -> bool:
+        """
+        Whether a valid, non partial index on exactly these columns exists, e.g. created by a migration.
+        """
+        return bool(self.execute_sql(
+            'SELECT 1 FROM pg_index i WHERE i.indrelid = %s::regclass AND i.indisvalid AND i.indpred IS NULL '
+            'AND i.indisunique >= %s AND ARRAY(SELECT a.attname::text FROM unnest(i.indkey) WITH ORDINALITY k(n, o) '
+            'JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.n ORDER BY k.o) = %s',
+            [table, unique, list(columns)]))
+
+    def duplicates(self, table: str, columns, where: str) -> int:
+        return self.execute_sql(
+            'SELECT count(*) FROM (SELECT 1 FROM %s %s GROUP BY %s HAVING count(*) > 1) d'
+            % (table, 'WHERE %s' % where if where else '', ', '.join(columns)))[0][0]
+
+    def create_index(self, table: str, name: str, columns, unique: bool, where: str, dry_run: bool):
+        partitioned = self.is_partitioned(table)
+        if unique and partitioned:
+            # Unique indexes of partitioned tables must include the partition key (created):
+            self.stdout.write('%s is partitioned, creating %s without uniqueness.' % (table, name))
+            unique = False
+
+        state = self.index_state(name)
+        if state or (not where and self.has_equivalent(table, columns, unique)):
+            self.stdout.write('%s exists.' % name)
+            return
+        if unique:
+            count = self.duplicates(table, columns, where)
+            if count:
+                self.stdout.write('Skipped %s, %s has %s duplicate (%s) groups to merge first.'
+                                  % (name, table, count, ', '.join(columns)))
+                return
+        if dry_run:
+            self.stdout.write('Would create %s.' % name)
+            return
+
+        if state is False and not partitioned:
+            self.execute_sql('DROP INDEX CONCURRENTLY IF EXISTS %s' % name)
+
+        definition = '(%s)%s' % (', '.join(columns), ' WHERE %s' % where if where else '')
+        try:
+            if partitioned:
+                self.create_partitioned_index(table, name, definition)
+            else:
+                self.execute_sql('CREATE %sINDEX CONCURRENTLY %s ON %s %s'
+                                 % ('UNIQUE ' if unique else '', name, table, definition))
+        except DatabaseError as e:
+            # E.g. a duplicate written while the index was built, the invalid index is dropped on the next run.
+            self.stderr.write('Could not create %s: %s' % (name, e))
+            return
+        self.stdout.write('Created %s.' % name)
+
+    def create_partitioned_index(self, table: str, name: str, definition: str):
+        # CONCURRENTLY isn't supported on partitioned tables: create the parent index without building it,
+        # build the index of each partition concurrently and attach it.
+        self.execute_sql('CREATE INDEX IF NOT EXISTS %s ON ONLY %s %s' % (name, table, definition))
+        partitions = self.execute_sql(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass', [table])
+        for (partition,) in partitions:
+            partition_index = '%s_%s' % (name[:40], partition[-20:])
+            self.execute_sql('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s %s'
+                             % (partition_index, partition, definition))
+            if not self.execute_sql('SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass', [partition_index]):
+                self.execute_sql('ALTER INDEX %s ATTACH PARTITION %s' % (name, partition_index))
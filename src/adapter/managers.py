@@ -0,0 +1,127 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, models
+
+from . import cache, payloads
+
+
+def estimated_count(model) -> int:
+    """
+    Row estimate from the planner statistics, avoids a full COUNT(*) on large tables.
+    Partitioned tables are estimated from their partitions.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT SUM(GREATEST(reltuples, 0)) FROM pg_class WHERE oid = %s::regclass '
+                       'OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)',
+                       [model._meta.db_table] * 2)
+        row = cursor.fetchone()
+    return int(row[0] or 0)
+
+
+class TransactionPayloadManager(models.Manager):
+    def load(self, tx_type: str, tx_id: int, name: str):
+        """
+        Returns the decoded payload, or an empty dict if none was stored.
+        """
+        row = self.filter(tx_type=tx_type, tx_id=tx_id, name=name).values_list('content', 'compressed').first()
+        if row is None:
+            return {}
+        return payloads.decode(*row)
+
+    def load_many(self, tx_type: str, tx_ids, name: str) -> dict:
+        """
+        Returns a dict of decoded payloads keyed by transaction id.
+        """
+        rows = self.filter(tx_type=tx_type, tx_id__in=tx_ids, name=name)\
+            .values_list('tx_id', 'content', 'compressed')
+        return {tx_id: payloads.decode(content, compressed) for tx_id, content, compressed in rows}
+
+    def store(self, tx_type: str, tx_id: int, name: str, value):
+        content, compressed = payloads.encode(value)
+        self.update_or_create(tx_type=tx_type, tx_id=tx_id, name=name,
+                              defaults={'content': content, 'compressed': compressed})
+
+
+class TransactionQuerySet(models.QuerySet):
+    def summary(self):
+        """
+        Only load the columns (and related account columns) needed to list transactions.
+        """
+        related = {name.split('__')[0] for name in self.model.SUMMARY_FIELDS if '__' in name}
+        return self.select_related(*related).only(*self.model.SUMMARY_FIELDS)
+
+
+class AdminAccountRegistry:
+    """
+    In-process copy of all admin accounts, loaded with a single query. It is reloaded when the
+    'admin_account' cache namespace version changes, which happens whenever an account is saved or deleted,
+    and at least every ADAPTER_ADMIN_ACCOUNT_TTL seconds, in case a version bump was lost.
+    """
+    def __init__(self, model):
+        self.model = model
+        self._accounts = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self) -> list:
+        version = cache.version('admin_account')
+        ttl = getattr(settings, 'ADAPTER_ADMIN_ACCOUNT_TTL', 300)
+        with self._lock:
+            if self._accounts is None or version != self._version or time.monotonic() - self._loaded_at > ttl:
+                self._accounts = list(self.model._default_manager.all())
+                self._version = version
+                self._loaded_at = time.monotonic()
+            return self._accounts
+
+    def get(self, **lookup):
+        matches = [account for account in self._load()
+                   if all(getattr(account, field) == value for field, value in lookup.items())]
+        if not matches:
+            raise self.model.DoesNotExist('No %s matches %s.' % (self.model._meta.object_name, lookup))
+        if len(matches) > 1:
+            raise self.model.MultipleObjectsReturned('%s %s match %s.' % (len(matches),
+                                                                          self.model._meta.object_name, lookup))
+        # A copy, so that callers can't change the registry:
+        return copy.deepcopy(matches[0])
+
+    def invalidate(self):
+        with self._lock:
+            self._accounts = None
+        cache.bump('admin_account')
+
+
+class AdminAccountManager(models.Manager):
+    _registry = None
+
+    @property
+    def registry(self) -> AdminAccountRegistry:
+        if AdminAccountManager._registry is None:
+            AdminAccountManager._registry = AdminAccountRegistry(self.model)
+        return AdminAccountManager._registry
+
+    def get_cached(self, **lookup):
+        """
+        Returns the admin account matching exact field lookups from the in-process registry,
+        e.g. get_cached(default=True). Makes no queries once the registry is loaded.
+        """
+        return self.registry.get(**lookup)
+
+    def allocate_index(self, account_id: int):
+        """
+        Atomically increments the account's current_index. Returns the previous value (None if it wasn't set).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE {table} a SET secret = jsonb_set(COALESCE(a.secret, '{{}}'), '{{current_index}}', "
+                "to_jsonb(COALESCE((o.previous #>> '{{}}')::int + 1, 0))) "
+                "FROM (SELECT id, secret -> 'current_index' AS previous FROM {table} WHERE id = %s FOR UPDATE) o "
+                "WHERE a.id = o.id RETURNING (o.previous #>> '{{}}')::int".format(table=self.model._meta.db_table),
+                [account_id])
+            row = cursor.fetchone()
+        if row is None:
+            raise self.model.DoesNotExist('No %s with id %s.' % (self.model._meta.object_name, account_id))
+        return row[0]
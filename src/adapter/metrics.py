@@ -0,0 +1,49 @@
+import threading
+from collections import defaultdict
+
+# In-process metrics, rendered in the Prometheus text format by the metrics endpoint.
+# Each web or worker process reports its own values.
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def register_gauge(name: str, callback, **labels):
+    """
+    Registers a callable that returns the gauge value when metrics are rendered.
+    """
+    with _lock:
+        _gauges[_key(name, labels)] = callback
+
+
+def counter_value(name: str, **labels) -> float:
+    return _counters.get(_key(name, labels), 0)
+
+
+def _format(name: str, labels, value) -> str:
+    if labels:
+        name += '{%s}' % ','.join('%s="%s"' % (k, v) for k, v in labels)
+    return '%s %s' % (name, value)
+
+
+def render() -> str:
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items(), key=lambda item: item[0])
+
+    lines = [_format(name, labels, value) for (name, labels), value in counters]
+    for (name, labels), callback in gauges:
+        value = callback()
+        if value is not None:  # Gauges without a value yet are left out.
+            lines.append(_format(name, labels, value))
+    return '\n'.join(lines) + '\n'
@@ -1,16 +1,27 @@
+from datetime import timedelta
 from logging import getLogger
 
-from decimal import Decimal
+import requests
+from django.conf import settings
 from django.contrib.postgres.fields import JSONField
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from .api import Interface, WebhookReceiveInterface
+from . import cache, db, metrics, outbox, qr, webhooks
+from .amounts import Amount
+from .coins import DEFAULT_COIN, Coin, get_coin, is_enabled, payment_uri
+from .exceptions import DependencyUnavailableError, InvalidTransitionError
+from .managers import AdminAccountManager, TransactionPayloadManager, TransactionQuerySet
+from .payloads import PayloadModelMixin, payload_property, encode
 
 logger = getLogger('django')
 
 
+# No longer used by the models (amounts are integer units), kept for existing migrations.
 class MoneyField(models.DecimalField):
     """Decimal Field with hardcoded precision of 28 and a scale of 18."""
 
@@ -20,7 +31,7 @@ class MoneyField(models.DecimalField):
 
 
 # Log of all receive transactions processed.
-class ReceiveTransaction(models.Model):
+class ReceiveTransaction(PayloadModelMixin):
     STATUS = (
         ('Waiting', 'Waiting'),
         ('Pending', 'Pending'),
@@ -28,71 +39,259 @@ class ReceiveTransaction(models.Model):
         ('Complete', 'Complete'),  # Confirmed and uploaded to rehive
         ('Failed', 'Failed'),
     )
+    # Allowed status transitions (from -> to). Failed transactions can be retried.
+    TRANSITIONS = {
+        None: ('Waiting', 'Pending'),
+        'Waiting': ('Pending', 'Failed'),
+        'Pending': ('Confirmed', 'Failed'),
+        'Confirmed': ('Complete', 'Failed'),
+        'Complete': (),
+        'Failed': ('Pending', 'Confirmed'),
+    }
+    TERMINAL_STATUSES = ('Confirmed', 'Complete', 'Failed')
+    PAYLOAD_TYPE = 'receive'
+    PAYLOAD_FIELDS = ('rehive_response', 'data', 'metadata')
+    SUMMARY_FIELDS = ('id', 'external_id', 'rehive_code', 'amount', 'currency', 'status', 'created',
+                      'user_account', 'user_account__rehive_id')
+
     user_account = models.ForeignKey('adapter.UserAccount')
     external_id = models.CharField(max_length=100, null=True, blank=True, db_index=True)
     rehive_code = models.CharField(max_length=100, null=True, blank=True, db_index=True)
     recipient = models.CharField(max_length=200, null=True, blank=True)
-    amount = MoneyField(default=Decimal(0))
+    amount = models.BigIntegerField(default=0)  # In units, e.g. satoshis.
+    divisibility = models.PositiveSmallIntegerField(default=8)
     currency = models.CharField(max_length=200, null=True, blank=True)
     issuer = models.CharField(max_length=200, null=True, blank=True)
-    rehive_response = JSONField(null=True, blank=True, default={})
     status = models.CharField(max_length=24, choices=STATUS, null=True, blank=True, db_index=True)
-    data = JSONField(null=True, blank=True, default={})
-    metadata = JSONField(null=True, blank=True, default={})
+    created = models.DateTimeField(auto_now_add=True, null=True, blank=True, db_index=True)
+    updated = models.DateTimeField(auto_now=True, null=True, blank=True, db_index=True)
+
+    # Raw payloads, stored in TransactionPayload and loaded on demand:
+    rehive_response = payload_property('rehive_response')
+    data = payload_property('data')
+    metadata = payload_property('metadata')
+
+    objects = TransactionQuerySet.as_manager()
+
+    def get_amount(self) -> Amount:
+        return Amount(self.amount, self.divisibility)
+
+    def save(self, *args, **kwargs):
+        created = not self.id
+        with transaction.atomic():
+            super(ReceiveTransaction, self).save(*args, **kwargs)
+            if created:
+                ReceiveTransactionTransition.objects.create(transaction_id=self.id,
+                                                            from_status=None,
+                                                            to_status=self.status,
+                                                            cause='created')
+
+    def transition(self, to_status: str, cause: str = '', **fields) -> bool:
+        """
+        Move the transaction to `to_status` with a conditional update of the status column
+        (and any extra `fields`). The full row, including the blockchain payload, is not rewritten.
+        Payloads passed in `fields` are written to the payload table.
+
+        Returns False if the row was changed by someone else since it was loaded.
+        """
+        from_status = self.status
+        if to_status not in self.TRANSITIONS.get(from_status, ()):
+            raise InvalidTransitionError('Invalid status transition: %s -> %s' % (from_status, to_status))
+
+        payloads = {name: fields.pop(name) for name in self.PAYLOAD_FIELDS if name in fields}
+        fields['updated'] = timezone.now()
+
+        with transaction.atomic():
+            updated = ReceiveTransaction.objects.filter(id=self.id, status=from_status)\
+                .update(status=to_status, **fields)
+            if not updated:
+                logger.info('Transaction %s is no longer %s, skipping transition to %s.'
+                            % (self.id, from_status, to_status))
+                return False
+
+            ReceiveTransactionTransition.objects.create(transaction_id=self.id,
+                                                        from_status=from_status,
+                                                        to_status=to_status,
+                                                        cause=cause)
+
+            for name, value in payloads.items():
+                setattr(self, name, value)
+            self.save_payloads()
+
+        self.status = to_status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        if to_status in self.TERMINAL_STATUSES:
+            user_account_id, external_id = self.user_account_id, self.external_id
+            transaction.on_commit(lambda: webhooks.remember_status(user_account_id, external_id, to_status))
+        return True
 
     def upload_to_rehive(self):
-        from .tasks import create_or_confirm_rehive_receive
-        self.refresh_from_db()
-        if not self.rehive_code:
-            if self.status == 'Pending':
-                create_or_confirm_rehive_receive.delay(self.id, confirm=False)
+        """
+        Queues the Rehive upload for the current status through the outbox.
+        Call it in the database transaction that changed the status.
+
+        Creating isn't idempotent, so it is queued once per transaction. A transaction confirmed while its
+        create is in flight is confirmed by the create task (see create_or_confirm_rehive_receive).
+        """
+        if self.status == 'Confirmed' and not self.rehive_code:
+            # The row is locked by the status change, so a create that just finished is seen here:
+            self.rehive_code = ReceiveTransaction.objects.filter(id=self.id)\
+                .values_list('rehive_code', flat=True).get()
+
+        if not self.rehive_code and self.status in ('Pending', 'Confirmed'):
+            dedup_key = 'receive:%s:create' % self.id
+        elif self.status == 'Confirmed':
+            dedup_key = 'receive:%s:confirm:%s' % (self.id, self.updated.isoformat())
         else:
-            if self.status == 'Confirmed':
-                create_or_confirm_rehive_receive.delay(self.id, confirm=True)
+            return
+
+        outbox.enqueue('adapter.create_or_confirm_rehive_receive.task',
+                       dedup_key=dedup_key,
+                       tx_id=self.id,
+                       confirm=self.status == 'Confirmed',
+                       currency=self.currency)
+
+
+# Append-only audit log of receive transaction status changes.
+# No database constraint on the transaction so that the transaction table can be partitioned.
+class ReceiveTransactionTransition(models.Model):
+    transaction = models.ForeignKey('adapter.ReceiveTransaction', related_name='transitions', db_constraint=False)
+    from_status = models.CharField(max_length=24, null=True, blank=True)
+    to_status = models.CharField(max_length=24, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    cause = models.CharField(max_length=100, blank=True)
+
+
+# Task messages, written in the same database transaction as the change that causes them.
+class OutboxMessage(models.Model):
+    task = models.CharField(max_length=100)
+    kwargs = JSONField(null=True, blank=True, default={})
+    dedup_key = models.CharField(max_length=100, unique=True)
+    created = models.DateTimeField(auto_now_add=True)
+    claimed = models.DateTimeField(null=True, blank=True)
+    dispatched = models.DateTimeField(null=True, blank=True, db_index=True)
+    attempts = models.IntegerField(default=0)
+
+
+# Raw transaction payloads, kept out of the transaction tables so that they stay narrow.
+# tx_id is the id of the ReceiveTransaction or SendTransaction (by tx_type), without a foreign key so that the
+# transaction tables can be partitioned. Payloads are deleted with their transaction (delete_transaction_payloads)
+# and moved out with detached partitions (the detach action of transaction_partitions).
+class TransactionPayload(models.Model):
+    TYPE = (
+        ('receive', 'Receive'),
+        ('send', 'Send'),
+    )
+    tx_type = models.CharField(max_length=10, choices=TYPE)
+    tx_id = models.IntegerField()
+    name = models.CharField(max_length=24)  # e.g. data, metadata, rehive_response
+    compressed = models.BooleanField(default=False)
+    content = models.BinaryField()
+
+    objects = TransactionPayloadManager()
+
+    class Meta:
+        unique_together = ('tx_type', 'tx_id', 'name')
+
+    @classmethod
+    def build(cls, tx_type: str, tx_id: int, name: str, value) -> 'TransactionPayload':
+        content, compressed = encode(value)
+        return cls(tx_type=tx_type, tx_id=tx_id, name=name, content=content, compressed=compressed)
 
 
 # Log of all processed sends.
-class SendTransaction(models.Model):
+class SendTransaction(PayloadModelMixin):
     STATUS = (
         ('Pending', 'Pending'),
         ('Complete', 'Complete'),
+        ('Failed', 'Failed'),
     )
     TYPE = (
         ('send', 'Send'),
         ('receive', 'Receive'),
     )
+    PAYLOAD_TYPE = 'send'
+    PAYLOAD_FIELDS = ('rehive_request', 'data', 'metadata')
+    SUMMARY_FIELDS = ('id', 'external_id', 'rehive_code', 'recipient', 'amount', 'currency', 'status', 'created',
+                      'admin_account', 'admin_account__name')
+
     admin_account = models.ForeignKey('adapter.AdminAccount')
     external_id = models.CharField(max_length=100, null=True, blank=True, db_index=True)
-    rehive_code = models.CharField(max_length=100, null=True, blank=True, db_index=True)
+    # Unique: the claim that keeps a retried send webhook from sending twice (see SendView).
+    rehive_code = models.CharField(max_length=100, null=True, blank=True, unique=True)
     recipient = models.CharField(max_length=200, null=True, blank=True)
-    amount = MoneyField(default=Decimal(0))
+    amount = models.BigIntegerField(default=0)  # In units, e.g. satoshis.
+    divisibility = models.PositiveSmallIntegerField(default=8)
     currency = models.CharField(max_length=200, null=True, blank=True)
     issuer = models.CharField(max_length=200, null=True, blank=True)
-    rehive_request = JSONField(null=True, blank=True, default={})
-    data = JSONField(null=True, blank=True, default={})
-    metadata = JSONField(null=True, blank=True, default={})
+    status = models.CharField(max_length=24, choices=STATUS, null=True, blank=True, db_index=True,
+                              default='Pending')
+    created = models.DateTimeField(auto_now_add=True, null=True, blank=True, db_index=True)
+    updated = models.DateTimeField(auto_now=True, null=True, blank=True, db_index=True)
+
+    # Raw payloads, stored in TransactionPayload and loaded on demand:
+    rehive_request = payload_property('rehive_request')
+    data = payload_property('data')
+    metadata = payload_property('metadata')
+
+    objects = TransactionQuerySet.as_manager()
+
+    def get_amount(self) -> Amount:
+        return Amount(self.amount, self.divisibility)
 
     def save(self, *args, **kwargs):
         if not self.id:  # On create
-            self.admin_account = AdminAccount.objects.get(default=True)
+            # Currencies the adapter doesn't send (only records) use the default coin's account:
+            currency = self.currency if is_enabled(self.currency) else DEFAULT_COIN
+            self.admin_account = AdminAccount.objects.get_cached(default=True, currency=currency)
         return super(SendTransaction, self).save(*args, **kwargs)
 
     def execute(self):
         self.admin_account.send(self)
 
 
+@receiver(post_delete, sender=ReceiveTransaction, dispatch_uid="delete_receive_transaction_payloads")
+@receiver(post_delete, sender=SendTransaction, dispatch_uid="delete_send_transaction_payloads")
+def delete_transaction_payloads(sender, instance, **kwargs):
+    TransactionPayload.objects.filter(tx_type=instance.PAYLOAD_TYPE, tx_id=instance.id).delete()
+
+
 # Accounts for identifying Rehive users.
 # Passive account, receive only.
 class UserAccount(models.Model):
     rehive_id = models.CharField(max_length=100, null=True, blank=True)  # id for identifying user on rehive
     account_id = models.CharField(max_length=200, null=True, blank=True)  # crypto address
     admin_account = models.ForeignKey('adapter.AdminAccount')
+    currency = models.CharField(max_length=12, default=DEFAULT_COIN, db_index=True)  # Rehive currency code
     metadata = JSONField(null=True, blank=True, default={})
+    address_index = models.IntegerField(null=True, blank=True)  # Derivation index of the address on the MPK
+    # Last time the account was shown or received funds. Webhooks of dormant accounts are expired.
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ('rehive_id', 'currency')
+
+    @property
+    def coin(self) -> Coin:
+        return get_coin(self.currency)
+
+    def touch(self):
+        """
+        Records activity on the account, writing at most once every ADAPTER_ACTIVITY_RESOLUTION seconds.
+        """
+        now = timezone.now()
+        resolution = timedelta(seconds=getattr(settings, 'ADAPTER_ACTIVITY_RESOLUTION', 60 * 60))
+        if self.last_activity and now - self.last_activity < resolution:
+            return
+        UserAccount.objects.filter(id=self.id).update(last_activity=now)
+        self.last_activity = now
 
     def save(self, *args, **kwargs):
         if not self.id:  # On create
             logger.info('Fetching account_id.')
-            self.admin_account = AdminAccount.objects.get(name='receive_mpk')  # TODO: Make this more generic
+            # TODO: Make this more generic
+            self.admin_account = AdminAccount.objects.get_cached(name='receive_mpk', currency=self.currency)
             self._new_account_id()
         return super(UserAccount, self).save(*args, **kwargs)
 
@@ -101,6 +300,14 @@ class UserAccount(models.Model):
 
         # Get and save user account ID:
         self.account_id = interface.get_user_account_id()
+        self.address_index = getattr(interface, 'index', None)
+        metrics.inc('adapter_user_accounts_created_total', currency=self.currency)
+
+        # Render the QR code now, so that account responses never wait for it:
+        try:
+            qr.precompute(payment_uri(self.coin, self.account_id))
+        except OSError as exc:
+            logger.warning('Could not store QR code for %s: %s' % (self.account_id, exc))
 
         return self.account_id
 
@@ -109,13 +316,31 @@ class UserAccount(models.Model):
         webhooks = WebhookReceiveInterface(account=self)
         webhooks.subscribe_to_all()
 
+    def activate_hooks(self) -> bool:
+        """
+        Subscribes the account to its receive webhooks unless it already has them. Returns whether it subscribed.
+        """
+        if self.receivewebhook_set.exists():
+            return False
+
+        logger.info('Subscribing to webhooks for receive transactions')
+        metrics.inc('adapter_hook_activations_total', currency=self.currency)
+        try:
+            self.subscribe_to_hooks()
+        except (DependencyUnavailableError, requests.RequestException, KeyError) as exc:
+            # Don't fail the request while BlockCypher is down or erroring, subscribe in the background:
+            logger.warning('Deferring webhook subscription for account %s: %r' % (self.id, exc))
+            outbox.enqueue('adapter.subscribe_to_receive_hooks.task', dedup_key='hooks:%s' % self.id,
+                           account_id=self.id)
+        return True
+
 
 @receiver(post_save, sender=UserAccount, dispatch_uid="subscribe_to_receive_hooks")
 def subscribe_to_receive_hooks(sender, instance, created, **kwargs):
+    # Accounts are subscribed when their address is first shown, unless activation is eager.
     # Kwargs raw is used to check if data is loaded from fixtures.
-    if created and not kwargs.get('raw', False):
-        logger.info('Subscribing to webhooks for receive transactions')
-        instance.subscribe_to_hooks()
+    if created and not kwargs.get('raw', False) and getattr(settings, 'ADAPTER_HOOK_ACTIVATION', 'lazy') == 'eager':
+        instance.activate_hooks()
 
 # HotWallet/ Operational Accounts for sending or receiving on behalf of users.
 # Admin accounts usually have a secret key to authenticate with third-party provider (or XPUB for key generation).
@@ -125,16 +350,27 @@ class AdminAccount(models.Model):
     type = models.CharField(max_length=100, null=True, blank=True)  # some more descriptive info.
     secret = JSONField(null=True, blank=True, default={})  # crypto seed, private key or XPUB
     metadata = JSONField(null=True, blank=True, default={})
-    default = models.BooleanField(default=False)
+    default = models.BooleanField(default=False)  # Default account of its currency.
+    currency = models.CharField(max_length=12, default=DEFAULT_COIN, db_index=True)  # Rehive currency code
+
+    objects = AdminAccountManager()
+
+    @property
+    def coin(self) -> Coin:
+        return get_coin(self.currency)
 
     def send(self, tx: SendTransaction) -> bool:
-        from .tasks import confirm_rehive_transaction
         """
         Initiates a send transaction using the Admin account.
         """
         interface = Interface(account=self)
         interface.send(tx)
-        confirm_rehive_transaction(tx_id=tx.id, tx_type='send')
+        cache.delete('balance', interface.get_account_id())
+        # Broadcast, so confirmed on Rehive in the background under the retry policy:
+        outbox.enqueue('adapter.confirm_rehive_tx.task', dedup_key='send:%s:confirm' % tx.id,
+                       tx_id=tx.id,
+                       tx_type='send',
+                       currency=tx.currency)
         return True
 
     # Return account id (e.g. Bitcoin address)
@@ -150,8 +386,33 @@ class AdminAccount(models.Model):
         return interface.get_balance()
 
 
+@receiver(post_delete, sender=UserAccount, dispatch_uid="invalidate_user_account_cache")
+def invalidate_user_account_cache(sender, instance, **kwargs):
+    # Cached account responses are keyed on the request host too, so drop them all:
+    cache.bump('user_account')
+
+
+@receiver(post_save, sender=AdminAccount, dispatch_uid="invalidate_admin_account_cache")
+@receiver(post_delete, sender=AdminAccount, dispatch_uid="invalidate_admin_account_cache_on_delete")
+def invalidate_admin_account_cache(sender, instance, **kwargs):
+    AdminAccount.objects.registry.invalidate()
+    # The secret (and so the derived address) may have changed:
+    cache.bump('operating_address')
+
+
 class ReceiveWebhook(models.Model):
     webhook_type = models.CharField(max_length=50, null=True, blank=True)
     webhook_id = models.CharField(max_length=50, null=True, blank=True)
     user_account = models.ForeignKey(UserAccount)
     callback_url = models.CharField(max_length=150, blank=False)
+    created = models.DateTimeField(auto_now_add=True, null=True, blank=True, db_index=True)
+
+
+@receiver(request_started, dispatch_uid="check_db_connections")
+def check_db_connections(sender, **kwargs):
+    db.check_connections()
+
+
+@receiver(request_finished, dispatch_uid="mark_db_connections_healthy")
+def mark_db_connections_healthy(sender, **kwargs):
+    db.mark_healthy()
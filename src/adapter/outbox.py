@@ -0,0 +1,76 @@
+from datetime import timedelta
+from logging import getLogger
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = getLogger('django')
+
+
+def enqueue(task: str, dedup_key: str, **kwargs):
+    """
+    Writes a task message to the outbox as part of the current database transaction.
+    A dedup key is sent only once, callers that need to send again use a new key.
+    The message is sent when the transaction commits, the relay process picks up anything that isn't.
+    """
+    from .models import OutboxMessage
+    message, created = OutboxMessage.objects.get_or_create(dedup_key=dedup_key,
+                                                           defaults={'task': task, 'kwargs': kwargs})
+    if created:
+        transaction.on_commit(lambda: _send_on_commit(message.id))
+
+
+def _send_on_commit(message_id: int):
+    from .models import OutboxMessage
+    try:
+        send(claim(OutboxMessage.objects.filter(id=message_id)))
+    except Exception:
+        logger.exception('Outbox message %s not sent, the relay process will send it.' % message_id)
+
+
+def claim(queryset, limit: int = None) -> list:
+    """
+    Claims the unsent messages of the queryset in a short transaction, so that no row locks are held while
+    they are published. Claims expire after ADAPTER_OUTBOX_CLAIM_TIMEOUT seconds, e.g. of a relay that died.
+    """
+    from .models import OutboxMessage
+    now = timezone.now()
+    expired = now - timedelta(seconds=getattr(settings, 'ADAPTER_OUTBOX_CLAIM_TIMEOUT', 60))
+    with transaction.atomic():
+        messages = list(queryset.select_for_update()
+                        .filter(Q(claimed__isnull=True) | Q(claimed__lt=expired), dispatched__isnull=True)
+                        .order_by('id')[:limit])
+        OutboxMessage.objects.filter(id__in=[m.id for m in messages])\
+            .update(claimed=now, attempts=F('attempts') + 1)
+    return messages
+
+
+def send(messages: list) -> int:
+    """
+    Publishes claimed messages and marks them as dispatched. If publishing fails part way through,
+    the claims of the unsent messages are released for the next relay (at-least-once).
+    Returns the number of messages sent.
+    """
+    from .models import OutboxMessage
+    sent = []
+    try:
+        for message in messages:
+            current_app.send_task(message.task, kwargs=message.kwargs)
+            sent.append(message.id)
+    finally:
+        OutboxMessage.objects.filter(id__in=sent).update(dispatched=timezone.now())
+        OutboxMessage.objects.filter(id__in=[m.id for m in messages if m.id not in sent]).update(claimed=None)
+    return len(sent)
+
+
+def relay(batch_size: int = None) -> int:
+    """
+    Sends a batch of pending outbox messages to the broker.
+    Returns the number of messages sent.
+    """
+    from .models import OutboxMessage
+    batch_size = batch_size or getattr(settings, 'ADAPTER_OUTBOX_BATCH_SIZE', 100)
+    return send(claim(OutboxMessage.objects.all(), limit=batch_size))
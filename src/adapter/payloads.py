@@ -0,0 +1,80 @@
+import json
+import zlib
+
+from django.conf import settings
+from django.db import models, transaction
+
+
+def encode(value) -> (bytes, bool):
+    """
+    Serialize a payload to bytes, compressing it if it is large enough.
+    Returns the content and whether it was compressed.
+    """
+    content = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    if getattr(settings, 'ADAPTER_PAYLOAD_COMPRESSION', True) and \
+            len(content) >= getattr(settings, 'ADAPTER_PAYLOAD_COMPRESSION_MIN_SIZE', 512):
+        return zlib.compress(content), True
+    return content, False
+
+
+def decode(content: bytes, compressed: bool):
+    content = bytes(content)
+    if compressed:
+        content = zlib.decompress(content)
+    return json.loads(content.decode('utf-8'))
+
+
+def payload_property(name: str):
+    """
+    Model property for a payload stored in the TransactionPayload side table.
+    The payload is only loaded when it is first accessed, and written on save.
+    """
+    def fget(instance):
+        payloads = instance.__dict__.setdefault('_payloads', {})
+        if name not in payloads:
+            if instance.id:
+                from .models import TransactionPayload
+                payloads[name] = TransactionPayload.objects.load(instance.PAYLOAD_TYPE, instance.id, name)
+            else:
+                payloads[name] = {}
+        return payloads[name]
+
+    def fset(instance, value):
+        instance.__dict__.setdefault('_payloads', {})[name] = value
+        instance.__dict__.setdefault('_dirty_payloads', set()).add(name)
+
+    return property(fget, fset)
+
+
+class PayloadModelMixin(models.Model):
+    """
+    Keeps raw payloads out of the model's own table. Subclasses set PAYLOAD_TYPE and
+    declare their payloads with `payload_property`.
+    """
+    PAYLOAD_TYPE = None
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        created = not self.id
+        with transaction.atomic():
+            super(PayloadModelMixin, self).save(*args, **kwargs)
+            self.save_payloads(created=created)
+
+    def save_payloads(self, created: bool = False):
+        """
+        Write payloads that were changed since they were loaded.
+        """
+        from .models import TransactionPayload
+        dirty = self.__dict__.pop('_dirty_payloads', set())
+        if not dirty:
+            return
+
+        payloads = self.__dict__['_payloads']
+        if created:
+            TransactionPayload.objects.bulk_create(
+                [TransactionPayload.build(self.PAYLOAD_TYPE, self.id, name, payloads[name]) for name in dirty])
+        else:
+            for name in dirty:
+                TransactionPayload.objects.store(self.PAYLOAD_TYPE, self.id, name, payloads[name])
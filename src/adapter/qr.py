@@ -0,0 +1,103 @@
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+from .cache import LRUCache
+
+# QR codes rendered by the adapter, stored by content hash so that they never change once served:
+# in memory, then on disk under ADAPTER_QR_DIR (a directory a CDN or web server can serve as static files).
+
+FORMATS = {
+    'svg': 'image/svg+xml',
+    'png': 'image/png',
+}
+
+BORDER = 4
+
+# Sizes (pixels) and the longest value codes are rendered for, which bounds the work one request can cause:
+SIZES = (150, 300, 600)
+MAX_VALUE_LENGTH = 256
+
+_memory = LRUCache(256, float('inf'))
+
+
+def qr_dir() -> str:
+    return getattr(settings, 'ADAPTER_QR_DIR', '') or os.path.join(settings.CACHE_DIR, 'qr')
+
+
+def digest(value: str, size: int = 300, fmt: str = 'svg') -> str:
+    # Keyed, so that only the adapter can name a code: the endpoint renders only the codes it linked to.
+    return salted_hmac('adapter.qr', '%s:%s:%s' % (fmt, size, value)).hexdigest()[:32]
+
+
+def renderable(value: str, size: int) -> bool:
+    return bool(value) and len(value) <= MAX_VALUE_LENGTH and size in SIZES
+
+
+def filename(value: str, size: int = 300, fmt: str = 'svg') -> str:
+    return '%s.%s' % (digest(value, size, fmt), fmt)
+
+
+def render(value: str, size: int = 300, fmt: str = 'svg') -> bytes:
+    if not renderable(value, size):
+        raise ValueError('Invalid QR code value or size: %s' % size)
+    # Imported on first render, most processes only serve stored codes:
+    import qrcode
+    from qrcode.image.svg import SvgPathImage
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=BORDER)
+    code.add_data(value)
+    code.make(fit=True)
+
+    stream = io.BytesIO()
+    if fmt == 'svg':
+        code.make_image(image_factory=SvgPathImage).save(stream)
+    else:
+        code.box_size = max(size // (code.modules_count + 2 * BORDER), 1)
+        code.make_image().save(stream)
+    return stream.getvalue()
+
+
+def load(name: str):
+    """
+    Returns a stored image by file name, or None.
+    """
+    content = _memory.get(name, None)
+    if content is not None:
+        return content
+    try:
+        with open(os.path.join(qr_dir(), os.path.basename(name)), 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    _memory.set(name, content)
+    return content
+
+
+def store(name: str, content: bytes):
+    directory = qr_dir()
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first, so that a partially written image is never served:
+    fd, path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(path, os.path.join(directory, name))
+    _memory.set(name, content)
+
+
+def get_or_render(value: str, size: int = 300, fmt: str = 'svg') -> bytes:
+    name = filename(value, size, fmt)
+    content = load(name)
+    if content is None:
+        content = render(value, size, fmt)
+        store(name, content)
+    return content
+
+
+def precompute(value: str, size: int = 300):
+    """
+    Renders the QR code in the default format ahead of the first request, e.g. when an address is allocated.
+    """
+    get_or_render(value, size, getattr(settings, 'ADAPTER_QR_FORMAT', 'svg'))
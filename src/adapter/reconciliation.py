@@ -0,0 +1,182 @@
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import clients, outbox
+from .coins import COINS, DEFAULT_COIN, Coin
+from .export import export_queryset, iter_rows
+from .models import ReceiveTransaction
+
+logger = getLogger('django')
+
+FIELDS = {
+    'receive': ('id', 'external_id', 'rehive_code', 'status', 'currency'),
+    'send': ('id', 'external_id', 'rehive_code', 'status', 'currency'),
+}
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def fetch_chain_state(tx_hashes, coin: Coin = None) -> dict:
+    """
+    Returns {tx hash: confirmations} for a batch of hashes on a coin's chain. Hashes unknown to the provider are
+    left out.
+    """
+    if not tx_hashes:
+        return {}
+    r = clients.blockcypher_request('GET', 'txs/' + ';'.join(tx_hashes), coin=coin)
+    if r.status_code == 404:
+        return {}
+    r.raise_for_status()
+    result = r.json()
+    if isinstance(result, dict):
+        result = [result]
+    return {tx['hash']: tx.get('confirmations', 0) for tx in result if 'hash' in tx}
+
+
+def fetch_rehive_state(tx_code: str):
+    """
+    Returns the Rehive status of a transaction, or None if Rehive doesn't know it.
+    """
+    r = clients.rehive_request('GET', '/admins/transactions/%s/' % tx_code)
+    if r.status_code == 404:
+        return None
+    r.raise_for_status()
+    data = r.json().get('data', {})
+    return data.get('status')
+
+
+def diff(tx_type: str, row: dict, chain: dict, rehive: dict):
+    """
+    Compares one adapter transaction with its chain and Rehive state.
+    Returns (mismatch kind, repair action) or None if the states agree.
+    """
+    status, tx_hash, tx_code = row['status'], row['external_id'], row['rehive_code']
+    confirmations = chain.get(tx_hash)
+    rehive_status = rehive.get(tx_code) if tx_code else None
+
+    if tx_hash and confirmations is None and status in ('Confirmed', 'Complete'):
+        return 'missing_on_chain', None
+    if tx_type == 'receive':
+        if status in ('Pending', 'Failed') and confirmations:
+            return 'unconfirmed_locally', 'confirm'
+        if not tx_code and status in ('Pending', 'Confirmed', 'Failed'):
+            return 'missing_on_rehive', 'upload'
+    if tx_code and rehive_status is None:
+        return 'missing_on_rehive', None
+    if status == 'Complete' and rehive_status != 'Complete':
+        return 'not_complete_on_rehive', 'upload' if tx_type == 'receive' else None
+    if status == 'Failed' and rehive_status == 'Complete':
+        return 'failed_locally', None
+    return None
+
+
+def repair(tx_type: str, tx_id: int, action: str):
+    """
+    Queues the tasks that bring the adapter and Rehive back in line.
+    """
+    tx = ReceiveTransaction.objects.get(id=tx_id)
+    if action == 'confirm':
+        with transaction.atomic():
+            if tx.transition('Confirmed', cause='reconcile'):
+                tx.upload_to_rehive()
+    elif action == 'upload' and tx.status == 'Failed':
+        # Not on chain and never created on Rehive: back to Pending, so it isn't flagged again, and created.
+        with transaction.atomic():
+            if tx.transition('Pending', cause='reconcile'):
+                _upload(tx)
+    elif action == 'upload':
+        _upload(tx)
+
+
+def _upload(tx: ReceiveTransaction):
+    # Not through upload_to_rehive, which creates a transaction only once. Uploaded again at most once a day,
+    # a repair that didn't help is reported by the next run:
+    confirm = tx.status in ('Confirmed', 'Complete')
+    outbox.enqueue('adapter.create_or_confirm_rehive_receive.task',
+                   dedup_key='reconcile:%s:%s:%s' % (tx.id, 'confirm' if confirm else 'create',
+                                                     timezone.now().date().isoformat()),
+                   tx_id=tx.id,
+                   confirm=confirm,
+                   currency=tx.currency)
+
+
+def reconcile(tx_type: str = 'receive', start=None, end=None, status=None, auto_repair: bool = False,
+              summary: Counter = None):
+    """
+    Streams adapter transactions in chunks, fetches their chain and Rehive state concurrently
+    and joins the three on tx hash and Rehive code. Memory use is bounded by the chunk size.
+
+    Yields a mismatch dict per transaction that doesn't agree, and counts results in `summary`.
+    """
+    chunk_size = getattr(settings, 'ADAPTER_RECONCILE_CHUNK_SIZE', 1000)
+    batch_size = getattr(settings, 'ADAPTER_RECONCILE_CHAIN_BATCH_SIZE', 25)
+    concurrency = getattr(settings, 'ADAPTER_RECONCILE_CONCURRENCY', 8)
+
+    summary = Counter() if summary is None else summary
+    rows = iter_rows(export_queryset(tx_type, status=status, start=start, end=end), FIELDS[tx_type],
+                     chunk_size=chunk_size)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for chunk in _chunks(rows, chunk_size):
+            hashes = defaultdict(set)
+            for row in chunk:
+                if row['external_id']:
+                    hashes[row['currency'] if row['currency'] in COINS else DEFAULT_COIN].add(row['external_id'])
+            codes = sorted({row['rehive_code'] for row in chunk if row['rehive_code']})
+
+            chain_futures = {executor.submit(fetch_chain_state, batch, COINS[code]): batch
+                             for code, coin_hashes in hashes.items()
+                             for batch in _chunks(sorted(coin_hashes), batch_size)}
+            rehive_futures = {code: executor.submit(fetch_rehive_state, code) for code in codes}
+
+            # A failed fetch only affects the transactions it was for, they are reported as fetch errors:
+            chain, failed_hashes = {}, set()
+            for future, batch in chain_futures.items():
+                try:
+                    chain.update(future.result())
+                except (requests.RequestException, ValueError) as exc:
+                    logger.warning('Could not fetch chain state of %s transactions: %s' % (len(batch), exc))
+                    failed_hashes.update(batch)
+            rehive, failed_codes = {}, set()
+            for code, future in rehive_futures.items():
+                try:
+                    rehive[code] = future.result()
+                except (requests.RequestException, ValueError) as exc:
+                    logger.warning('Could not fetch Rehive state of %s: %s' % (code, exc))
+                    failed_codes.add(code)
+
+            for row in chunk:
+                summary['checked'] += 1
+                if row['external_id'] in failed_hashes or row['rehive_code'] in failed_codes:
+                    result = 'fetch_error', None
+                else:
+                    result = diff(tx_type, row, chain, rehive)
+                if result is None:
+                    continue
+
+                kind, action = result
+                summary[kind] += 1
+                mismatch = dict(row, tx_type=tx_type, kind=kind, repair=action,
+                                confirmations=chain.get(row['external_id']),
+                                rehive_status=rehive.get(row['rehive_code']))
+                if auto_repair and action and tx_type == 'receive':
+                    repair(tx_type, row['id'], action)
+                    summary['repaired'] += 1
+                yield mismatch
+
+    logger.info('Reconciliation of %s transactions: %s' % (tx_type, dict(summary)))
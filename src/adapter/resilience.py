@@ -0,0 +1,202 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from logging import getLogger
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .exceptions import DependencyUnavailableError
+
+logger = getLogger('django')
+
+# Request outcome classes used by the retry policy:
+OK = 'ok'
+TRANSIENT = 'transient'  # Connection errors, timeouts and server errors: retry with backoff.
+RATE_LIMITED = 'rate_limited'  # Retry after the time the service asks for.
+PERMANENT = 'permanent'  # Client errors: retrying won't help.
+UNKNOWN = 'unknown'  # No response in time: a non-idempotent request may have been processed, don't retry it.
+
+
+def classify(response: requests.Response = None, exc: Exception = None, idempotent: bool = True) -> str:
+    if exc is not None:
+        if isinstance(exc, requests.exceptions.ReadTimeout) and not idempotent:
+            return UNKNOWN
+        if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return TRANSIENT
+        return PERMANENT
+
+    status = response.status_code
+    if status < 400:
+        return OK
+    if status == 429:
+        return RATE_LIMITED
+    if status >= 500 or status == 408:
+        return TRANSIENT
+    return PERMANENT
+
+
+def retry_after(response: requests.Response):
+    """
+    Returns the delay in seconds asked for by a Retry-After header, or None.
+    """
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - timezone.now()).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter, so that retries after an outage are spread out.
+    """
+    base = getattr(settings, 'ADAPTER_RETRY_BASE_DELAY', 30)
+    cap = getattr(settings, 'ADAPTER_RETRY_MAX_DELAY', 60 * 60)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. While open, requests are refused
+    until `reset_timeout` has passed, then a single trial request is let through (half-open):
+    success closes the circuit, failure opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}  # Gauge values.
+
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, 'ADAPTER_BREAKER_FAILURE_THRESHOLD', 5)
+        self.reset_timeout = reset_timeout or getattr(settings, 'ADAPTER_BREAKER_RESET_TIMEOUT', 60)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # Let a trial request through once the timeout passed (again, if a trial never reported back):
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def remaining(self) -> float:
+        """
+        Seconds until the circuit allows a trial request.
+        """
+        if self.state == self.CLOSED:
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning('Circuit %s opened after %s failures.' % (self.name, self.failures))
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Returns the process wide circuit breaker for a dependency (e.g. 'rehive', 'blockcypher').
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            breaker = CircuitBreaker(name)
+            metrics.register_gauge('adapter_circuit_state', lambda: CircuitBreaker.STATES[breaker.state],
+                                   dependency=name)
+            _breakers[name] = breaker
+        return _breakers[name]
+
+
+class Bulkhead:
+    """
+    Limits concurrent calls to a dependency, so that a slow dependency can't tie up every worker thread.
+    """
+    def __init__(self, name: str, size: int = None, timeout: float = None):
+        self.name = name
+        self.size = size or getattr(settings, 'ADAPTER_BULKHEAD_SIZE', 10)
+        self.timeout = getattr(settings, 'ADAPTER_BULKHEAD_TIMEOUT', 0.5) if timeout is None else timeout
+        self.in_use = 0
+        self._semaphore = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        if not self._semaphore.acquire(timeout=self.timeout):
+            return False
+        with self._lock:
+            self.in_use += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_use -= 1
+        self._semaphore.release()
+
+
+_bulkheads = {}
+
+
+def get_bulkhead(name: str) -> Bulkhead:
+    with _breakers_lock:
+        if name not in _bulkheads:
+            bulkhead = Bulkhead(name)
+            metrics.register_gauge('adapter_bulkhead_in_use', lambda: bulkhead.in_use, dependency=name)
+            _bulkheads[name] = bulkhead
+        return _bulkheads[name]
+
+
+@contextmanager
+def protect(name: str):
+    """
+    Runs a call to a dependency inside its bulkhead and circuit breaker.
+    Raises DependencyUnavailableError straight away if the circuit is open or no slot frees up in time.
+    """
+    breaker, bulkhead = get_breaker(name), get_bulkhead(name)
+    if not breaker.allow():
+        metrics.inc('adapter_dependency_rejected_total', dependency=name, reason='circuit_open')
+        raise DependencyUnavailableError('%s is unavailable.' % name)
+    if not bulkhead.acquire():
+        metrics.inc('adapter_dependency_rejected_total', dependency=name, reason='bulkhead_full')
+        raise DependencyUnavailableError('%s is busy.' % name)
+
+    try:
+        yield
+    except AssertionError:
+        # Input validation by the provider library, not a sign of an unhealthy dependency.
+        raise
+    except Exception:
+        breaker.record_failure()
+        metrics.inc('adapter_dependency_calls_total', dependency=name, result='failure')
+        raise
+    else:
+        breaker.record_success()
+        metrics.inc('adapter_dependency_calls_total', dependency=name, result='success')
+    finally:
+        bulkhead.release()
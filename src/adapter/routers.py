@@ -0,0 +1,56 @@
+import zlib
+
+from django.conf import settings
+
+from .coins import queue_name
+
+
+def shard_for(key, shards: int) -> int:
+    """
+    Shard number of a key. Stable across processes, unlike hash().
+    """
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+
+def _webhook_shard_key(kwargs: dict):
+    # The tx hash keeps the events of a transaction in order, the account id is the fallback:
+    data = kwargs.get('data') or {}
+    return data.get('hash') or kwargs.get('receive_id')
+
+
+# Tasks that can be sharded, with the function returning the shard key from the task kwargs:
+SHARD_KEYS = {'adapter.tasks.process_webhook_receive': _webhook_shard_key}
+
+
+def shards(task: str) -> int:
+    return max(getattr(settings, 'ADAPTER_TASK_SHARDS', {}).get(task, 1), 1)
+
+
+def task_queues(task: str, currency: str = None) -> list:
+    """
+    All queues a task can be routed to for a coin.
+    """
+    queue = queue_name(settings.ADAPTER_TASK_QUEUES[task], currency)
+    count = shards(task)
+    if count == 1 or task not in SHARD_KEYS:
+        return [queue]
+    return ['%s-%s' % (queue, shard) for shard in range(count)]
+
+
+class TaskRouter:
+    """
+    Routes tasks to a queue per coin (using their `currency` kwarg), so that one busy chain can't starve
+    the others. Sharded tasks are further spread over ADAPTER_TASK_SHARDS queues by a key (e.g. the tx hash).
+    Each shard queue has a single consumer, so messages with the same key are processed in order while
+    the shards run in parallel.
+    """
+    def route_for_task(self, task, args=None, kwargs=None):
+        base = getattr(settings, 'ADAPTER_TASK_QUEUES', {}).get(task)
+        if base is None:
+            return None
+        kwargs = kwargs or {}
+        queue = queue_name(base, kwargs.get('currency'))
+        count = shards(task)
+        if count > 1 and task in SHARD_KEYS:
+            queue = '%s-%s' % (queue, shard_for(SHARD_KEYS[task](kwargs), count))
+        return {'queue': queue}
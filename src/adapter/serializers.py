@@ -13,7 +13,7 @@ class TransactionSerializer(serializers.Serializer):
     from_user = serializers.CharField(required=True)
     to_user = serializers.CharField(required=False)
     status = serializers.CharField(required=True)
-    amount = serializers.CharField(required=True)
+    amount = serializers.IntegerField(required=True)  # In units of the currency's divisibility.
     fee = serializers.CharField(required=False)
     currency = serializers.CharField(required=True)
     company = serializers.CharField(required=True)
@@ -0,0 +1,240 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from logging import getLogger
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import cache, clients, outbox
+from .api import WebhookReceiveInterface
+from .coins import Coin
+from .exceptions import DependencyUnavailableError
+from .models import ReceiveWebhook, UserAccount
+from .resilience import protect
+
+logger = getLogger('django')
+
+
+class RateLimiter:
+    """
+    Spaces calls out to at most `rate` per second, shared by all threads.
+    """
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def list_hooks(coin: Coin, limiter: RateLimiter = None, page_size: int = None):
+    """
+    Yields the BlockCypher webhooks of the token on a coin's chain, fetching one page at a time.
+    """
+    page_size = page_size or getattr(settings, 'ADAPTER_HOOK_PAGE_SIZE', 200)
+    start = 0
+    while True:
+        if limiter:
+            limiter.wait()
+        with protect('blockcypher'):
+            r = clients.blockcypher_request('GET', 'hooks', coin=coin, params={'start': start, 'limit': page_size})
+        r.raise_for_status()
+        page = r.json()
+        for hook in page:
+            yield hook
+        if len(page) < page_size:
+            return
+        start += len(page)
+
+
+def plan(coin: Coin, remote: dict, dormant_after: timedelta = None, listed_at=None):
+    """
+    Diffs this deployment's remote hooks ({webhook id: hook}) against the ReceiveWebhook rows of a coin.
+
+    Returns (hooks to create as (account, event), remote hook ids to delete, ReceiveWebhook ids to delete,
+    remote hook ids unknown to the database): active accounts that were activated (or every active account with
+    eager ADAPTER_HOOK_ACTIVATION) get a hook per subscribed event, hooks of dormant accounts and duplicate hooks
+    are deleted, and rows of hooks BlockCypher no longer has are pruned.
+    Rows saved after `listed_at`, when the remote hooks were listed, are left alone: the listing may miss them.
+    """
+    remote = dict(remote)
+    accounts = UserAccount.objects.filter(currency=coin.code)
+    if dormant_after:
+        accounts = accounts.filter(last_activity__gte=timezone.now() - dormant_after)
+    active = {account.id: account for account in accounts.exclude(account_id=None).iterator()}
+
+    subscribed = defaultdict(set)
+    delete_hooks, delete_rows = [], []
+    rows = ReceiveWebhook.objects.filter(user_account__currency=coin.code) \
+        .values_list('id', 'webhook_id', 'webhook_type', 'user_account_id', 'created')
+    for row_id, webhook_id, webhook_type, account_id, created in rows.iterator():
+        listed = remote.pop(webhook_id, None) is not None
+        if listed_at and created and created >= listed_at:
+            subscribed[account_id].add(webhook_type)
+        elif not listed:
+            delete_rows.append(row_id)
+        elif account_id not in active or webhook_type in subscribed[account_id]:
+            delete_hooks.append(webhook_id)
+            delete_rows.append(row_id)
+        else:
+            subscribed[account_id].add(webhook_type)
+
+    # Accounts without hooks are activated once their address is used, see scan_unsubscribed:
+    eager = getattr(settings, 'ADAPTER_HOOK_ACTIVATION', 'lazy') == 'eager'
+    create = [(account, event) for account_id, account in active.items() if eager or subscribed.get(account_id)
+              for event in WebhookReceiveInterface.SUBSCRIBED_EVENTS if event not in subscribed[account_id]]
+    # Left over remote hooks are unknown to the database:
+    return create, delete_hooks, delete_rows, list(remote)
+
+
+def scan_unsubscribed(coin: Coin, limiter: RateLimiter = None, summary: Counter = None) -> Counter:
+    """
+    Checks the addresses of accounts without hooks, not activated yet or expired while dormant, for transactions
+    the adapter hasn't seen, in batches of ADAPTER_ADDRESS_SCAN_BATCH_SIZE. Accounts with new transactions are
+    activated (see reactivate).
+    """
+    summary = Counter() if summary is None else summary
+    batch_size = getattr(settings, 'ADAPTER_ADDRESS_SCAN_BATCH_SIZE', 50)
+    accounts = UserAccount.objects.filter(currency=coin.code, receivewebhook__isnull=True) \
+        .exclude(account_id=None).annotate(known=Count('receivetransaction', distinct=True))
+
+    batch = []
+    for account in accounts.iterator():
+        batch.append(account)
+        if len(batch) == batch_size:
+            _scan_batch(coin, batch, limiter, summary)
+            batch = []
+    if batch:
+        _scan_batch(coin, batch, limiter, summary)
+    return summary
+
+
+def _scan_batch(coin: Coin, accounts: list, limiter: RateLimiter, summary: Counter):
+    by_address = {account.account_id: account for account in accounts}
+    try:
+        if limiter:
+            limiter.wait()
+        with protect('blockcypher'):
+            r = clients.blockcypher_request('GET', 'addrs/%s/balance' % ';'.join(by_address), coin=coin)
+        r.raise_for_status()
+        result = r.json()
+        for address in [result] if isinstance(result, dict) else result:
+            account = by_address.get(address.get('address'))
+            # final_n_tx includes unconfirmed transactions, addresses of user accounts only receive:
+            if account and address.get('final_n_tx', 0) > account.known:
+                reactivate(account, limiter)
+                summary['reactivated'] += 1
+    except (DependencyUnavailableError, requests.RequestException) as exc:
+        summary['errors'] += 1
+        logger.warning('Could not scan addresses: %s' % exc)
+    summary['scanned'] += len(accounts)
+
+
+def reactivate(account: UserAccount, limiter: RateLimiter = None):
+    """
+    Processes the transactions of an address the adapter hasn't seen as confirmation webhooks, records the
+    activity and subscribes the account to its hooks.
+    """
+    if limiter:
+        limiter.wait()
+    with protect('blockcypher'):
+        r = clients.blockcypher_request('GET', 'addrs/%s/full' % account.account_id, coin=account.coin)
+    r.raise_for_status()
+    known = set(account.receivetransaction_set.values_list('external_id', flat=True))
+    with transaction.atomic():
+        account.touch()
+        for tx in r.json().get('txs', []):
+            if tx['hash'] not in known:
+                logger.info('Found transaction %s of unsubscribed account %s.' % (tx['hash'], account.id))
+                outbox.enqueue('adapter.tasks.process_webhook_receive',
+                               dedup_key='scan:%s:%s' % (account.id, tx['hash']),
+                               webhook_type='confirmations',
+                               receive_id=account.id,
+                               data=tx,
+                               currency=account.currency)
+    account.activate_hooks()
+
+
+def sync(coin: Coin, dormant_after: timedelta = None, dry_run: bool = False, summary: Counter = None) -> Counter:
+    """
+    Brings the BlockCypher webhooks of a coin in line with its active user accounts.
+
+    Remote hooks are listed in pages and diffed against ReceiveWebhook, then missing hooks are created
+    and unwanted ones deleted concurrently, within ADAPTER_HOOK_SYNC_RATE requests per second.
+    Only hooks with a callback to this deployment are considered, the token may be shared.
+    The addresses of accounts without hooks are then scanned for deposits (see scan_unsubscribed).
+    `dormant_after` defaults to ADAPTER_HOOK_DORMANT_DAYS, False keeps the hooks of dormant accounts.
+    """
+    summary = Counter() if summary is None else summary
+    if dormant_after is None:
+        days = getattr(settings, 'ADAPTER_HOOK_DORMANT_DAYS', 90)
+        dormant_after = timedelta(days=days) if days else None
+    limiter = RateLimiter(getattr(settings, 'ADAPTER_HOOK_SYNC_RATE', 3))
+    concurrency = getattr(settings, 'ADAPTER_HOOK_SYNC_CONCURRENCY', 8)
+
+    base_url = WebhookReceiveInterface.callback_base_url()
+    listed_at = timezone.now()
+    remote = {hook['id']: hook for hook in list_hooks(coin, limiter) if hook.get('url', '').startswith(base_url)}
+    create, delete_hooks, delete_rows, unknown = plan(coin, remote, dormant_after, listed_at)
+    # A hook created while listing has no row until its subscription saves it, so unknown hooks are only deleted
+    # when the previous sync didn't know them either:
+    previously_unknown = set(cache.get('hook_sync', coin.code) or ())
+    delete_hooks.extend(webhook_id for webhook_id in unknown if webhook_id in previously_unknown)
+    summary.update({'remote': len(remote), 'to_create': len(create), 'to_delete': len(delete_hooks),
+                    'to_prune': len(delete_rows), 'unknown': len(unknown)})
+    if dry_run:
+        return summary
+    cache.set('hook_sync', coin.code, [webhook_id for webhook_id in unknown if webhook_id not in previously_unknown])
+
+    def create_hook(account, event):
+        limiter.wait()
+        return WebhookReceiveInterface(account=account).create_hook(event)
+
+    def delete_hook(webhook_id):
+        limiter.wait()
+        return WebhookReceiveInterface.delete_hook(webhook_id, coin)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        delete_futures = [executor.submit(delete_hook, webhook_id) for webhook_id in delete_hooks]
+        create_futures = [executor.submit(create_hook, account, event) for account, event in create]
+
+        for future in delete_futures:
+            try:
+                future.result()
+                summary['deleted'] += 1
+            except (DependencyUnavailableError, requests.RequestException) as exc:
+                summary['errors'] += 1
+                logger.warning('Could not delete webhook: %s' % exc)
+
+        created = []
+        for future in create_futures:
+            try:
+                created.append(future.result())
+            except (DependencyUnavailableError, requests.RequestException) as exc:
+                summary['errors'] += 1
+                logger.warning('Could not create webhook: %s' % exc)
+
+    # Rows of hooks that failed to delete are pruned too: the next sync deletes them as unknown hooks.
+    for start in range(0, len(delete_rows), 1000):
+        ReceiveWebhook.objects.filter(id__in=delete_rows[start:start + 1000]).delete()
+    ReceiveWebhook.objects.bulk_create(created, batch_size=1000)
+    summary['created'] += len(created)
+    summary['pruned'] += len(delete_rows)
+
+    # Deposits to the addresses of accounts without hooks are found by scanning them:
+    scan_unsubscribed(coin, limiter, summary)
+
+    logger.info('Webhook sync of %s: %s' % (coin.code, dict(summary)))
+    return summary
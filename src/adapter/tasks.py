@@ -1,26 +1,134 @@
+import random
+
 import requests
 from celery import shared_task
 
 import logging
+from collections import Counter
+from datetime import timedelta
 
-from decimal import Decimal
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 
-from .utils import from_cents, to_cents
+from .amounts import sum_outputs
 from .models import ReceiveTransaction, SendTransaction, UserAccount
 
-from .exceptions import PlatformRequestFailedError
+from . import clients, coins, gap, subscriptions, webhooks
+from .exceptions import DependencyUnavailableError, InvalidTransitionError, PlatformRequestFailedError, \
+    PlatformRequestOutcomeUnknownError
+from .outbox import relay
+from .reconciliation import reconcile
+from .resilience import OK, PERMANENT, TRANSIENT, UNKNOWN, backoff, classify, get_breaker, retry_after
 
 logger = logging.getLogger('django')
 
+def _set_status(tx, status: str, cause: str, rehive_response: dict):
+    """
+    Store the Rehive response and move the transaction to the new status.
+    """
+    if isinstance(tx, ReceiveTransaction):
+        if tx.status == status:  # e.g. a repeated confirmation
+            tx.rehive_response = rehive_response
+            tx.save_payloads()
+        else:
+            try:
+                tx.transition(status, cause=cause, rehive_response=rehive_response)
+            except InvalidTransitionError as e:
+                logger.warning(str(e))
+    else:
+        tx.rehive_response = rehive_response
+        tx.status = status
+        tx.save()
+
+
+def _rehive_post(task, path: str, payload: dict, idempotent: bool = True):
+    """
+    Post to Rehive under the retry policy.
+
+    Returns the response if the request succeeded or failed with a permanent error response. Transient
+    errors are retried with exponential backoff and rate limited requests after their Retry-After time
+    (raises Retry, or DependencyUnavailableError once the retries are exhausted). While the Rehive circuit
+    is open the task is parked on the delay queue instead and None is returned, up to ADAPTER_MAX_PARKED
+    times (then raises DependencyUnavailableError). Requests that can't be sent at all (e.g. an invalid URL)
+    raise PlatformRequestFailedError, non-idempotent requests that time out PlatformRequestOutcomeUnknownError.
+    """
+    breaker = get_breaker('rehive')
+    if not breaker.allow():
+        # Re-applied tasks start with fresh retries, so the parks are counted in the kwargs:
+        kwargs = dict(task.request.kwargs or {})
+        kwargs['parked'] = kwargs.get('parked', 0) + 1
+        if kwargs['parked'] > getattr(settings, 'ADAPTER_MAX_PARKED', 48):
+            logger.warning('Rehive circuit still open after parking %s %s times.' % (task.name, kwargs['parked'] - 1))
+            raise DependencyUnavailableError()
+        # Spread parked tasks out so that they don't all hit Rehive when it recovers:
+        countdown = breaker.remaining() + random.uniform(0, breaker.reset_timeout)
+        logger.info('Rehive circuit open, parking %s for %.0fs.' % (task.name, countdown))
+        task.apply_async(args=task.request.args, kwargs=kwargs, countdown=countdown,
+                         queue=settings.ADAPTER_DELAY_QUEUE)
+        return None
+
+    r = None
+    try:
+        r = clients.rehive_request('POST', path, json=payload)
+        kind = classify(response=r)
+    except requests.exceptions.RequestException as e:
+        kind = classify(exc=e, idempotent=idempotent)
+        if kind == PERMANENT:
+            logger.warning('Rehive request failed permanently: %s' % e)
+            raise PlatformRequestFailedError()
+        if kind == UNKNOWN:
+            breaker.record_failure()
+            logger.warning('Rehive request timed out, not retried as it may have been processed: %s' % e)
+            raise PlatformRequestOutcomeUnknownError()
+
+    if kind == TRANSIENT:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+    if kind in (OK, PERMANENT):
+        return r
+
+    countdown = retry_after(r)
+    if countdown is None:
+        countdown = backoff(task.request.retries)
+    logger.info('Retry Rehive request (%s) in %.0fs.' % (kind, countdown))
+    raise task.retry(countdown=countdown, exc=DependencyUnavailableError())
+
+
+def _confirm_on_rehive(task, tx):
+    logger.info('Transaction update request.')
+    try:
+        r = _rehive_post(task, '/admins/transactions/update/', {'tx_code': tx.rehive_code, 'status': 'Confirmed'})
+    except DependencyUnavailableError:
+        # Not a failure of the transaction, e.g. a send is already broadcast. Reconciliation confirms it later.
+        logger.warning('Rehive unavailable, transaction %s left %s.' % (tx.id, tx.status))
+        return
+    except PlatformRequestFailedError:
+        logger.info('Final transaction update request failure.')
+        _set_status(tx, 'Failed', 'rehive:confirm:request_failed', {})
+        return
+
+    if r is None:
+        return
+    if r.status_code in (200, 201):
+        _set_status(tx, 'Complete', 'rehive:confirm', r.json())
+    else:
+        logger.info('Failed transaction update request: HTTP %s Error: %s' % (r.status_code, r.text))
+        _set_status(tx, 'Failed', 'rehive:confirm:%s' % r.status_code,
+                    {'status': r.status_code, 'data': r.text})
+
+
 @shared_task
 def default_task():
     logger.info('running default task')
     return 'True'
 
 
-@shared_task(bind=True, name='adapter.confirm_rehive_tx.task', max_retries=24, default_retry_delay=60 * 60)
-def confirm_rehive_transaction(self, tx_id: int, tx_type: str):
+# parked counts how often a Rehive task was parked on the delay queue (see _rehive_post).
+@shared_task(bind=True, name='adapter.confirm_rehive_tx.task', max_retries=24)
+def confirm_rehive_transaction(self, tx_id: int, tx_type: str, currency: str = None, parked: int = 0):
     if tx_type == 'receive':
         tx = ReceiveTransaction.objects.get(id=tx_id)
     elif tx_type == 'send':
@@ -28,160 +136,167 @@ def confirm_rehive_transaction(self, tx_id: int, tx_type: str):
     else:
         raise TypeError('Invalid transaction type specified.')
 
-    logger.info('Transaction update request.')
-
-    # Update URL
-    url = getattr(settings, 'REHIVE_API_URL') + '/admins/transactions/update/'
+    _confirm_on_rehive(self, tx)
 
-    # Add Authorization headers
-    headers = {'Authorization': 'Token ' + getattr(settings, 'REHIVE_API_TOKEN')}
-
-    try:
-        # Make request
-        r = requests.post(url, json={'tx_code': tx.rehive_code, 'status': 'Confirmed'}, headers=headers)
-
-        if r.status_code in (200,201):
-            tx.rehive_response = r.json()
-            tx.status = 'Complete'
-            tx.save()
-        else:
-            logger.info(headers)
-            logger.info('Failed transaction update request: HTTP %s Error: %s' % (r.status_code, r.text))
-            tx.rehive_response = {'status': r.status_code, 'data': r.text}
-            tx.status = 'Failed'
-            tx.save()
 
-    except (requests.exceptions.RequestException, requests.exceptions.MissingSchema) as e:
-        try:
-            logger.info('Retry transaction update request due to connection error.')
-            self.retry(countdown=5 * 60, exc=PlatformRequestFailedError)
-        except PlatformRequestFailedError:
-            logger.info('Final transaction update request failure due to connection error.')
-
-
-@shared_task(bind=True, name='adapter.create_or_confirm_rehive_receive.task', max_retries=24, default_retry_delay=60 * 60)
-def create_or_confirm_rehive_receive(self, tx_id: int, confirm: bool=False):
+@shared_task(bind=True, name='adapter.create_or_confirm_rehive_receive.task', max_retries=24)
+def create_or_confirm_rehive_receive(self, tx_id: int, confirm: bool=False, currency: str = None,
+                                     parked: int = 0):
     tx = ReceiveTransaction.objects.get(id=tx_id)
     # If transaction has not yet been created, create it:
     if not tx.rehive_code:
-        url = getattr(settings, 'REHIVE_API_URL') + '/admins/transactions/receive/'
-        headers = {'Authorization': 'Token ' + getattr(settings, 'REHIVE_API_TOKEN')}
-
         try:
-            # Make request:
-            r = requests.post(url,
-                              json={'recipient': tx.user_account.rehive_id,
-                                    'amount': to_cents(tx.amount, 8),
-                                    'currency': tx.currency,
-                                    'issuer': tx.issuer,
-                                    'metadata': tx.metadata,
-                                    'from_reference': tx.external_id},
-                              headers=headers)
-
-            if r.status_code in (200, 201):
-                tx.rehive_response = r.json()
-                tx.rehive_code = tx.rehive_response['data']['tx_code']
-                tx.status = 'Pending'
-                tx.save()
-            else:
-                logger.info(headers)
-                logger.info('Failed transaction update request: HTTP %s Error: %s' % (r.status_code, r.text))
-                tx.status = 'Failed'
-                tx.rehive_response = {'status': r.status_code, 'data': r.text}
-                tx.save()
-
-        except (requests.exceptions.RequestException, requests.exceptions.MissingSchema) as e:
-            try:
-                logger.info('Retry transaction update request due to connection error.')
-                self.retry(countdown=5 * 60, exc=PlatformRequestFailedError)
-            except PlatformRequestFailedError:
-                logger.info('Final transaction update request failure due to connection error.')
+            # Not idempotent, Rehive creates a transaction per request:
+            r = _rehive_post(self, '/admins/transactions/receive/',
+                             {'recipient': tx.user_account.rehive_id,
+                              'amount': tx.amount,
+                              'currency': tx.currency,
+                              'issuer': tx.issuer,
+                              'metadata': tx.metadata,
+                              'from_reference': tx.external_id},
+                             idempotent=False)
+        except DependencyUnavailableError:
+            # Left Pending without a Rehive code, reconciliation uploads it later.
+            logger.warning('Rehive unavailable, transaction %s not created on Rehive.' % tx.id)
+            return
+        except PlatformRequestOutcomeUnknownError:
+            # Creating it again could credit the deposit twice, so it is failed for an operator to check:
+            logger.warning('Rehive create of transaction %s timed out, check Rehive for from_reference %s '
+                           'before repairing it.' % (tx.id, tx.external_id))
+            _set_status(tx, 'Failed', 'rehive:create:outcome_unknown', {})
+            return
+        except PlatformRequestFailedError:
+            logger.info('Final transaction create request failure.')
+            _set_status(tx, 'Failed', 'rehive:create:request_failed', {})
+            return
+
+        if r is None:
+            return
+        if r.status_code in (200, 201):
+            # Only record the Rehive code, the status may have moved on in the meantime:
+            tx.rehive_response = r.json()
+            tx.rehive_code = tx.rehive_response['data']['tx_code']
+            with transaction.atomic():
+                ReceiveTransaction.objects.filter(id=tx.id)\
+                    .update(rehive_code=tx.rehive_code, updated=timezone.now())
+                # Read after the update, which waits for a concurrent status change, so that a confirmation
+                # queued without the Rehive code (see upload_to_rehive) is done here:
+                tx.status = ReceiveTransaction.objects.filter(id=tx.id).values_list('status', flat=True).get()
+            tx.save_payloads()
+        else:
+            logger.info('Failed transaction create request: HTTP %s Error: %s' % (r.status_code, r.text))
+            _set_status(tx, 'Failed', 'rehive:create:%s' % r.status_code,
+                        {'status': r.status_code, 'data': r.text})
+            return
 
     # After creation, or if tx already exists, confirm it if necessary
-    if confirm:
-        logger.info('Transaction update request.')
-
-        # Update URL
-        url = getattr(settings, 'REHIVE_API_URL') + '/admins/transactions/update/'
-
-        # Add Authorization headers
-        headers = {'Authorization': 'Token ' + getattr(settings, 'REHIVE_API_TOKEN')}
-
-        try:
-            # Make request
-            r = requests.post(url, json={'tx_code': tx.rehive_code, 'status': 'Confirmed'}, headers=headers)
-
-            if r.status_code in (200, 201):
-                tx.rehive_response = r.json()
-                tx.status = 'Complete'
-                tx.save()
-            else:
-                logger.info(headers)
-                logger.info('Failed transaction update request: HTTP %s Error: %s' % (r.status_code, r.text))
-                tx.rehive_response = {'status': r.status_code, 'data': r.text}
-                tx.status = 'Failed'
-                tx.save()
-
-        except (requests.exceptions.RequestException, requests.exceptions.MissingSchema) as e:
-            try:
-                logger.info('Retry transaction update request due to connection error.')
-                self.retry(countdown=5 * 60, exc=PlatformRequestFailedError)
-            except PlatformRequestFailedError:
-                logger.info('Final transaction update request failure due to connection error.')
-
-
+    if confirm or tx.status == 'Confirmed':
+        _confirm_on_rehive(self, tx)
+
+
+@shared_task(name='adapter.reconcile_transactions.task')
+def reconcile_transactions(tx_type: str = 'receive', days: int = 7, auto_repair: bool = False):
+    """
+    Reconciles the recent transactions of a type against the blockchain and Rehive.
+    """
+    summary = Counter()
+    for mismatch in reconcile(tx_type, start=timezone.now() - timedelta(days=days), auto_repair=auto_repair,
+                              summary=summary):
+        logger.warning('Reconciliation mismatch: %s' % mismatch)
+    return dict(summary)
+
+
+@shared_task(bind=True, name='adapter.subscribe_to_receive_hooks.task', max_retries=24)
+def subscribe_to_receive_hooks(self, account_id: int):
+    """
+    Subscribes a user account to its receive webhooks, for subscriptions deferred while BlockCypher was failing.
+    """
+    account = UserAccount.objects.get(id=account_id)
+    try:
+        account.subscribe_to_hooks()
+    except (DependencyUnavailableError, requests.RequestException, KeyError) as exc:
+        countdown = max(get_breaker('blockcypher').remaining(), backoff(self.request.retries))
+        raise self.retry(countdown=countdown, exc=exc)
+
+
+@shared_task(name='adapter.sync_receive_webhooks.task')
+def sync_receive_webhooks(dry_run: bool = False):
+    """
+    Syncs the BlockCypher receive webhooks of every enabled coin, for use as a periodic task.
+    """
+    summary = Counter()
+    for code in coins.enabled():
+        subscriptions.sync(coins.COINS[code], dry_run=dry_run, summary=summary)
+    return dict(summary)
+
+
+@shared_task(name='adapter.scan_receive_addresses.task')
+def scan_receive_addresses():
+    """
+    Scans the addresses of accounts without hooks for deposits, for use as a periodic task (more often than the
+    webhook sync, deposits to these addresses are only found by it).
+    """
+    summary = Counter()
+    limiter = subscriptions.RateLimiter(getattr(settings, 'ADAPTER_HOOK_SYNC_RATE', 3))
+    for code in coins.enabled():
+        subscriptions.scan_unsubscribed(coins.COINS[code], limiter, summary=summary)
+    return dict(summary)
+
+
+@shared_task(name='adapter.check_address_gap.task')
+def check_address_gap():
+    """
+    Checks the address gaps of the receive MPKs, for use as a periodic task.
+    """
+    return gap.check()
+
+
+@shared_task(name='adapter.relay_outbox.task')
+def relay_outbox():
+    """
+    Drains the outbox, for use as a periodic task.
+    """
+    sent = total = relay()
+    while sent:
+        sent = relay()
+        total += sent
+    return total
+
+
+# The currency kwargs of the tasks are only used to route them to the coin's queue (see adapter.routers).
 @shared_task()
-def process_webhook_receive(webhook_type, receive_id, data):
-    logger.debug('Incoming: Blockcypher Unconfirmed: ID: %s', str(receive_id))
+def process_webhook_receive(webhook_type, receive_id, data, currency: str = None):
+    logger.debug('Incoming: Blockcypher %s: ID: %s' % (webhook_type, receive_id))
     user_account = UserAccount.objects.get(id=receive_id)
 
-    if webhook_type == 'confirmations':
-        logger.info('Confirmations webhook')
-        logger.info('Transaction: %s' % data['hash'])
-        # TODO: Check if this is 'malleability' proof:
-        if data['confirmations'] == 0:
-            logger.info('Zero Confirmations')
-            # Loop through outputs to count amount received:
-            amount_received = Decimal('0')
-            for o in data['outputs']:
-                output_addresses = tuple(o['addresses'])
-
-                # Bitcoin outputs usually have one address, but the API returns a tuple
-                if len(output_addresses) > 1:
-                    raise Exception('Bitcoin output has multiple addresses')
-
-                for address in output_addresses:
-                    if address == user_account.account_id:
-                        output_value = from_cents(o['value'], 8)
-                        amount_received += output_value
-
+    level = webhooks.event_level(webhook_type, data)
+    logger.info('%s webhook for transaction %s' % (webhook_type, data['hash']))
+    if level == webhooks.IGNORED:
+        return
+
+    # TODO: Check if this is 'malleability' proof:
+    tx = ReceiveTransaction.objects.filter(user_account=user_account, external_id=data['hash']).first()
+    with transaction.atomic():
+        # Also created by a confirming event, in case the unconfirmed event was coalesced or never arrived:
+        if tx is None:
+            logger.info('Creating transaction')
+            # Sum the outputs to the account, in satoshis:
+            amount_received = sum_outputs(data['outputs'], user_account.account_id)
             tx = ReceiveTransaction.objects.create(user_account=user_account,
                                                    amount=amount_received,
+                                                   divisibility=user_account.coin.divisibility,
+                                                   currency=user_account.currency,
                                                    external_id=data['hash'],
                                                    data=data,
                                                    status='Pending')
-
-            tx.upload_to_rehive()
-
-        elif data['confirmations'] >= 1:  # TODO: Make this customizable
-            logger.info('More than 1 confirmation')
-            tx = ReceiveTransaction.objects.get(external_id=data['hash'])
-            if tx.status not in ('Confirmed', 'Complete', 'Failed'):
-                logger.info('Confirming transaction')
-                tx.data = data
-                tx.status = 'Confirmed'
-                tx.save()
+            if level == webhooks.CREATE:
                 tx.upload_to_rehive()
+            user_account.touch()
 
-    elif webhook_type == 'confidence':
-        logger.info('Confidence webhook')
-        if data['confidence'] > 0.9:  # TODO: Make this customizable
-            logger.info('Greater than 90% confidence')
-            #  TODO: Check if this is 'malleability' proof:
-            tx = ReceiveTransaction.objects.get(external_id=data['hash'])
-            if tx.status not in ('Confirmed', 'Complete', 'Failed'):
-                logger.info('Confirming transaction')
-                tx.data = data
-                tx.status = 'Confirmed'
-                tx.save()
+        if level == webhooks.CONFIRM and tx.status not in ReceiveTransaction.TERMINAL_STATUSES:
+            logger.info('Confirming transaction')
+            if tx.transition('Confirmed', cause='webhook:%s' % webhook_type):
                 tx.upload_to_rehive()
+
+    if tx.status in ReceiveTransaction.TERMINAL_STATUSES:
+        webhooks.remember_status(receive_id, tx.external_id, tx.status)
@@ -1,3 +1,550 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from datetime import timedelta
+
+import requests
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import cache, fees, outbox, qr, reconciliation, resilience, subscriptions, webhooks
+from .amounts import from_units, parse_units, sum_outputs, to_units
+from .api import WebhookReceiveInterface
+from .coins import COINS, get_coin, queue_name
+from .exceptions import FeeTooHighError, InvalidAmountError, InvalidTransitionError, NotImplementedAPIError
+from .models import AdminAccount, OutboxMessage, ReceiveTransaction, ReceiveTransactionTransition, ReceiveWebhook, \
+    SendTransaction, TransactionPayload, UserAccount
+from .routers import TaskRouter
+from .views import UserAccountView, WebhookView
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AdminAccountRegistryTest(TestCase):
+    def setUp(self):
+        self.default = AdminAccount.objects.create(name='hot_wallet', default=True, secret={})
+        self.receive = AdminAccount.objects.create(name='receive_mpk', secret={'mpk': 'xpub'})
+        AdminAccount.objects.registry.invalidate()
+
+    def test_registry_loads_once(self):
+        with self.assertNumQueries(1):
+            AdminAccount.objects.get_cached(default=True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(AdminAccount.objects.get_cached(default=True).id, self.default.id)
+            self.assertEqual(AdminAccount.objects.get_cached(name='receive_mpk').id, self.receive.id)
+
+    def test_save_invalidates_registry(self):
+        AdminAccount.objects.get_cached(default=True)
+        self.default.rehive_id = 'admin'
+        self.default.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(AdminAccount.objects.get_cached(default=True).rehive_id, 'admin')
+
+    def test_delete_invalidates_registry(self):
+        AdminAccount.objects.get_cached(name='receive_mpk')
+        self.receive.delete()
+
+        with self.assertRaises(AdminAccount.DoesNotExist):
+            AdminAccount.objects.get_cached(name='receive_mpk')
+
+    def test_returned_accounts_are_copies(self):
+        account = AdminAccount.objects.get_cached(default=True)
+        account.secret['seed'] = 'changed'
+
+        with self.assertNumQueries(0):
+            self.assertNotIn('seed', AdminAccount.objects.get_cached(default=True).secret)
+
+    def test_send_transaction_create_does_not_query_admin_account(self):
+        AdminAccount.objects.get_cached(default=True)
+
+        with CaptureQueriesContext(connection) as context:
+            tx = SendTransaction.objects.create(recipient='address', currency='XBT')
+
+        self.assertEqual(tx.admin_account_id, self.default.id)
+        self.assertFalse([query for query in context.captured_queries
+                          if AdminAccount._meta.db_table in query['sql']])
+
+    def test_allocate_index(self):
+        self.assertIsNone(AdminAccount.objects.allocate_index(self.receive.id))
+        self.assertEqual(AdminAccount.objects.allocate_index(self.receive.id), 0)
+        self.assertEqual(AdminAccount.objects.allocate_index(self.receive.id), 1)
+
+        self.receive.refresh_from_db()
+        self.assertEqual(self.receive.secret['current_index'], 2)
+
+
+def _plan_nodes(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+# Indexes are created concurrently, which can't run inside the transaction of a TestCase.
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HotPathIndexTest(TransactionTestCase):
+    rows = 20000
+
+    def setUp(self):
+        call_command('tune_indexes', stdout=StringIO())
+
+        self.receive = AdminAccount.objects.create(name='receive_mpk', secret={})
+        AdminAccount.objects.bulk_create([AdminAccount(name='account_%s' % i, currency='C%s' % i, default=True)
+                                          for i in range(self.rows)])
+        UserAccount.objects.bulk_create([UserAccount(rehive_id='user_%s' % i, account_id='address_%s' % i,
+                                                     admin_account=self.receive) for i in range(self.rows)])
+        account_ids = list(UserAccount.objects.values_list('id', flat=True))
+        self.account_id = account_ids[0]
+        ReceiveTransaction.objects.bulk_create([ReceiveTransaction(user_account_id=account_ids[i % len(account_ids)],
+                                                                   external_id='hash_%s' % i, status='Pending')
+                                                for i in range(self.rows)])
+        ReceiveWebhook.objects.bulk_create([ReceiveWebhook(user_account_id=account_id, webhook_type='tx-confirmation',
+                                                           webhook_id='hook_%s' % account_id, callback_url='url')
+                                            for account_id in account_ids])
+        with connection.cursor() as cursor:
+            for model in (AdminAccount, UserAccount, ReceiveTransaction, ReceiveWebhook):
+                cursor.execute('ANALYZE %s' % model._meta.db_table)
+
+    def assertNoSeqScan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = [node['Relation Name'] for node in _plan_nodes(plan[0]['Plan']) if node['Node Type'] == 'Seq Scan']
+        self.assertFalse(scans, 'Sequential scan on %s for: %s' % (', '.join(scans), sql))
+
+    def test_hot_path_queries_use_indexes(self):
+        self.assertNoSeqScan(UserAccount.objects.filter(rehive_id='user_5', currency='XBT'))
+        self.assertNoSeqScan(ReceiveTransaction.objects.filter(user_account_id=self.account_id,
+                                                               external_id='hash_5').order_by('id')[:1])
+        self.assertNoSeqScan(AdminAccount.objects.filter(default=True, currency='XBT'))
+        self.assertNoSeqScan(AdminAccount.objects.filter(name='receive_mpk', currency='XBT'))
+        self.assertNoSeqScan(ReceiveWebhook.objects.filter(user_account_id=self.account_id))
+
+    def test_duplicate_user_accounts_are_rejected(self):
+        with self.assertRaises(IntegrityError):
+            UserAccount.objects.bulk_create([UserAccount(rehive_id='user_5', admin_account=self.receive)])
+
+    def test_duplicate_receive_transactions_are_rejected(self):
+        with self.assertRaises(IntegrityError):
+            ReceiveTransaction.objects.bulk_create([ReceiveTransaction(user_account_id=self.account_id,
+                                                                       external_id='hash_0')])
+
+
+def _set_address(account):
+    account.account_id = 'address_%s' % account.rehive_id
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   ADAPTER_HOOK_ACTIVATION='lazy')
+@mock.patch.object(UserAccount, '_new_account_id', autospec=True, side_effect=_set_address)
+@mock.patch.object(WebhookReceiveInterface, 'create_hook', autospec=True)
+class LazyHookActivationTest(TestCase):
+    def setUp(self):
+        AdminAccount.objects.create(name='receive_mpk', currency=get_coin().code, secret={'mpk': 'xpub'})
+        AdminAccount.objects.registry.invalidate()
+
+    def test_account_creation_does_not_subscribe(self, create_hook, new_account_id):
+        request = RequestFactory().post('/api/1/users/')
+        UserAccountView.render_account(request, 'user', get_coin())
+        UserAccountView.render_account(request, 'user', get_coin())
+
+        self.assertEqual(UserAccount.objects.filter(rehive_id='user').count(), 1)
+        self.assertFalse(create_hook.called)
+        self.assertFalse(ReceiveWebhook.objects.exists())
+
+    def test_activation_subscribes(self, create_hook, new_account_id):
+        create_hook.side_effect = lambda interface, event: ReceiveWebhook(user_account=interface.account,
+                                                                           webhook_type=event, webhook_id=event)
+        account = UserAccount.objects.create(rehive_id='user')
+
+        self.assertTrue(account.activate_hooks())
+        self.assertEqual(create_hook.call_count, len(WebhookReceiveInterface.SUBSCRIBED_EVENTS))
+        self.assertFalse(account.activate_hooks())
+
+
+@mock.patch('adapter.outbox.current_app')
+class OutboxTest(TransactionTestCase):
+    def test_enqueue_sends_after_commit(self, app):
+        with transaction.atomic():
+            outbox.enqueue('adapter.task', dedup_key='key', tx_id=1)
+            self.assertFalse(app.send_task.called)
+
+        app.send_task.assert_called_once_with('adapter.task', kwargs={'tx_id': 1})
+        self.assertIsNotNone(OutboxMessage.objects.get(dedup_key='key').dispatched)
+
+    def test_enqueue_sends_a_dedup_key_once(self, app):
+        outbox.enqueue('adapter.task', dedup_key='key', tx_id=1)
+        dispatched = OutboxMessage.objects.get(dedup_key='key').dispatched
+        outbox.enqueue('adapter.task', dedup_key='key', tx_id=2)
+
+        self.assertEqual(app.send_task.call_count, 1)
+        message = OutboxMessage.objects.get(dedup_key='key')
+        self.assertEqual((message.kwargs, message.dispatched), ({'tx_id': 1}, dispatched))
+        self.assertEqual(outbox.relay(), 0)
+
+    def test_enqueue_leaves_unsent_messages_to_the_relay(self, app):
+        app.send_task.side_effect = ConnectionError
+        outbox.enqueue('adapter.task', dedup_key='key', tx_id=1)
+
+        message = OutboxMessage.objects.get(dedup_key='key')
+        self.assertEqual((message.claimed, message.dispatched), (None, None))
+
+        app.send_task.side_effect = None
+        self.assertEqual(outbox.relay(), 1)
+        self.assertEqual(OutboxMessage.objects.get(dedup_key='key').attempts, 2)
+
+    def test_relay_releases_the_unsent_part_of_a_batch(self, app):
+        OutboxMessage.objects.bulk_create([OutboxMessage(task='adapter.task', dedup_key='key_%s' % i, kwargs={})
+                                           for i in range(3)])
+        app.send_task.side_effect = [None, ConnectionError]
+
+        with self.assertRaises(ConnectionError):
+            outbox.relay()
+        self.assertEqual(OutboxMessage.objects.filter(dispatched__isnull=False).count(), 1)
+        self.assertFalse(OutboxMessage.objects.filter(dispatched__isnull=True, claimed__isnull=False).exists())
+
+        app.send_task.side_effect = None
+        self.assertEqual(outbox.relay(), 2)
+
+    def test_relay_skips_claimed_messages_until_the_claim_expires(self, app):
+        message = OutboxMessage.objects.create(task='adapter.task', dedup_key='key', kwargs={},
+                                               claimed=timezone.now())
+        self.assertEqual(outbox.relay(), 0)
+
+        OutboxMessage.objects.filter(id=message.id).update(claimed=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(outbox.relay(), 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+@mock.patch('adapter.views.process_webhook_receive')
+class WebhookAdmissionTest(TestCase):
+    def post(self, data: dict):
+        request = RequestFactory().post('/api/1/webhook/confirmations/?id=1', data=json.dumps(data),
+                                        content_type='application/json')
+        return WebhookView.as_view()(request, hook_name='confirmations')
+
+    def test_duplicate_event_is_dropped(self, task):
+        data = {'hash': 'hash_duplicate', 'confirmations': 0}
+        self.post(data)
+        self.post(data)
+
+        self.assertEqual(task.delay.call_count, 1)
+
+    def test_confirmation_is_queued_after_creation(self, task):
+        self.post({'hash': 'hash_confirmed', 'confirmations': 0})
+        self.post({'hash': 'hash_confirmed', 'confirmations': 1})
+        self.post({'hash': 'hash_confirmed', 'confirmations': 0})
+
+        self.assertEqual(task.delay.call_count, 2)
+
+    def test_event_is_admitted_again_when_it_could_not_be_queued(self, task):
+        data = {'hash': 'hash_retried', 'confirmations': 0}
+        task.delay.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            self.post(data)
+
+        task.delay.side_effect = None
+        self.post(data)
+        self.assertEqual(task.delay.call_count, 2)
+        self.assertFalse(webhooks.admit('confirmations', '1', data))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReceiveTransactionStateMachineTest(TestCase):
+    def setUp(self):
+        admin_account = AdminAccount.objects.create(name='receive_mpk', secret={})
+        UserAccount.objects.bulk_create([UserAccount(rehive_id='user', account_id='address',
+                                                     admin_account=admin_account)])
+        self.tx = ReceiveTransaction.objects.create(user_account=UserAccount.objects.get(rehive_id='user'),
+                                                    external_id='hash', status='Pending')
+
+    def log(self):
+        return list(ReceiveTransactionTransition.objects.filter(transaction_id=self.tx.id).order_by('id')
+                    .values_list('from_status', 'to_status', 'cause'))
+
+    def test_creation_is_logged(self):
+        self.assertEqual(self.log(), [(None, 'Pending', 'created')])
+
+    def test_allowed_transitions(self):
+        self.assertTrue(self.tx.transition('Confirmed', cause='webhook'))
+        self.assertTrue(self.tx.transition('Complete', cause='rehive:confirm'))
+
+        self.assertEqual(ReceiveTransaction.objects.get(id=self.tx.id).status, 'Complete')
+        self.assertEqual(self.log(), [(None, 'Pending', 'created'), ('Pending', 'Confirmed', 'webhook'),
+                                      ('Confirmed', 'Complete', 'rehive:confirm')])
+
+    def test_failed_transactions_can_be_retried(self):
+        self.assertTrue(self.tx.transition('Failed'))
+        self.assertTrue(self.tx.transition('Pending', cause='reconcile'))
+
+    def test_denied_transitions(self):
+        with self.assertRaises(InvalidTransitionError):
+            self.tx.transition('Complete')
+        self.tx.transition('Confirmed')
+        self.tx.transition('Complete')
+        for status in ('Pending', 'Confirmed', 'Failed'):
+            with self.assertRaises(InvalidTransitionError):
+                self.tx.transition(status)
+
+        self.assertEqual(ReceiveTransaction.objects.get(id=self.tx.id).status, 'Complete')
+        self.assertEqual(len(self.log()), 3)
+
+    def test_conditional_update_loses_a_race(self):
+        stale = ReceiveTransaction.objects.get(id=self.tx.id)
+        self.assertTrue(self.tx.transition('Confirmed'))
+
+        self.assertFalse(stale.transition('Failed', cause='rehive:create:request_failed'))
+        self.assertEqual(ReceiveTransaction.objects.get(id=self.tx.id).status, 'Confirmed')
+        self.assertEqual(self.log(), [(None, 'Pending', 'created'), ('Pending', 'Confirmed', '')])
+
+    def test_extra_fields_are_updated(self):
+        self.tx.transition('Confirmed', rehive_code='code')
+
+        self.assertEqual(ReceiveTransaction.objects.get(id=self.tx.id).rehive_code, 'code')
+
+    def test_payloads_are_deleted_with_the_transaction(self):
+        self.tx.transition('Confirmed', data={'hash': 'hash'})
+        self.assertEqual(ReceiveTransaction.objects.get(id=self.tx.id).data, {'hash': 'hash'})
+
+        ReceiveTransaction.objects.filter(id=self.tx.id).delete()
+        self.assertFalse(TransactionPayload.objects.filter(tx_type='receive', tx_id=self.tx.id).exists())
+
+
+def _response(status: int, **headers) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers)
+    return response
+
+
+class ResilienceTest(TestCase):
+    def test_classify_responses(self):
+        self.assertEqual(resilience.classify(response=_response(201)), resilience.OK)
+        self.assertEqual(resilience.classify(response=_response(429)), resilience.RATE_LIMITED)
+        self.assertEqual(resilience.classify(response=_response(503)), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify(response=_response(408)), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify(response=_response(400)), resilience.PERMANENT)
+
+    def test_classify_exceptions(self):
+        self.assertEqual(resilience.classify(exc=requests.exceptions.ConnectionError()), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify(exc=requests.exceptions.ReadTimeout()), resilience.TRANSIENT)
+        self.assertEqual(resilience.classify(exc=requests.exceptions.InvalidURL()), resilience.PERMANENT)
+
+    def test_classify_timeouts_of_non_idempotent_requests(self):
+        self.assertEqual(resilience.classify(exc=requests.exceptions.ReadTimeout(), idempotent=False),
+                         resilience.UNKNOWN)
+        # Nothing was sent:
+        self.assertEqual(resilience.classify(exc=requests.exceptions.ConnectTimeout(), idempotent=False),
+                         resilience.TRANSIENT)
+
+    def test_retry_after(self):
+        self.assertEqual(resilience.retry_after(_response(429, **{'Retry-After': '120'})), 120)
+        self.assertIsNone(resilience.retry_after(_response(429)))
+        self.assertIsNone(resilience.retry_after(None))
+
+    @override_settings(ADAPTER_RETRY_BASE_DELAY=10, ADAPTER_RETRY_MAX_DELAY=60)
+    def test_backoff_is_capped(self):
+        with mock.patch('adapter.resilience.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([resilience.backoff(attempt) for attempt in range(5)], [10, 20, 40, 60, 60])
+        for attempt in range(10):
+            self.assertTrue(0 <= resilience.backoff(attempt) <= 60)
+
+    @mock.patch('adapter.resilience.time.monotonic', return_value=100.0)
+    def test_circuit_breaker(self, monotonic):
+        breaker = resilience.CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.remaining(), 30)
+
+        # Half open after the reset timeout: one trial request, a failure opens the circuit again.
+        monotonic.return_value = 130.0
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        monotonic.return_value = 160.0
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_bulkhead(self):
+        bulkhead = resilience.Bulkhead('test', size=1, timeout=0)
+        self.assertTrue(bulkhead.acquire())
+        self.assertFalse(bulkhead.acquire())
+        self.assertEqual(bulkhead.in_use, 1)
+        bulkhead.release()
+        self.assertTrue(bulkhead.acquire())
+
+
+class AmountsTest(TestCase):
+    def test_parse_units(self):
+        self.assertEqual(parse_units(5), 5)
+        self.assertEqual(parse_units(' 12 '), 12)
+        self.assertEqual(parse_units(Decimal('3.00')), 3)
+        for value in ('1.5', 'abc', 1.0, True, None):
+            with self.assertRaises(InvalidAmountError):
+                parse_units(value)
+
+    def test_to_units(self):
+        self.assertEqual(to_units('1.5', 8), 150000000)
+        self.assertEqual(to_units(Decimal('0.00000001'), 8), 1)
+        self.assertEqual(to_units(2, 0), 2)
+        for value, divisibility in (('0.000000001', 8), (1.5, 8), ('NaN', 8), ('1', 19)):
+            with self.assertRaises(InvalidAmountError):
+                to_units(value, divisibility)
+
+    def test_from_units(self):
+        self.assertEqual(from_units(150000000, 8), Decimal('1.5'))
+        self.assertEqual(to_units(from_units(123456789, 8), 8), 123456789)
+
+    def test_sum_outputs(self):
+        outputs = [{'addresses': ['address'], 'value': 5}, {'addresses': ['change'], 'value': 7},
+                   {'addresses': ['address'], 'value': 3}, {'addresses': None, 'value': 1}]
+        self.assertEqual(sum_outputs(outputs, 'address'), 8)
+        with self.assertRaises(InvalidAmountError):
+            sum_outputs([{'addresses': ['address', 'other'], 'value': 1}], 'address')
+
+
+@override_settings(ADAPTER_COINS=['XBT', 'LTC'], HOST_NAME='host',
+                   ADAPTER_TASK_QUEUES={'adapter.tasks.process_webhook_receive': 'webhooks'},
+                   ADAPTER_TASK_SHARDS={'adapter.tasks.process_webhook_receive': 4})
+class CoinRoutingTest(TestCase):
+    def test_coin_registry(self):
+        self.assertEqual(get_coin().code, 'XBT')
+        self.assertEqual(get_coin('LTC'), COINS['LTC'])
+        with self.assertRaises(NotImplementedAPIError):
+            get_coin('DOGE')
+
+    def test_queue_names(self):
+        self.assertEqual(queue_name('webhooks'), 'webhooks-host')
+        self.assertEqual(queue_name('webhooks', 'XBT'), 'webhooks-host')
+        self.assertEqual(queue_name('webhooks', 'LTC'), 'webhooks-ltc-host')
+
+    def test_shards_are_stable(self):
+        route = TaskRouter().route_for_task
+        task = 'adapter.tasks.process_webhook_receive'
+        # crc32 of the tx hash, the same in every process:
+        self.assertEqual(route(task, kwargs={'data': {'hash': 'hash_a'}, 'receive_id': 1}),
+                         {'queue': 'webhooks-host-2'})
+        self.assertEqual(route(task, kwargs={'data': {'hash': 'hash_b'}, 'receive_id': 1, 'currency': 'LTC'}),
+                         {'queue': 'webhooks-ltc-host-0'})
+        self.assertEqual(route(task, kwargs={'data': {}, 'receive_id': 7}), {'queue': 'webhooks-host-2'})
+        self.assertIsNone(route('adapter.other.task', kwargs={}))
+
+
+class ReconciliationDiffTest(TestCase):
+    def diff(self, status, rehive_code=None, confirmations=None, rehive_status=None, tx_type='receive'):
+        chain = {} if confirmations is None else {'hash': confirmations}
+        rehive = {} if rehive_status is None else {rehive_code: rehive_status}
+        return reconciliation.diff(tx_type, {'status': status, 'external_id': 'hash', 'rehive_code': rehive_code},
+                                   chain, rehive)
+
+    def test_agreeing_states(self):
+        self.assertIsNone(self.diff('Complete', 'code', 6, 'Complete'))
+        self.assertIsNone(self.diff('Pending', 'code', 0, 'Pending'))
+
+    def test_mismatches(self):
+        self.assertEqual(self.diff('Confirmed', 'code', None, 'Pending'), ('missing_on_chain', None))
+        self.assertEqual(self.diff('Pending', 'code', 2, 'Pending'), ('unconfirmed_locally', 'confirm'))
+        self.assertEqual(self.diff('Confirmed', None, 2), ('missing_on_rehive', 'upload'))
+        self.assertEqual(self.diff('Confirmed', 'code', 2), ('missing_on_rehive', None))
+        self.assertEqual(self.diff('Complete', 'code', 6, 'Pending'), ('not_complete_on_rehive', 'upload'))
+        self.assertEqual(self.diff('Failed', 'code', 0, 'Complete'), ('failed_locally', None))
+
+    def test_sends_are_only_reported(self):
+        self.assertEqual(self.diff('Complete', 'code', 6, 'Pending', tx_type='send'),
+                         ('not_complete_on_rehive', None))
+        self.assertIsNone(self.diff('Pending', None, 2, tx_type='send'))
+
+
+@override_settings(ADAPTER_HOOK_ACTIVATION='lazy')
+class SubscriptionPlanTest(TestCase):
+    def setUp(self):
+        admin_account = AdminAccount.objects.create(name='receive_mpk', secret={})
+        UserAccount.objects.bulk_create([UserAccount(rehive_id=rehive_id, account_id='address_%s' % rehive_id,
+                                                     admin_account=admin_account) for rehive_id in ('a', 'b')])
+        self.account = UserAccount.objects.get(rehive_id='a')
+        confidence, confirmation = WebhookReceiveInterface.SUBSCRIBED_EVENTS
+        ReceiveWebhook.objects.bulk_create([
+            ReceiveWebhook(user_account=self.account, webhook_type=confidence, webhook_id='hook', callback_url='url'),
+            ReceiveWebhook(user_account=self.account, webhook_type=confidence, webhook_id='duplicate',
+                           callback_url='url'),
+            ReceiveWebhook(user_account=self.account, webhook_type=confirmation, webhook_id='gone',
+                           callback_url='url'),
+        ])
+        self.remote = {'hook': {}, 'duplicate': {}, 'stray': {}}
+
+    def test_plan(self):
+        create, delete_hooks, delete_rows, unknown = subscriptions.plan(get_coin(), self.remote)
+
+        # Account b was never activated, the pruned confirmation hook of account a is created again:
+        self.assertEqual([(account.id, event) for account, event in create], [(self.account.id, 'tx-confirmation')])
+        self.assertEqual(len(delete_hooks), 1)
+        self.assertIn(delete_hooks[0], ('hook', 'duplicate'))
+        self.assertEqual(len(delete_rows), 2)
+        self.assertEqual(unknown, ['stray'])
+
+    @override_settings(ADAPTER_HOOK_ACTIVATION='eager')
+    def test_eager_plan_subscribes_every_account(self):
+        create, _, _, _ = subscriptions.plan(get_coin(), self.remote)
+
+        self.assertEqual(sorted(account.rehive_id for account, event in create), ['a', 'b', 'b'])
+
+    def test_dormant_accounts_are_unsubscribed(self):
+        UserAccount.objects.filter(id=self.account.id).update(last_activity=timezone.now() - timedelta(days=60))
+        create, delete_hooks, _, _ = subscriptions.plan(get_coin(), self.remote, dormant_after=timedelta(days=30))
+
+        self.assertEqual(create, [])
+        self.assertEqual(sorted(delete_hooks), ['duplicate', 'hook'])
+
+
+class QRCodeTest(TestCase):
+    def test_digest_is_keyed_on_format_and_size(self):
+        names = {qr.digest('bitcoin:address', size, fmt) for size in qr.SIZES for fmt in qr.FORMATS}
+        self.assertEqual(len(names), len(qr.SIZES) * len(qr.FORMATS))
+        with self.settings(SECRET_KEY='other'):
+            self.assertNotIn(qr.digest('bitcoin:address'), names)
+
+    def test_size_limits(self):
+        self.assertTrue(qr.renderable('bitcoin:address', 300))
+        self.assertFalse(qr.renderable('bitcoin:address', 301))
+        self.assertFalse(qr.renderable('', 300))
+        self.assertFalse(qr.renderable('x' * (qr.MAX_VALUE_LENGTH + 1), 300))
+        with self.assertRaises(ValueError):
+            qr.render('x' * (qr.MAX_VALUE_LENGTH + 1))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   ADAPTER_FEE_SOURCES=['adapter.fees.StaticFeeSource'],
+                   ADAPTER_FEE_STATIC_RATES={'high': 50000, 'medium': 25000, 'low': 10000},
+                   ADAPTER_FEE_DEFAULT_TIER='high', ADAPTER_FEE_MAX_PER_KB=30000)
+class FeeCapTest(TestCase):
+    def setUp(self):
+        cache.bump('fees')
+
+    def test_tiers_above_the_cap_are_stepped_down(self):
+        self.assertEqual(fees.select_tier(), ('medium', 25000))
+        self.assertEqual(fees.select_tier('low'), ('low', 10000))
+
+    def test_fees_above_the_cap_are_rejected(self):
+        size = fees.estimate_size(inputs=1, outputs=2)
+        fees.check_fee(30000 * size // 1000, size)
+        with self.assertRaises(FeeTooHighError):
+            fees.check_fee(30000 * size // 1000 + 1, size)
+
+    @override_settings(ADAPTER_FEE_MAX_PER_KB=0)
+    def test_no_cap(self):
+        fees.check_fee(10 ** 8, 250)
+        self.assertEqual(fees.select_tier(), ('high', 50000))
@@ -9,8 +9,12 @@ urlpatterns = (
     url(r'^deposit/$', views.DepositView.as_view(), name='deposit'),
     url(r'^send/$', views.SendView.as_view(), name='send'),
     url(r'^operating/balance/$', views.BalanceView.as_view(), name='operating_balance'),
+    url(r'^operating/fees/$', views.FeeEstimateView.as_view(), name='operating_fees'),
     url(r'^operating/account/$', views.OperatingAccountView.as_view(), name='operating_account'),
     url(r'^user/account/$', views.UserAccountView.as_view(), name='user_account'),
+    url(r'^export/transactions/$', views.TransactionExportView.as_view(), name='export_transactions'),
+    url(r'^qr/(?P<name>[0-9a-f]{32})\.(?P<fmt>svg|png)$', views.QRCodeView.as_view(), name='qr_code'),
+    url(r'^metrics/$', views.MetricsView.as_view(), name='metrics'),
     url(r'^hooks/(?P<hook_name>\w+)/$', views.WebhookView.as_view(), name='hooks'),
     url(r'^$', views.adapter_root)
 
@@ -1,6 +1,14 @@
 import json
 import urllib.parse
 from decimal import Decimal
+from logging import getLogger
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+
+from . import amounts
+
+logger = getLogger('django')
 
 
 def input_to_json(metadata):
@@ -14,16 +22,33 @@ def input_to_json(metadata):
 
 
 def to_cents(amount: Decimal, divisibility: int) -> int:
-    return int(amount * Decimal('10')**Decimal(divisibility))
+    """
+    Wrapper around amounts.to_units: raises InvalidAmountError instead of truncating sub-unit amounts.
+    """
+    return amounts.to_units(amount, divisibility)
 
 
 def from_cents(amount: int, divisibility: int) -> Decimal:
-    return Decimal(amount) / Decimal('10')**Decimal(divisibility)
-
-
-def create_qr_code_url(value, size=300):
-    url = "https://chart.googleapis.com/chart?%s" % urllib.parse.urlencode({'chs': size,
-                                                                            'cht': 'qr',
-                                                                            'chl': value,
-                                                                            'choe': 'UTF-8'})
-    return url
+    return amounts.from_units(amount, divisibility)
+
+
+def create_qr_code_url(value, size=300, request=None, fmt=None):
+    """
+    Returns the URL of the locally rendered QR code for a value (absolute if a request is given).
+    """
+    from . import qr
+
+    fmt = fmt or getattr(settings, 'ADAPTER_QR_FORMAT', 'svg')
+    base_url = getattr(settings, 'ADAPTER_QR_URL', '')
+    if base_url:
+        # Only stored codes are served from there, render it if it isn't yet:
+        try:
+            qr.get_or_render(value, size, fmt)
+        except OSError as exc:
+            logger.warning('Could not store QR code for %s: %s' % (value, exc))
+        return base_url.rstrip('/') + '/' + qr.filename(value, size, fmt)
+
+    # The value is passed along so that any host can render the code if it isn't stored locally:
+    url = '%s?%s' % (reverse('adapter-api:qr_code', kwargs={'name': qr.digest(value, size, fmt), 'fmt': fmt}),
+                     urllib.parse.urlencode({'chl': value, 'chs': size}))
+    return request.build_absolute_uri(url) if request is not None else url
@@ -4,16 +4,24 @@ from collections import OrderedDict
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.exceptions import APIException, ParseError, ValidationError
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import exceptions
 from rest_framework.generics import GenericAPIView
 from rest_framework.reverse import reverse
 from rest_framework.status import HTTP_200_OK, HTTP_404_NOT_FOUND
 from rest_framework.views import APIView
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.generic import View
 
+from . import cache, coins, fees, gap, metrics, qr, webhooks
+from .export import EXPORTS, FORMATS, export_lines, gzip_chunks, parse_time
 from .tasks import process_webhook_receive
-from .utils import from_cents, create_qr_code_url, input_to_json
+from .amounts import parse_units
+from .coins import COINS, DEFAULT_COIN, get_coin
+from .utils import create_qr_code_url, input_to_json
 from .api import Interface
+from .exceptions import DependencyUnavailableError, DuplicateRequestError, InvalidAmountError
 from .models import UserAccount, AdminAccount, SendTransaction
 from .permissions import AdapterGlobalPermission
 
@@ -120,24 +128,89 @@ class SendView(GenericAPIView):
         logger.info('Received send request')
         tx_code = request.data.get('tx_code')
         to_user = request.data.get('to_user')
-        amount = from_cents(request.data.get('amount'), 8)
+        try:
+            # Rehive amounts are integer units, stored as they are:
+            amount = parse_units(request.data.get('amount'))
+        except InvalidAmountError as exc:
+            raise ValidationError({'amount': [str(exc)]})
         currency = request.data.get('currency')
         issuer = request.data.get('issuer')
+        # Optional, e.g. {"fee_tier": "low"}:
+        metadata = input_to_json(request.data.get('metadata'))
 
         logger.debug(request.data)
         logger.info('To: ' + to_user)
         logger.info('Amount: ' + str(amount))
         logger.info('Currency: ' + currency)
 
-        tx = SendTransaction.objects.create(rehive_code=tx_code,
-                                            recipient=to_user,
-                                            amount=amount,
-                                            currency=currency,
-                                            issuer=issuer)
-        if tx.currency == 'XBT':
-            tx.execute()
-
-        return Response({'status': 'success'})
+        # Idempotency: a retried webhook for the same tx code must not send twice. The unique rehive_code
+        # of the SendTransaction is the claim, the cached result only answers retries without a query.
+        if tx_code:
+            result = cache.get('idempotency', 'send:%s' % tx_code)
+            if result:
+                logger.info('Duplicate send request %s.' % tx_code)
+                return Response(result)
+
+        coin = COINS[currency] if coins.is_enabled(currency) else None
+        fields = dict(recipient=to_user,
+                      amount=amount,
+                      divisibility=coin.divisibility if coin else 8,
+                      currency=currency,
+                      issuer=issuer,
+                      metadata=metadata)
+        if tx_code:
+            tx, created = SendTransaction.objects.get_or_create(rehive_code=tx_code, defaults=fields)
+            if not created and not self.claim_retry(tx):
+                return self.duplicate(tx)
+        else:
+            tx = SendTransaction.objects.create(**fields)
+
+        if coin:
+            try:
+                tx.execute()
+            except Exception as exc:
+                self.release(tx, exc)
+                raise
+
+        result = {'status': 'success'}
+        if tx_code:
+            cache.set('idempotency', 'send:%s' % tx_code, result)
+        return Response(result)
+
+    @staticmethod
+    def claim_retry(tx: SendTransaction) -> bool:
+        """
+        Claims a send that failed before anything was broadcast, so that it is retried once.
+        """
+        if tx.status != 'Failed' or tx.external_id:
+            return False
+        claimed = SendTransaction.objects.filter(id=tx.id, status='Failed', external_id=None)\
+            .update(status='Pending')
+        tx.status = 'Pending'
+        return bool(claimed)
+
+    @staticmethod
+    def duplicate(tx: SendTransaction) -> Response:
+        # Broadcast, or only recorded (currencies the adapter doesn't send):
+        if tx.external_id or not coins.is_enabled(tx.currency):
+            logger.info('Duplicate send request %s.' % tx.rehive_code)
+            result = {'status': 'success'}
+            cache.set('idempotency', 'send:%s' % tx.rehive_code, result)
+            return Response(result)
+        # Being sent, or its outcome is unknown:
+        raise DuplicateRequestError()
+
+    @staticmethod
+    def release(tx: SendTransaction, exc: Exception):
+        """
+        Settles the claim of a send that raised: failed if nothing can have been broadcast, so that it can
+        be retried, otherwise left pending to be checked against the chain.
+        """
+        if isinstance(exc, DependencyUnavailableError) or not getattr(tx, 'broadcasting', False):
+            tx.status = 'Failed'
+            tx.save()
+        else:
+            logger.error('Send %s failed while broadcasting, check it on chain before retrying: %s' % (tx.id, exc))
 
     def get(self, request, *args, **kwargs):
         raise exceptions.MethodNotAllowed('GET')
@@ -152,12 +225,30 @@ class BalanceView(APIView):
         raise exceptions.MethodNotAllowed('POST')
 
     def get(self, request, *args, **kwargs):
-        account = AdminAccount.objects.get(default=True)
+        coin = get_coin(request.GET.get('currency'))
+        account = AdminAccount.objects.get_cached(default=True, currency=coin.code)
         interface = Interface(account=account)
         balance = interface.get_balance()
         return Response({'balance': balance})
 
 
+class FeeEstimateView(APIView):
+    """
+    Current fee rates (units per kB) of the priority tiers of a coin (`currency` parameter),
+    and the tier sends use by default.
+    """
+    allowed_methods = ('GET',)
+    throttle_classes = (NoThrottling,)
+    permission_classes = (AdapterGlobalPermission,)
+
+    def get(self, request, *args, **kwargs):
+        coin = get_coin(request.GET.get('currency'))
+        rates = fees.get_rates(coin)
+        default_tier, _ = fees.select_tier(coin=coin)
+        return Response(OrderedDict([('tiers', OrderedDict((tier, rates[tier]) for tier in fees.TIERS)),
+                                     ('default', default_tier)]))
+
+
 class OperatingAccountView(APIView):
     allowed_methods = ('GET',)
     throttle_classes = (NoThrottling,)
@@ -167,13 +258,14 @@ class OperatingAccountView(APIView):
         raise exceptions.MethodNotAllowed('POST')
 
     def get(self, request, *args, **kwargs):
-        account = AdminAccount.objects.get(default=True)
+        coin = get_coin(request.GET.get('currency'))
+        account = AdminAccount.objects.get_cached(default=True, currency=coin.code)
         interface = Interface(account=account)
         account_id = interface.get_account_id()
 
         # TODO: move this details calculation to interface:
-        payment_uri = 'bitcoin:' + str(account_id)
-        qr_code = create_qr_code_url(payment_uri)
+        payment_uri = coins.payment_uri(coin, account_id)
+        qr_code = create_qr_code_url(payment_uri, request=request)
         details = {'payment_uri': payment_uri,
                    'qr_code': qr_code}
 
@@ -193,26 +285,122 @@ class UserAccountView(GenericAPIView):
         user_id = request.data.get('user_id')
         # Check if metadata is specified:
         metadata = input_to_json(request.data.get('metadata'))
+        coin = get_coin(request.data.get('currency'))
 
+        # Rehive asks for the account on every wallet view, repeats are served from the rendered response.
+        # Entries expire with the activity resolution, so that the account is touched on time:
+        key = '%s:%s:%s' % (coin.code, user_id, request.get_host())
+        content = cache.get_or_set('user_account', key, lambda: self.render_account(request, user_id, coin))
+        return HttpResponse(content, content_type='application/json')
+
+    @staticmethod
+    def render_account(request, user_id: str, coin) -> bytes:
         # Get Account ID:
-        user_account, created = UserAccount.objects.get_or_create(rehive_id=user_id)
+        user_account, created = UserAccount.objects.get_or_create(rehive_id=user_id, currency=coin.code)
+        if not created:
+            user_account.touch()
+        # Webhooks are only subscribed to once the address is used, see subscriptions.scan_unsubscribed.
         account_id = user_account.account_id
 
         logger.debug('AccountID: %s' % account_id)
 
         # TODO: move this details calculation to interface:
-        payment_uri = 'bitcoin:' + str(account_id)
-        qr_code = create_qr_code_url(payment_uri)
+        payment_uri = coins.payment_uri(coin, account_id)
+        qr_code = create_qr_code_url(payment_uri, request=request)
         details = {'payment_uri': payment_uri,
                    'qr_code': qr_code}
 
-        return Response(OrderedDict([('account_id', account_id),
-                                     ('details', details)]))
+        return JSONRenderer().render(OrderedDict([('account_id', account_id),
+                                                  ('details', details)]))
 
     def get(self, request, *args, **kwargs):
         raise exceptions.MethodNotAllowed('GET')
 
 
+class TransactionExportView(APIView):
+    """
+    Streams transactions for reconciliation.
+
+    Query parameters: `tx_type` (receive or send), `output` (ndjson or csv), `status`,
+    `start` and `end` (ISO dates on created), `account` and `compress` (gzip).
+    """
+    allowed_methods = ('GET',)
+    throttle_classes = (NoThrottling,)
+    permission_classes = (AdapterGlobalPermission,)
+
+    def post(self, request, *args, **kwargs):
+        raise exceptions.MethodNotAllowed('POST')
+
+    def get(self, request, *args, **kwargs):
+        tx_type = request.query_params.get('tx_type', 'receive')
+        output = request.query_params.get('output', 'ndjson')
+        if tx_type not in EXPORTS or output not in FORMATS:
+            raise ValidationError('Invalid tx_type or output.')
+
+        try:
+            lines = export_lines(tx_type,
+                                 output=output,
+                                 status=request.query_params.get('status'),
+                                 start=parse_time(request.query_params.get('start')),
+                                 end=parse_time(request.query_params.get('end')),
+                                 account=request.query_params.get('account'))
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        content_type = 'text/csv' if output == 'csv' else 'application/x-ndjson'
+        filename = '%s-transactions.%s' % (tx_type, output)
+        if request.query_params.get('compress') == 'gzip':
+            response = StreamingHttpResponse(gzip_chunks(lines), content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+
+class QRCodeView(View):
+    """
+    Serves locally rendered QR codes. Names are content hashes, so responses are cached forever.
+    A plain Django view, so that image Accept headers don't go through API content negotiation.
+    """
+    http_method_names = ['get', 'head']
+
+    def get(self, request, name, fmt, *args, **kwargs):
+        etag = '"%s"' % name
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=304)
+        else:
+            filename = '%s.%s' % (name, fmt)
+            content = qr.load(filename)
+            if content is None:
+                value = request.GET.get('chl', '')
+                try:
+                    size = int(request.GET.get('chs', 300))
+                except ValueError:
+                    raise Http404()
+                # Only codes the adapter linked to (e.g. precomputed on another host) are rendered:
+                if not qr.renderable(value, size) or qr.digest(value, size, fmt) != name:
+                    raise Http404()
+                content = qr.get_or_render(value, size, fmt)
+            response = HttpResponse(content, content_type=qr.FORMATS[fmt])
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+
+class MetricsView(APIView):
+    """
+    Adapter metrics of the serving process, in the Prometheus text format.
+    """
+    throttle_classes = (NoThrottling,)
+    permission_classes = (AdapterGlobalPermission,)
+
+    def get(self, request, *args, **kwargs):
+        gap.register_gauges()
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
+
+
 class WebhookView(APIView):
     allowed_methods = ('POST',)
     permission_classes = (AllowAny,)
@@ -228,9 +416,20 @@ class WebhookView(APIView):
         if not receive_id:
             raise Exception('Bad blockcypher post: no receive_id')
 
-        process_webhook_receive.delay(webhook_type=hook_name,
-                                      receive_id=receive_id,
-                                      data=data)
+        if not webhooks.admit(hook_name, receive_id, data):
+            logger.info('Webhook dropped, it adds nothing to events already processed.')
+            return Response({}, status=HTTP_200_OK)
+
+        try:
+            # Hooks created before coins were added have no currency, they are all for the default coin:
+            process_webhook_receive.delay(webhook_type=hook_name,
+                                          receive_id=receive_id,
+                                          data=data,
+                                          currency=request.GET.get('currency', DEFAULT_COIN))
+        except Exception:
+            # Fails the request so that BlockCypher retries it, the retry mustn't be coalesced away:
+            webhooks.release(hook_name, receive_id, data)
+            raise
 
         return Response({}, status=HTTP_200_OK)
 
@@ -0,0 +1,75 @@
+from django.conf import settings
+
+from . import cache, metrics
+
+# Coalescing of BlockCypher receive webhooks before they are queued.
+#
+# BlockCypher posts several events per transaction: the unconfirmed transaction, a confirmation event for every
+# new block up to the hook's depth and confidence updates. Only the first event of each kind changes anything,
+# so each event is ranked and an event is dropped when an event of the same or a higher rank was already queued
+# for the transaction within the coalescing window, or when the transaction already reached a terminal status.
+
+IGNORED, CREATE, CONFIRM = 0, 1, 2
+
+
+def event_level(webhook_type: str, data: dict) -> int:
+    """
+    What processing a webhook event can lead to: nothing, creating the transaction or confirming it.
+    """
+    if webhook_type == 'confirmations':
+        return CONFIRM if data.get('confirmations', 0) >= 1 else CREATE
+    if webhook_type == 'confidence':
+        threshold = getattr(settings, 'ADAPTER_WEBHOOK_CONFIDENCE_THRESHOLD', 0.9)
+        return CONFIRM if data.get('confidence', 0) > threshold else IGNORED
+    return IGNORED
+
+
+def _key(receive_id, tx_hash: str) -> str:
+    # A transaction can pay several accounts, so keys include the account:
+    return '%s:%s' % (receive_id, tx_hash)
+
+
+def remember_status(receive_id, tx_hash: str, status: str):
+    """
+    Caches the status of a transaction that reached a terminal status, so that later events are dropped.
+    """
+    if tx_hash:
+        cache.set('tx_status', _key(receive_id, tx_hash), status)
+
+
+def admit(webhook_type: str, receive_id, data: dict) -> bool:
+    """
+    Returns whether a webhook event needs processing, counting the outcome in the webhook metrics.
+    """
+    from .models import ReceiveTransaction
+
+    tx_hash = data.get('hash') if isinstance(data, dict) else None
+    if not tx_hash:
+        return True  # Left to the task to report.
+
+    key = _key(receive_id, tx_hash)
+    level = event_level(webhook_type, data)
+    window = getattr(settings, 'ADAPTER_WEBHOOK_COALESCE_WINDOW', 30)
+    if level == IGNORED:
+        result = 'ignored'
+    elif cache.get('tx_status', key) in ReceiveTransaction.TERMINAL_STATUSES:
+        result = 'terminal'
+    elif level < CONFIRM and cache.get('webhooks', '%s:%s' % (key, CONFIRM)):
+        result = 'coalesced'
+    # Atomic in Redis, so only one of several concurrent identical events is queued (None: Redis unavailable).
+    elif cache.add('webhooks', '%s:%s' % (key, level), 1, window) is False:
+        result = 'coalesced'
+    else:
+        result = 'queued'
+
+    metrics.inc('adapter_webhooks_total', webhook_type=webhook_type, result=result)
+    return result == 'queued'
+
+
+def release(webhook_type: str, receive_id, data: dict):
+    """
+    Forgets an admitted event that couldn't be queued, so that BlockCypher's retry of it is admitted.
+    """
+    tx_hash = data.get('hash') if isinstance(data, dict) else None
+    if tx_hash:
+        cache.delete('webhooks', '%s:%s' % (_key(receive_id, tx_hash), event_level(webhook_type, data)))
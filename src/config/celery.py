@@ -1,7 +1,10 @@
 from __future__ import absolute_import
 
 import os
+from logging import getLogger
+
 from celery import Celery
+from celery.signals import task_postrun, task_prerun, worker_init
 from django.conf import settings
 
 if not os.environ.get("DJANGO_SETTINGS_MODULE", ''):
@@ -14,3 +17,26 @@ app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
+
+
+# Celery's Django fixup closes expired connections around tasks, replace the ones dropped while idle too:
+@task_prerun.connect
+def check_db_connections(**kwargs):
+    from adapter import db
+    db.check_connections()
+
+
+@task_postrun.connect
+def mark_db_connections_healthy(**kwargs):
+    from adapter import db
+    db.mark_healthy()
+
+
+@worker_init.connect
+def check_db_connection_limit(sender=None, **kwargs):
+    from adapter import db
+    # Every pool process (or thread) keeps its own connection:
+    concurrency, limit = getattr(sender, 'concurrency', None), db.connection_limit('worker')
+    if limit and concurrency and concurrency > limit:
+        getLogger('django').warning('Worker concurrency %s exceeds the worker connection limit %s '
+                                    '(ADAPTER_DB_WORKER_CONNECTIONS).' % (concurrency, limit))
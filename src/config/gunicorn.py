@@ -3,9 +3,33 @@ import os
 
 bind = '0.0.0.0:8000'
 # bind = "127.0.0.1:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
+
+# "sync" serves one request per worker. The endpoints mostly wait on BlockCypher, Rehive and Postgres, "gevent"
+# workers serve up to worker_connections requests each while they wait (see the README for sizing).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+if worker_class == 'gevent':
+    # Gevent workers only need a process per core for the CPU bound part of the requests:
+    workers = multiprocessing.cpu_count() + 1
+else:
+    workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.environ.get('GUNICORN_WORKERS', workers))
+# Every sync worker keeps a persistent database connection, stay within the web role's connection limit:
+if int(os.environ.get('ADAPTER_DB_WEB_CONNECTIONS', 0)):
+    workers = min(workers, int(os.environ['ADAPTER_DB_WEB_CONNECTIONS']))
 name = os.environ.get('PROJECT_NAME')
 log_level = 'info'
 log_file = '-'
 pythonpath = '/app/'
 forwarded_allow_ips = '*'
+
+
+if worker_class == 'gevent':
+    # Without it every psycopg2 call blocks the worker and all of its requests, refuse to start instead:
+    from psycogreen.gevent import patch_psycopg
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 waits on Postgres in C, make it yield to other requests:
+        patch_psycopg()
@@ -0,0 +1,77 @@
+import os
+
+# Adapter tuning options.
+
+# Raw transaction payloads (blockchain data, Rehive requests/responses) are stored outside the transaction tables.
+# Payloads larger than the minimum size (in bytes) are zlib compressed when compression is enabled.
+ADAPTER_PAYLOAD_COMPRESSION = os.environ.get('ADAPTER_PAYLOAD_COMPRESSION', 'True') in ['True', True, 'true']
+ADAPTER_PAYLOAD_COMPRESSION_MIN_SIZE = int(os.environ.get('ADAPTER_PAYLOAD_COMPRESSION_MIN_SIZE', 512))
+
+# Pooled HTTP clients for the provider (BlockCypher) and platform (Rehive) APIs.
+ADAPTER_HTTP_POOL_SIZE = int(os.environ.get('ADAPTER_HTTP_POOL_SIZE', 20))
+ADAPTER_HTTP_TIMEOUT = float(os.environ.get('ADAPTER_HTTP_TIMEOUT', 10))
+
+# Reconciliation of adapter transactions against the blockchain and Rehive.
+ADAPTER_RECONCILE_CHUNK_SIZE = int(os.environ.get('ADAPTER_RECONCILE_CHUNK_SIZE', 1000))
+ADAPTER_RECONCILE_CHAIN_BATCH_SIZE = int(os.environ.get('ADAPTER_RECONCILE_CHAIN_BATCH_SIZE', 25))
+ADAPTER_RECONCILE_CONCURRENCY = int(os.environ.get('ADAPTER_RECONCILE_CONCURRENCY', 8))
+
+# Transactional outbox: messages written with the status change, relayed to the broker in batches.
+ADAPTER_OUTBOX_BATCH_SIZE = int(os.environ.get('ADAPTER_OUTBOX_BATCH_SIZE', 100))
+# Seconds after which a claimed but unsent message is sent again, e.g. when its relay died part way through.
+ADAPTER_OUTBOX_CLAIM_TIMEOUT = int(os.environ.get('ADAPTER_OUTBOX_CLAIM_TIMEOUT', 60))
+
+# Retry policy for provider and platform requests: exponential backoff with full jitter (seconds).
+ADAPTER_RETRY_BASE_DELAY = float(os.environ.get('ADAPTER_RETRY_BASE_DELAY', 30))
+ADAPTER_RETRY_MAX_DELAY = float(os.environ.get('ADAPTER_RETRY_MAX_DELAY', 60 * 60))
+
+# Circuit breakers: open after this many consecutive failures, allow a trial request after the reset timeout.
+ADAPTER_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('ADAPTER_BREAKER_FAILURE_THRESHOLD', 5))
+ADAPTER_BREAKER_RESET_TIMEOUT = float(os.environ.get('ADAPTER_BREAKER_RESET_TIMEOUT', 60))
+
+# Bulkheads: concurrent calls allowed per dependency and process, and how long to wait for a free slot (seconds).
+ADAPTER_BULKHEAD_SIZE = int(os.environ.get('ADAPTER_BULKHEAD_SIZE', 10))
+ADAPTER_BULKHEAD_TIMEOUT = float(os.environ.get('ADAPTER_BULKHEAD_TIMEOUT', 0.5))
+
+# QR codes are rendered locally and stored by content hash in ADAPTER_QR_DIR (default: CACHE_DIR/qr).
+# Set ADAPTER_QR_URL to a CDN or static URL that serves that directory to link to it instead of the QR endpoint.
+ADAPTER_QR_FORMAT = os.environ.get('ADAPTER_QR_FORMAT', 'svg')
+ADAPTER_QR_DIR = os.environ.get('ADAPTER_QR_DIR', '')
+ADAPTER_QR_URL = os.environ.get('ADAPTER_QR_URL', '')
+
+# Fee estimation: sources are tried in order until one returns rates (satoshis per kB) for every tier.
+# Sends use ADAPTER_FEE_DEFAULT_TIER unless the transaction metadata asks for another `fee_tier`. Tiers whose
+# rate is above ADAPTER_FEE_MAX_PER_KB (0: no cap) are stepped down to the fastest tier within the cap, and sends
+# whose fee is still above the cap for their size are rejected before they are signed.
+ADAPTER_FEE_SOURCES = os.environ.get('ADAPTER_FEE_SOURCES',
+                                     'adapter.fees.BlockCypherFeeSource,adapter.fees.StaticFeeSource').split(',')
+ADAPTER_FEE_STATIC_RATES = {
+    'high': int(os.environ.get('ADAPTER_FEE_STATIC_HIGH', 50000)),
+    'medium': int(os.environ.get('ADAPTER_FEE_STATIC_MEDIUM', 25000)),
+    'low': int(os.environ.get('ADAPTER_FEE_STATIC_LOW', 10000)),
+}
+ADAPTER_FEE_DEFAULT_TIER = os.environ.get('ADAPTER_FEE_DEFAULT_TIER', 'high')
+ADAPTER_FEE_MAX_PER_KB = int(os.environ.get('ADAPTER_FEE_MAX_PER_KB', 0))
+
+# Rehive currency codes served by this deployment (see adapter.coins), e.g. "XBT,LTC".
+ADAPTER_COINS = [code.strip() for code in os.environ.get('ADAPTER_COINS', 'XBT').split(',')]
+
+# Receive webhooks for a transaction that add nothing to an event queued within this many seconds are dropped.
+ADAPTER_WEBHOOK_COALESCE_WINDOW = int(os.environ.get('ADAPTER_WEBHOOK_COALESCE_WINDOW', 30))
+# Confidence events above this confidence confirm a receive transaction before its first confirmation.
+ADAPTER_WEBHOOK_CONFIDENCE_THRESHOLD = float(os.environ.get('ADAPTER_WEBHOOK_CONFIDENCE_THRESHOLD', 0.9))
+
+# Sync of BlockCypher receive webhooks (see adapter.subscriptions). Hooks of accounts without activity for
+# ADAPTER_HOOK_DORMANT_DAYS days are deleted (0 keeps them). BlockCypher allows 3 requests per second by default.
+ADAPTER_HOOK_DORMANT_DAYS = int(os.environ.get('ADAPTER_HOOK_DORMANT_DAYS', 90))
+ADAPTER_HOOK_SYNC_RATE = float(os.environ.get('ADAPTER_HOOK_SYNC_RATE', 3))
+ADAPTER_HOOK_SYNC_CONCURRENCY = int(os.environ.get('ADAPTER_HOOK_SYNC_CONCURRENCY', 8))
+ADAPTER_HOOK_PAGE_SIZE = int(os.environ.get('ADAPTER_HOOK_PAGE_SIZE', 200))
+# The addresses of accounts without hooks are scanned for deposits, this many per BlockCypher request.
+ADAPTER_ADDRESS_SCAN_BATCH_SIZE = int(os.environ.get('ADAPTER_ADDRESS_SCAN_BATCH_SIZE', 50))
+# Account activity is written at most once per this many seconds.
+ADAPTER_ACTIVITY_RESOLUTION = int(os.environ.get('ADAPTER_ACTIVITY_RESOLUTION', 60 * 60))
+# "lazy" subscribes user accounts to webhooks when a scan finds their address used, "eager" when they are created.
+ADAPTER_HOOK_ACTIVATION = os.environ.get('ADAPTER_HOOK_ACTIVATION', 'lazy')
+# Longest run of unused receive addresses before the address gap monitor warns (see adapter.gap).
+ADAPTER_GAP_LIMIT = int(os.environ.get('ADAPTER_GAP_LIMIT', 20))
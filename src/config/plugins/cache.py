@@ -0,0 +1,46 @@
+import os
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/1')
+
+# Shared cache. Redis errors are treated as cache misses, so the adapter keeps working without Redis.
+# Bump ADAPTER_CACHE_VERSION to invalidate every cached value at once.
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'adapter',
+        'VERSION': int(os.environ.get('ADAPTER_CACHE_VERSION', 1)),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+            'IGNORE_EXCEPTIONS': True,
+        },
+    }
+}
+
+# In-process L1 cache in front of Redis: max entries per process and how long (seconds) an entry may be served
+# without checking Redis. This bounds how stale an invalidated value can be in other processes.
+ADAPTER_CACHE_L1_SIZE = int(os.environ.get('ADAPTER_CACHE_L1_SIZE', 1024))
+ADAPTER_CACHE_L1_TTL = float(os.environ.get('ADAPTER_CACHE_L1_TTL', 5))
+
+# Seconds the in-process admin account registry is used before it is reloaded, even if no change was signalled.
+ADAPTER_ADMIN_ACCOUNT_TTL = int(os.environ.get('ADAPTER_ADMIN_ACCOUNT_TTL', 5 * 60))
+
+# How long (seconds) other callers wait for the value while one caller computes it after a miss.
+ADAPTER_CACHE_LOCK_TIMEOUT = float(os.environ.get('ADAPTER_CACHE_LOCK_TIMEOUT', 10))
+
+# Timeout (seconds) per cache namespace:
+ADAPTER_CACHE_TIMEOUTS = {
+    'balance': int(os.environ.get('ADAPTER_CACHE_BALANCE_TIMEOUT', 30)),
+    'fees': int(os.environ.get('ADAPTER_CACHE_FEES_TIMEOUT', 5 * 60)),
+    'operating_address': 24 * 60 * 60,
+    'idempotency': 24 * 60 * 60,
+    'tx_status': 24 * 60 * 60,
+    'address_gap': 24 * 60 * 60,
+    # Remote webhooks unknown to the database at the last sync, deleted if the next sync doesn't know them either:
+    'hook_sync': 7 * 24 * 60 * 60,
+    # Matches ADAPTER_ACTIVITY_RESOLUTION, account activity is recorded when an entry is rendered again:
+    'user_account': int(os.environ.get('ADAPTER_ACTIVITY_RESOLUTION', 60 * 60)),
+}
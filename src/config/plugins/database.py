@@ -1,5 +1,32 @@
 import os
 
+# Role of the process: web, admin, webhook-ingress, worker or relay (see the role profiles in settings.py).
+ADAPTER_ROLE = os.environ.get('ADAPTER_ROLE', 'web')
+# The admin and webhook ingress roles serve web requests and use the web connection settings:
+ADAPTER_DB_ROLE = {'admin': 'web', 'webhook-ingress': 'web'}.get(ADAPTER_ROLE, ADAPTER_ROLE)
+
+# Seconds a connection is kept open and reused across requests and tasks (0 closes it after each one).
+# Every web and worker process (thread) holds one, so connections scale with processes, not requests.
+# Gevent web workers run each request in a new greenlet with its own connection, which can't be reused:
+# they close connections after each request (pool them with PgBouncer instead).
+ADAPTER_DB_CONN_MAX_AGE = {
+    'web': int(os.environ.get('ADAPTER_DB_WEB_CONN_MAX_AGE',
+                              0 if os.environ.get('GUNICORN_WORKER_CLASS') == 'gevent' else 60)),
+    'worker': int(os.environ.get('ADAPTER_DB_WORKER_CONN_MAX_AGE', 5 * 60)),
+    'relay': int(os.environ.get('ADAPTER_DB_RELAY_CONN_MAX_AGE', 5 * 60)),
+}
+
+# Maximum connections per role, enforced by capping the gunicorn workers and warning about Celery concurrency
+# above it (0: no limit). Size them so that their sum stays below max_connections (or the PgBouncer pool).
+ADAPTER_DB_CONNECTIONS = {
+    'web': int(os.environ.get('ADAPTER_DB_WEB_CONNECTIONS', 0)),
+    'worker': int(os.environ.get('ADAPTER_DB_WORKER_CONNECTIONS', 0)),
+}
+
+# Persistent connections are checked (SELECT 1) before reuse when idle for longer than this many seconds,
+# so that connections dropped by Postgres, PgBouncer or the network are replaced instead of failing a request.
+ADAPTER_DB_HEALTH_CHECK_INTERVAL = float(os.environ.get('ADAPTER_DB_HEALTH_CHECK_INTERVAL', 30))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -7,6 +34,12 @@ DATABASES = {
         'USER': os.environ.get('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.environ.get('POSTGRES_PORT_5432_TCP_ADDR', 'postgres'),
-        'PORT': os.environ.get('POSTGRES_1_PORT_5432_TCP_PORT', '7654')
+        'PORT': os.environ.get('POSTGRES_1_PORT_5432_TCP_PORT', '7654'),
+        'CONN_MAX_AGE': ADAPTER_DB_CONN_MAX_AGE.get(ADAPTER_DB_ROLE, 60),
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('POSTGRES_CONNECT_TIMEOUT', 5)),
+            # Shows the role in pg_stat_activity (and in PgBouncer's SHOW CLIENTS):
+            'application_name': 'adapter-%s' % ADAPTER_ROLE,
+        },
     }
 }
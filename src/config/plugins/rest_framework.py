@@ -1,4 +1,5 @@
 import datetime
+import os
 
 from rest_framework.pagination import PageNumberPagination
 
@@ -33,6 +34,11 @@ REST_FRAMEWORK = {
     # 'EXCEPTION_HANDLER': 'wallet.exceptions.custom_exception_handler',
 }
 
+# The API only roles don't load the user auth apps, the adapter API authenticates with its secret instead
+# (see adapter.permissions):
+if os.environ.get('ADAPTER_ROLE', 'web') in ('webhook-ingress', 'worker', 'relay'):
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] = ()
+
 OLD_PASSWORD_FIELD_ENABLED = True
 LOGOUT_ON_PASSWORD_CHANGE= False
 
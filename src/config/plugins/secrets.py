@@ -3,8 +3,8 @@ import os
 # Check if debug variable is there to determine whether loaded
 env_vars_loaded = os.environ.get('DEBUG', '')
 
-# fallback for when env variables are not loaded:
-if not env_vars_loaded:
+# fallback for when env variables are not loaded, once: processes started from this one inherit the variables.
+if not env_vars_loaded and not os.environ.get('ADAPTER_LOCAL_ENV_LOADED'):
     try:
         print('Loading keys from file...')
         current_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -21,6 +21,7 @@ if not env_vars_loaded:
             if var:
                 k, v = var.split('=', maxsplit=1)
                 os.environ.setdefault(k, v)
+        os.environ['ADAPTER_LOCAL_ENV_LOADED'] = file_path
     except FileNotFoundError:
         print('environmental variables file not found')
         pass
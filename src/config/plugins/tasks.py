@@ -16,9 +16,22 @@ CELERY_DEFAULT_QUEUE = default_queue
 
 webhooks_queue = '-'.join(('webhooks', HOST_NAME))
 rehive_updates_queue = '-'.join(('rehive-updates', HOST_NAME))
-CELERY_ROUTES = {'adapter.tasks.process_webhook_receive': {'queue': webhooks_queue},
-                 'adapter.tasks.confirm_rehive_transaction': {'queue': rehive_updates_queue},
-                 'adapter.tasks.create_or_confirm_rehive_receive': {'queue': rehive_updates_queue}}
+
+# Tasks are parked here while the service they depend on is unavailable:
+ADAPTER_DELAY_QUEUE = '-'.join(('rehive-delayed', HOST_NAME))
+# Times a task is parked before it fails, each park lasts one to two circuit reset timeouts:
+ADAPTER_MAX_PARKED = int(os.environ.get('ADAPTER_MAX_PARKED', 48))
+
+# Base queue per task name. Tasks get a queue per coin (e.g. webhooks-ltc-<host>) and shard, see adapter.routers.
+ADAPTER_TASK_QUEUES = {'adapter.tasks.process_webhook_receive': 'webhooks',
+                       'adapter.confirm_rehive_tx.task': 'rehive-updates',
+                       'adapter.create_or_confirm_rehive_receive.task': 'rehive-updates'}
+
+# Number of shard queues per task, e.g. webhooks-<host>-0 ... webhooks-<host>-3. Each shard needs a worker with
+# --concurrency=1. Drain the queues before changing the count, so that no transaction's events are split.
+ADAPTER_TASK_SHARDS = {'adapter.tasks.process_webhook_receive': int(os.environ.get('ADAPTER_WEBHOOK_SHARDS', 1))}
+
+CELERY_ROUTES = ('adapter.routers.TaskRouter',)
 
 BROKER_TRANSPORT = 'sqs'
 BROKER_TRANSPORT_OPTIONS = {
@@ -19,6 +19,8 @@ from .plugins.rest_framework import *
 from .plugins.database import *
 from .plugins.tasks import *
 from .plugins.authentication import *
+from .plugins.adapter import *
+from .plugins.cache import *
 
 # LOGGING
 # ---------------------------------------------------------------------------------------------------------------------#
@@ -195,6 +197,34 @@ AUTH_USER_MODEL = 'administration.User'
 FORMAT_MODULE_PATH = 'config.formats'
 
 
+# Role profiles
+# ---------------------------------------------------------------------------------------------------------------------
+# Processes load only what their role (ADAPTER_ROLE) needs, which keeps startup fast for autoscaling and Celery.
+# "web" (the default) and "admin" load everything, "webhook-ingress" serves only the adapter API and "worker"
+# and "relay" serve no HTTP at all.
+if ADAPTER_ROLE in ('webhook-ingress', 'worker', 'relay'):
+    INSTALLED_APPS = [
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django.contrib.sites',
+
+        'rest_framework',
+
+        'administration',
+        'adapter',
+    ]
+    MIDDLEWARE_CLASSES = [
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+    ] if ADAPTER_ROLE == 'webhook-ingress' else []
+    ROOT_URLCONF = 'config.urls_api'
+    # Keep only the context processors of the apps loaded (and Django's own):
+    TEMPLATES[0]['OPTIONS']['context_processors'] = [
+        processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+        if processor.split('.context_processors.')[0] in INSTALLED_APPS + ['django.template']
+    ]
+
+
 # Email config
 # ---------------------------------------------------------------------------------------------------------------------
 EMAIL_BACKEND = 'django_ses_backend.SESBackend'
@@ -0,0 +1,6 @@
+from django.conf.urls import include, url
+
+# URLs of the API only roles (see the role profiles in settings.py): the adapter API without the admin site.
+urlpatterns = [
+    url(r'^api/1/', include('adapter.urls', namespace='adapter-api')),
+]